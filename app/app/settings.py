@@ -45,11 +45,15 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.ConcurrencyLimitMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'core.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
+    'django.middleware.http.ConditionalGetMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.middleware.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -88,6 +92,26 @@ DATABASES = {
     }
 }
 
+# Recipe data is sharded by user over 'default' and the aliases listed
+# in DB_SHARDS, each on DB_<ALIAS>_HOST/DB_<ALIAS>_NAME (see
+# core/sharding.py). Run init_shards once after migrating every alias.
+SHARDS = ['default'] + [
+    alias for alias in os.environ.get('DB_SHARDS', '').split(',') if alias
+]
+for alias in SHARDS[1:]:
+    DATABASES[alias] = {
+        **DATABASES['default'],
+        'HOST': os.environ.get(
+            f'DB_{alias.upper()}_HOST', DATABASES['default']['HOST']
+        ),
+        'NAME': os.environ.get(
+            f'DB_{alias.upper()}_NAME',
+            f"{DATABASES['default']['NAME']}_{alias}"
+        ),
+    }
+
+DATABASE_ROUTERS = ['core.sharding.ShardRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
@@ -125,6 +149,115 @@ USE_TZ = True
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/3.0/howto/static-files/
 
+# Cache
+# https://docs.djangoproject.com/en/3.0/topics/cache/
+# Throttle counters must live in a cache shared by all workers in
+# production, e.g. CACHE_BACKEND=django.core.cache.backends.memcached.
+# MemcachedCache and CACHE_LOCATION=memcached:11211
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get(
+            'CACHE_BACKEND',
+            'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.environ.get('CACHE_LOCATION', ''),
+    }
+}
+
+THROTTLE_CACHE = 'default'
+
+# core.models.AuthToken, a token expires after AUTH_TOKEN_TTL seconds
+# without use, its expiry is pushed forward at most once per interval
+AUTH_TOKEN_TTL = int(os.environ.get('AUTH_TOKEN_TTL', 14 * 24 * 3600))
+AUTH_TOKEN_REFRESH_INTERVAL = 3600
+AUTH_TOKEN_MAX_PER_USER = 10
+
+REST_FRAMEWORK = {
+    'DEFAULT_THROTTLE_CLASSES': [
+        'core.throttling.AnonRateThrottle',
+        'core.throttling.UserRateThrottle',
+        'core.throttling.EndpointRateThrottle',
+    ],
+    'DEFAULT_THROTTLE_RATES': {
+        'anon': os.environ.get('THROTTLE_ANON', '100/min'),
+        'user': os.environ.get('THROTTLE_USER', '1000/min'),
+        'recipe': '600/min',
+        'recipe.upload_image': '30/min',
+        'recipe.batch_edit': '60/min',
+        'user.create': '20/min',
+        'user.token': '30/min',
+    },
+}
+
+# Response compression, see core/middleware.py
+# brotli and zstd are used when the brotli / zstandard packages exist
+
+COMPRESSION_MIN_SIZE = 512
+COMPRESSION_LEVELS = {
+    'gzip': int(os.environ.get('COMPRESSION_GZIP_LEVEL', 6)),
+    'br': int(os.environ.get('COMPRESSION_BROTLI_LEVEL', 4)),
+    'zstd': int(os.environ.get('COMPRESSION_ZSTD_LEVEL', 3)),
+}
+
+# Background tasks, see core/taskqueue.py
+# Eager mode runs tasks inline instead of queuing them for run_worker
+
+TASKS_ALWAYS_EAGER = os.environ.get('TASKS_ALWAYS_EAGER') == '1'
+TASKS_RETRY_BACKOFF = 10
+TASKS_MAX_BACKOFF = 3600
+TASKS_LOCK_TIMEOUT = 600
+
+# seconds a sync cursor lags behind, covers transactions still open
+# when the changes are read
+SYNC_CURSOR_OVERLAP = 30
+
+# seconds a soft deleted user or recipe is kept before it is purged
+PURGE_DELAY = int(os.environ.get('PURGE_DELAY', 3600))
+
+# change events streamed from app.asgi, core.events.PostgresBackend
+# fans them out across processes with LISTEN/NOTIFY
+EVENTS_BACKEND = os.environ.get('EVENTS_BACKEND', 'core.events.LocalBackend')
+EVENTS_QUEUE_SIZE = 100
+EVENTS_HEARTBEAT = 15
+
+# seconds a shard move waits for in-flight requests, and the Retry-After
+# of writes refused meanwhile
+SHARD_MOVE_SETTLE = 2
+SHARD_MOVE_RETRY_AFTER = 5
+# seconds the shard map is cached for reads, a move waits that long
+# before removing the old rows
+SHARD_CACHE_SECONDS = 60
+# ids allocated per shard, shard k starts at k * SHARD_ID_SPAN
+SHARD_ID_SPAN = 10 ** 8
+# shards new users are spread over, leave a full shard out to stop
+# growing it, None spreads them over all SHARDS
+SHARD_NEW_USERS = None
+
+# adaptive in-flight limits per endpoint class, see core/concurrency.py
+# for the classes and routes, a shed request gets a 503
+CONCURRENCY_MAX_INFLIGHT = int(os.environ.get('CONCURRENCY_MAX_INFLIGHT', 64))
+CONCURRENCY_RETRY_AFTER = 1
+CONCURRENCY_EXEMPT_PATHS = ('/metrics/',)
+
+# staff can profile a request with an X-Profile header or ?profile=,
+# besides one in PROFILE_SAMPLE_EVERY requests is written to PROFILE_DIR
+PROFILE_SAMPLE_EVERY = int(os.environ.get('PROFILE_SAMPLE_EVERY', 0))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', '/vol/web/profiles')
+PROFILE_INTERVAL = 0.005
+PROFILE_FORMAT = 'collapsed'
+
+# queries slower than SLOW_QUERY_MS are sampled with their plan into
+# SLOW_QUERY_LOG, report them with the slow_queries command
+SLOW_QUERY_MS = float(os.environ['SLOW_QUERY_MS']) \
+    if os.environ.get('SLOW_QUERY_MS') else None
+SLOW_QUERY_SAMPLE_RATE = float(os.environ.get('SLOW_QUERY_SAMPLE_RATE', 0.1))
+SLOW_QUERY_LOG = os.environ.get('SLOW_QUERY_LOG', '/vol/web/slow_queries.log')
+
+# bearer token required to scrape /metrics/, open when empty
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+
 STATIC_URL = '/static/'
 MEDIA_URL = '/media/'
 
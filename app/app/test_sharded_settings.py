@@ -0,0 +1,30 @@
+"""Settings running the test suite against two shards
+
+    DJANGO_SETTINGS_MODULE=app.test_sharded_settings python manage.py test
+
+The second shard is a database next to the default one, the cache is
+file based so that core.E001 passes, sharding needs a shared cache.
+Tests of sharded models list both databases. New users stay on 'default',
+the tests of core/tests/test_sharding.py place theirs on 'shard1'.
+"""
+import os
+import tempfile
+
+from app.settings import *  # noqa: F401,F403
+from app.settings import DATABASES
+
+SHARDS = ['default', 'shard1']
+DATABASES['shard1'] = {
+    **DATABASES['default'],
+    'NAME': f"{DATABASES['default']['NAME']}_shard1",
+}
+SHARD_NEW_USERS = ['default']
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(
+            tempfile.gettempdir(), 'recipe-app-test-cache'
+        ),
+    }
+}
@@ -1,15 +1,111 @@
 from django.contrib import admin
+from django.contrib.admin.views.main import ERROR_FLAG, IGNORED_PARAMS, \
+    PAGE_VAR, SEARCH_VAR
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models.functions import Lower
+from django.utils.functional import cached_property
 
 from core import models
 
 
+class EstimatedCountPaginator(Paginator):
+    """Paginator using the planner's row estimate for unfiltered tables
+
+    A COUNT(*) over millions of rows takes seconds on PostgreSQL, the
+    estimate from pg_class is exact enough to render the page links.
+    ``filtered`` tells whether the changelist has filters or a search,
+    the queryset's own WHERE can not, managers like the soft delete one
+    always add a condition.
+    """
+    # below this many rows the exact count is cheap enough
+    estimate_threshold = 100000
+
+    def __init__(self, *args, filtered=False, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.filtered = filtered
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql' and not self.filtered:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT reltuples FROM pg_class WHERE relname = %s',
+                    [queryset.model._meta.db_table]
+                )
+                row = cursor.fetchone()
+            if row and row[0] >= self.estimate_threshold:
+                return int(row[0])
+        return super().count
+
+
+class EstimatedCountMixin:
+    """Use EstimatedCountPaginator for changelists without filters"""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_paginator(self, request, queryset, per_page, orphans=0,
+                      allow_empty_first_page=True):
+        ignored = IGNORED_PARAMS + (PAGE_VAR, ERROR_FLAG)
+        filtered = bool(request.GET.get(SEARCH_VAR, '').strip()) or any(
+            name not in ignored for name in request.GET
+        )
+        return self.paginator(
+            queryset, per_page, orphans, allow_empty_first_page,
+            filtered=filtered
+        )
+
+
+class PrefixSearchMixin:
+    """Case insensitive prefix search matching a lower(field) index"""
+    prefix_search_field = 'name'
+    search_fields = ('name',)
+
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        queryset = queryset.annotate(
+            search_key=Lower(self.prefix_search_field)
+        ).filter(search_key__startswith=search_term.lower())
+        return queryset, False
+
+
 class UserAdmin(BaseUserAdmin):
     ordering = ['id']
     list_display = ['email', 'name']
+    search_fields = ('email',)
+
+    def get_search_results(self, request, queryset, search_term):
+        """exact match on the unique email index, stored normalized"""
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        email = models.User.objects.normalize_email(search_term)
+        return queryset.filter(email=email), False
+
+
+class RecipeAttributeAdmin(EstimatedCountMixin, PrefixSearchMixin,
+                           admin.ModelAdmin):
+    list_display = ('name', 'user')
+    list_select_related = ('user',)
+    raw_id_fields = ('user',)
+
+
+class RecipeAdmin(EstimatedCountMixin, PrefixSearchMixin, admin.ModelAdmin):
+    list_display = ('title', 'user', 'price', 'time_minutes')
+    list_select_related = ('user',)
+    raw_id_fields = ('user',)
+    autocomplete_fields = ('tag', 'ingredient')
+    prefix_search_field = 'title'
+    search_fields = ('title',)
+    ordering = ('-id',)
 
 
 admin.site.register(models.User, UserAdmin)
-admin.site.register(models.Tag)
-admin.site.register(models.Ingredient)
-admin.site.register(models.Recipe)
+admin.site.register(models.Tag, RecipeAttributeAdmin)
+admin.site.register(models.Ingredient, RecipeAttributeAdmin)
+admin.site.register(models.Recipe, RecipeAdmin)
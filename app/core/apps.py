@@ -1,5 +1,21 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.utils.module_loading import autodiscover_modules
 
 
 class CoreConfig(AppConfig):
     name = 'core'
+
+    def ready(self):
+        # register the background tasks of every installed app
+        autodiscover_modules('tasks')
+
+        # connect the signal receivers maintaining stats and tombstones
+        # and announcing changes
+        from core import checks, events, stats, sync  # noqa: F401
+
+        # sample slow queries and their plans, see core/slow_queries.py
+        if getattr(settings, 'SLOW_QUERY_MS', None) is not None:
+            from core import slow_queries
+            connection_created.connect(slow_queries.install)
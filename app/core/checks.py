@@ -0,0 +1,32 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.checks import Error, Tags, Warning, register
+
+
+def cache_is_shared(alias='default'):
+    """False for a cache every process keeps to itself"""
+    return not isinstance(caches[alias], LocMemCache)
+
+
+@register(Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    """Shard map and per-process cache versions need a shared cache"""
+    if cache_is_shared():
+        return []
+    if len(getattr(settings, 'SHARDS', ['default'])) > 1:
+        return [Error(
+            'Sharding needs a cache shared by all processes.',
+            hint='Set CACHE_BACKEND to memcached or redis, shard moves '
+                 'are refused with a per-process cache.',
+            id='core.E001',
+        )]
+    if not settings.DEBUG:
+        return [Warning(
+            'The autocomplete and similarity caches are invalidated '
+            'through the default cache, with a per-process cache other '
+            'workers keep serving stale results.',
+            hint='Set CACHE_BACKEND to memcached or redis.',
+            id='core.W001',
+        )]
+    return []
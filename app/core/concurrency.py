@@ -0,0 +1,154 @@
+import re
+import threading
+import time
+
+from django.conf import settings
+
+from core import metrics
+
+
+DEFAULT_CLASSES = {
+    # share: part of CONCURRENCY_MAX_INFLIGHT the class may still be
+    # admitted into, lower priorities are shed first
+    'read': {'initial': 20, 'min': 4, 'max': 200, 'latency': 0.25,
+             'share': 1.0},
+    'write': {'initial': 10, 'min': 2, 'max': 100, 'latency': 0.5,
+              'share': 0.8},
+    'expensive': {'initial': 4, 'min': 1, 'max': 20, 'latency': 2.0,
+                  'share': 0.5},
+}
+
+DEFAULT_ROUTES = (
+    ('expensive', 'POST', r'^/api/recipe/recipe/\d+/upload-image/$'),
+    ('expensive', 'POST', r'^/api/recipe/recipe/batch-edit/$'),
+    ('expensive', 'POST', r'^/api/user/create/$'),
+)
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class AdaptiveLimit:
+    """In-flight limit adjusted by additive increase/multiplicative decrease
+
+    A request slower than the latency target, or failing, shrinks the
+    limit by ``backoff``, at most once per ``latency`` seconds: the
+    requests in flight when the service slowed down all complete slow
+    and would otherwise collapse the limit to its minimum at once. Fast
+    requests grow it by one per ``limit`` requests, but only while the
+    limit is actually being used.
+    """
+
+    def __init__(self, initial, minimum, maximum, latency, backoff=0.9):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency = latency
+        self.backoff = backoff
+        self.inflight = 0
+        self.shed = 0
+        self._decreased_at = None
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Take a slot, False when the limit is reached"""
+        with self._lock:
+            if self.inflight >= int(self.limit):
+                self.shed += 1
+                return False
+            self.inflight += 1
+            return True
+
+    def release(self, latency, failed=False, now=None):
+        """Return a slot and adapt the limit to how the request went"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            busy = self.inflight >= int(self.limit) / 2
+            self.inflight -= 1
+            if failed or latency > self.latency:
+                if self._decreased_at is None or \
+                        now - self._decreased_at >= self.latency:
+                    self.limit = max(self.minimum, self.limit * self.backoff)
+                    self._decreased_at = now
+            elif busy:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+    def reject(self):
+        with self._lock:
+            self.shed += 1
+
+
+class Limiter:
+    """Adaptive limits per endpoint class with priority based shedding
+
+    Every class has its own adaptive limit. On top of that, a class is
+    only admitted while the requests in flight across all classes stay
+    below its share of ``CONCURRENCY_MAX_INFLIGHT``, so uploads and
+    signups are refused before writes, and writes before reads.
+    """
+
+    def __init__(self, classes=None, routes=None, max_inflight=None):
+        classes = classes or getattr(
+            settings, 'CONCURRENCY_CLASSES', DEFAULT_CLASSES
+        )
+        routes = routes or getattr(
+            settings, 'CONCURRENCY_ROUTES', DEFAULT_ROUTES
+        )
+        self.max_inflight = max_inflight or getattr(
+            settings, 'CONCURRENCY_MAX_INFLIGHT', 64
+        )
+        self.shares = {name: conf['share'] for name, conf in classes.items()}
+        self.limits = {
+            name: AdaptiveLimit(
+                conf['initial'], conf['min'], conf['max'], conf['latency']
+            )
+            for name, conf in classes.items()
+        }
+        self.routes = [
+            (name, method, re.compile(pattern))
+            for name, method, pattern in routes
+        ]
+
+    def classify(self, method, path):
+        for name, route_method, pattern in self.routes:
+            if method == route_method and pattern.match(path):
+                return name
+        return 'read' if method in SAFE_METHODS else 'write'
+
+    def inflight(self):
+        return sum(limit.inflight for limit in self.limits.values())
+
+    def acquire(self, name):
+        limit = self.limits[name]
+        if self.inflight() >= self.max_inflight * self.shares[name]:
+            limit.reject()
+            return False
+        return limit.acquire()
+
+    def release(self, name, latency, failed=False):
+        self.limits[name].release(latency, failed)
+
+    def collect(self):
+        """samples for the metrics endpoint"""
+        classes = sorted(self.limits.items())
+        return [
+            ('api_concurrency_limit', 'Adaptive in-flight limit', 'gauge',
+             [({'class': name}, round(limit.limit, 2))
+              for name, limit in classes]),
+            ('api_concurrency_inflight', 'Requests in flight', 'gauge',
+             [({'class': name}, limit.inflight) for name, limit in classes]),
+            ('api_concurrency_shed_total', 'Requests shed with 503',
+             'counter',
+             [({'class': name}, limit.shed) for name, limit in classes]),
+        ]
+
+
+_limiter = None
+
+
+def limiter():
+    """The limiter of this process, exported to the metrics endpoint"""
+    global _limiter
+    if _limiter is None:
+        _limiter = Limiter()
+        metrics.register(_limiter.collect)
+    return _limiter
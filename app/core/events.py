@@ -0,0 +1,213 @@
+import asyncio
+import json
+import logging
+import select
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from core import sync
+from core.models import Tag, Ingredient, Recipe
+
+
+logger = logging.getLogger(__name__)
+
+# put in a subscriber's queue instead of the events it could not keep
+# up with, the client is expected to catch up with the sync endpoint
+RESYNC = {'type': 'resync'}
+
+
+class Subscription:
+    """Bounded queue of the events of one user for one connection
+
+    Filled from any thread, read from the event loop that created it.
+    """
+
+    def __init__(self, user_id, maxsize):
+        self.user_id = user_id
+        self.loop = asyncio.get_event_loop()
+        self.queue = asyncio.Queue(maxsize=maxsize)
+
+    def offer(self, event):
+        self.loop.call_soon_threadsafe(self._put, event)
+
+    def _put(self, event):
+        if self.queue.full():
+            # drop what the client has not read yet and let it resync
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            event = RESYNC
+        self.queue.put_nowait(event)
+
+    async def get(self):
+        return await self.queue.get()
+
+
+class LocalBackend:
+    """Deliver events to the subscribers of this process only"""
+
+    def __init__(self, deliver):
+        self.deliver = deliver
+
+    def publish(self, user_id, event):
+        self.deliver(user_id, event)
+
+    def listen(self):
+        pass
+
+
+class PostgresBackend:
+    """Fan events out to every process with LISTEN/NOTIFY
+
+    Each process serving subscriptions keeps one extra connection
+    listening on the channel from a daemon thread.
+    """
+    channel = 'recipe_events'
+
+    def __init__(self, deliver):
+        self.deliver = deliver
+        self._listening = False
+        self._lock = threading.Lock()
+
+    def publish(self, user_id, event):
+        payload = json.dumps({'user': user_id, 'event': event})
+        with connections['default'].cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)', [self.channel, payload])
+
+    def listen(self):
+        with self._lock:
+            if self._listening:
+                return
+            self._listening = True
+        threading.Thread(target=self._listen, daemon=True).start()
+
+    def _listen(self):
+        import psycopg2
+        from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+        params = settings.DATABASES['default']
+        while True:
+            try:
+                conn = psycopg2.connect(
+                    host=params['HOST'], dbname=params['NAME'],
+                    user=params['USER'], password=params['PASSWORD'],
+                    port=params.get('PORT') or None
+                )
+                conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+                conn.cursor().execute(f'LISTEN {self.channel}')
+                while True:
+                    select.select([conn], [], [], 5)
+                    conn.poll()
+                    while conn.notifies:
+                        message = json.loads(conn.notifies.pop(0).payload)
+                        self.deliver(message['user'], message['event'])
+            except Exception:
+                logger.exception('Event listener lost its connection')
+                time.sleep(1)
+
+
+class Broker:
+    """In-process publish/subscribe of per user change events"""
+
+    def __init__(self):
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+        self._backend = None
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            backend = getattr(
+                settings, 'EVENTS_BACKEND', 'core.events.LocalBackend'
+            )
+            self._backend = import_string(backend)(self.deliver)
+        return self._backend
+
+    def subscribe(self, user_id):
+        """Subscription of the calling event loop to a user's events"""
+        self.backend.listen()
+        subscription = Subscription(
+            user_id, getattr(settings, 'EVENTS_QUEUE_SIZE', 100)
+        )
+        with self._lock:
+            self._subscribers[user_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.user_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.user_id]
+
+    def publish(self, user_id, event):
+        self.backend.publish(user_id, event)
+
+    def deliver(self, user_id, event):
+        """Hand an event to this process' subscribers of the user"""
+        with self._lock:
+            subscribers = list(self._subscribers.get(user_id, ()))
+        for subscription in subscribers:
+            subscription.offer(event)
+
+
+broker = Broker()
+
+
+def publish_changes(user_id, kind, ids, action='saved', using=None):
+    """Announce changed rows of a user once the transaction commits
+
+    For writes that bypass the model signals, e.g. queryset updates.
+    """
+    def publish():
+        cursor = sync.next_cursor()
+        for object_id in ids:
+            broker.publish(user_id, {
+                'type': kind,
+                'id': object_id,
+                'action': action,
+                'cursor': cursor,
+            })
+    transaction.on_commit(publish, using=using)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+def _saved(sender, instance, using, raw=False, **kwargs):
+    if raw:
+        return
+    action = 'saved' if getattr(instance, 'deleted_at', None) is None \
+        else 'deleted'
+    publish_changes(
+        instance.user_id, sync.KINDS[sender], [instance.id], action, using
+    )
+
+
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def _deleted(sender, instance, using, **kwargs):
+    # soft deleted recipes were announced when they were flagged
+    if getattr(instance, 'deleted_at', None) is not None:
+        return
+    publish_changes(
+        instance.user_id, sync.KINDS[sender], [instance.id], 'deleted', using
+    )
+
+
+@receiver(m2m_changed, sender=Recipe.tag.through)
+@receiver(m2m_changed, sender=Recipe.ingredient.through)
+def _related_changed(sender, instance, action, reverse, pk_set, using,
+                     **kwargs):
+    if not action.startswith('post_'):
+        return
+    ids = [instance.id] if not reverse else list(pk_set or ())
+    publish_changes(instance.user_id, 'recipe', ids, using=using)
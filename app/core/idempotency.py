@@ -0,0 +1,138 @@
+import hashlib
+import hmac
+import json
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+from core.models import IdempotencyKey
+
+
+HEADER = 'HTTP_IDEMPOTENCY_KEY'
+TTL = timedelta(hours=getattr(settings, 'IDEMPOTENCY_KEY_HOURS', 24))
+# a request still in progress after this long is taken to have died
+LOCK_TIMEOUT = timedelta(
+    seconds=getattr(settings, 'IDEMPOTENCY_LOCK_SECONDS', 60)
+)
+
+
+def _scope(request, fingerprint):
+    """Keys are per user, anonymous keys per payload
+
+    Anonymous clients can not be told apart, scoping their keys by the
+    payload means a replay only returns a response to a client that sent
+    the very same request, e.g. the same signup with the same password.
+    """
+    if request.user.is_authenticated:
+        return f'user:{request.user.pk}'
+    return f'anon:{fingerprint[:32]}'
+
+
+def request_hash(request):
+    """Keyed fingerprint of the method, path and payload of a request
+
+    An HMAC with the secret key, the payload of a signup contains the
+    password and the fingerprint is kept for a day.
+    """
+    digest = hmac.new(settings.SECRET_KEY.encode(), digestmod=hashlib.sha256)
+    digest.update(f'{request.method} {request.path}'.encode())
+    data = request.data
+    items = data.lists() if hasattr(data, 'lists') else \
+        ((key, [value]) for key, value in data.items())
+    for key, values in sorted(items, key=lambda item: item[0]):
+        digest.update(key.encode())
+        for value in values:
+            if isinstance(value, UploadedFile):
+                for chunk in value.chunks():
+                    digest.update(chunk)
+                value.seek(0)
+            else:
+                digest.update(
+                    json.dumps(value, cls=JSONEncoder, sort_keys=True)
+                    .encode()
+                )
+    return digest.hexdigest()
+
+
+def prune(now=None):
+    """Delete keys past their time to live"""
+    now = now or timezone.now()
+    return IdempotencyKey.objects.filter(created_at__lt=now - TTL) \
+        .delete()[0]
+
+
+def idempotent(view_method):
+    """Replay the stored response for a repeated Idempotency-Key
+
+    The first request with a key runs normally and its response is
+    stored. Retries with the same key and payload get that response
+    without running the view again, the same key with another payload
+    is rejected with 422 and a retry racing the first request with 409.
+    Errors are not stored so the request can be retried, nor is the
+    placeholder of a worker that died, a retry takes it over after
+    IDEMPOTENCY_LOCK_SECONDS.
+    """
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.META.get(HEADER)
+        if not key:
+            return view_method(self, request, *args, **kwargs)
+
+        fingerprint = request_hash(request)
+        scope = _scope(request, fingerprint)
+        now = timezone.now()
+        IdempotencyKey.objects.filter(
+            Q(created_at__lt=now - TTL) |
+            Q(status_code__isnull=True, created_at__lt=now - LOCK_TIMEOUT),
+            scope=scope, key=key
+        ).delete()
+        try:
+            with transaction.atomic():
+                record = IdempotencyKey.objects.create(
+                    scope=scope, key=key, request_hash=fingerprint
+                )
+        except IntegrityError:
+            return _replay(scope, key, fingerprint)
+
+        try:
+            response = view_method(self, request, *args, **kwargs)
+        except Exception:
+            record.delete()
+            raise
+
+        if response.status_code >= 400:
+            record.delete()
+            return response
+        record.status_code = response.status_code
+        record.response_body = json.dumps(response.data, cls=JSONEncoder)
+        record.save(update_fields=['status_code', 'response_body'])
+        return response
+
+    return wrapper
+
+
+def _replay(scope, key, fingerprint):
+    record = IdempotencyKey.objects.filter(scope=scope, key=key).first()
+    if record is None or record.status_code is None:
+        return Response(
+            {'detail': 'A request with this Idempotency-Key is in progress.'},
+            status=status.HTTP_409_CONFLICT
+        )
+    if record.request_hash != fingerprint:
+        return Response(
+            {'detail': 'Idempotency-Key was used for a different request.'},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY
+        )
+    response = Response(
+        json.loads(record.response_body), status=record.status_code
+    )
+    response['Idempotent-Replayed'] = 'true'
+    return response
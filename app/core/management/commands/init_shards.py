@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from core import sharding
+
+
+class Command(BaseCommand):
+    """Give every shard its own range of recipe, tag and ingredient ids"""
+    requires_system_checks = False
+
+    def handle(self, *args, **options):
+        for alias in sharding.shards():
+            sharding.set_sequences(alias)
+        self.stdout.write(self.style.SUCCESS(
+            f'Initialized {len(sharding.shards())} shards'
+        ))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.migrations.loader import MigrationLoader
+
+from core import migration_lint
+
+
+class Command(BaseCommand):
+    """Flag migration operations that would block writes on big tables"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('app_label', nargs='*')
+        parser.add_argument(
+            '--all', action='store_true',
+            help='also check migrations listed in the baseline'
+        )
+
+    def handle(self, *args, **options):
+        loader = MigrationLoader(None, ignore_no_migrations=True)
+        app_labels = options['app_label'] or migration_lint.project_apps()
+        baseline = set() if options['all'] else \
+            migration_lint.load_baseline()
+
+        problems = migration_lint.lint(loader, app_labels, baseline)
+        for (app_label, name), problem in problems:
+            self.stdout.write(f'{app_label}.{name}: {problem}')
+        if problems:
+            raise CommandError(
+                f'{len(problems)} blocking operation(s) found'
+            )
+        self.stdout.write(self.style.SUCCESS('No blocking operations'))
@@ -0,0 +1,40 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from core import sharding
+
+
+class Command(BaseCommand):
+    """Move the recipe data of a user to another shard while online"""
+    requires_system_checks = False
+
+    def add_arguments(self, parser):
+        parser.add_argument('--email', required=True)
+        parser.add_argument('--to', required=True, help='target alias')
+        parser.add_argument(
+            '--batch-size', type=int, default=sharding.DEFAULT_BATCH_SIZE
+        )
+        parser.add_argument(
+            '--settle', type=float, default=None,
+            help='seconds to wait for in-flight requests, '
+                 'defaults to SHARD_MOVE_SETTLE'
+        )
+
+    def handle(self, *args, **options):
+        user = get_user_model().objects.filter(
+            email=options['email']
+        ).first()
+        if user is None:
+            raise CommandError(f'No user {options["email"]}')
+        source = sharding.shard_for(user.pk, fresh=True)
+        try:
+            moved = sharding.move_user(
+                user, options['to'], options['batch_size'],
+                options['settle']
+            )
+        except sharding.ShardMoveError as error:
+            raise CommandError(str(error))
+        self.stdout.write(self.style.SUCCESS(
+            f'Moved {moved} rows of {user.email} '
+            f'from {source} to {options["to"]}'
+        ))
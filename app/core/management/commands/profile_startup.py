@@ -0,0 +1,51 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import startup
+
+
+class Command(BaseCommand):
+    """Measure the import time of the entry points against their budget"""
+    requires_system_checks = False
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'targets', nargs='*', default=list(startup.TARGETS),
+            help='entry points to measure, defaults to all'
+        )
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument(
+            '--timeout', type=float, default=startup.TIMEOUT,
+            help='seconds a single run may take'
+        )
+        parser.add_argument(
+            '--write', action='store_true',
+            help=f'save the reports in {startup.REPORTS_DIR}'
+        )
+
+    def handle(self, *args, **options):
+        budgets = startup.load_budgets()
+        errors = []
+        for target in options['targets']:
+            if target not in startup.TARGETS:
+                raise CommandError(f'Unknown target {target}')
+            try:
+                elapsed, modules = startup.measure(
+                    target, options['repeat'], options['timeout']
+                )
+            except RuntimeError as error:
+                raise CommandError(str(error))
+            report = startup.format_report(target, elapsed, modules)
+            if options['write']:
+                os.makedirs(startup.REPORTS_DIR, exist_ok=True)
+                path = os.path.join(startup.REPORTS_DIR, f'{target}.txt')
+                with open(path, 'w') as output:
+                    output.write(report)
+            self.stdout.write(report.splitlines()[0])
+            errors.extend(startup.check_budget(
+                target, elapsed, modules, budgets.get(target, {})
+            ))
+        if errors:
+            raise CommandError('\n'.join(errors))
+        self.stdout.write(self.style.SUCCESS('Startup within budget'))
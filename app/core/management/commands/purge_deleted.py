@@ -0,0 +1,31 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from core import idempotency, purge, sync
+
+
+class Command(BaseCommand):
+    """Purge soft deleted users and recipes in bounded batches"""
+    requires_system_checks = False
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=purge.DEFAULT_BATCH_SIZE
+        )
+        parser.add_argument(
+            '--grace-hours', type=int, default=0,
+            help='only purge rows deleted at least this many hours ago'
+        )
+
+    def handle(self, *args, **options):
+        grace = timedelta(hours=options['grace_hours'])
+        batch_size = options['batch_size']
+        users = purge.purge_users(grace, batch_size)
+        recipes = purge.purge_recipes(grace, batch_size)
+        tombstones = sync.prune_tombstones()
+        idempotency.prune()
+        self.stdout.write(self.style.SUCCESS(
+            f'Purged {users} users, {recipes} recipes '
+            f'and {tombstones} tombstones'
+        ))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from core import purge
+
+
+class Command(BaseCommand):
+    """Delete expired auth tokens in bounded batches"""
+    requires_system_checks = False
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=purge.DEFAULT_BATCH_SIZE
+        )
+
+    def handle(self, *args, **options):
+        tokens = purge.purge_tokens(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Purged {tokens} expired tokens'
+        ))
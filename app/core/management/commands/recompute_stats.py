@@ -0,0 +1,28 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from core import sharding, stats
+
+
+class Command(BaseCommand):
+    """Rebuild the recipe statistics counters from the recipe tables"""
+    requires_system_checks = False
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--email', action='append', default=[],
+            help='only repair the given users, can be repeated'
+        )
+
+    def handle(self, *args, **options):
+        users = get_user_model().objects.filter(deleted_at__isnull=True)
+        if options['email']:
+            users = users.filter(email__in=options['email'])
+        count = 0
+        for user in users.iterator():
+            with sharding.for_user(user.id):
+                stats.recompute(user)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Recomputed stats for {count} users'
+        ))
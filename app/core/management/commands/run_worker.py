@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from core.taskqueue import Worker
+
+
+class Command(BaseCommand):
+    """Run queued background tasks"""
+    requires_system_checks = False
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--threads', type=int, default=1,
+            help='number of tasks run concurrently by this process'
+        )
+        parser.add_argument(
+            '--poll', type=float, default=1.0,
+            help='seconds to wait when the queue is empty'
+        )
+        parser.add_argument(
+            '--burst', action='store_true',
+            help='exit once the queue is empty'
+        )
+
+    def handle(self, *args, **options):
+        worker = Worker(
+            threads=options['threads'],
+            poll=options['poll'],
+            burst=options['burst']
+        )
+        self.stdout.write(f'Worker {worker.id} started')
+        worker.run()
+        self.stdout.write(self.style.SUCCESS('Worker stopped'))
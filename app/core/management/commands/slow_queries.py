@@ -0,0 +1,55 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core import slow_queries
+
+
+class Command(BaseCommand):
+    """Report the slowest query fingerprints and indexes they miss"""
+    requires_system_checks = False
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--log', default=getattr(settings, 'SLOW_QUERY_LOG', None)
+        )
+        parser.add_argument('--top', type=int, default=10)
+        parser.add_argument(
+            '--plans', action='store_true', help='print the captured plans'
+        )
+        parser.add_argument(
+            '--reset', action='store_true',
+            help='empty the log after reporting'
+        )
+
+    def handle(self, *args, **options):
+        path = options['log']
+        if not path or not os.path.exists(path):
+            raise CommandError(f'No slow query log at {path}')
+
+        groups = slow_queries.aggregate(slow_queries.read_log(path))
+        if not groups:
+            self.stdout.write('No slow queries recorded')
+        for rank, group in enumerate(groups[:options['top']], 1):
+            self.stdout.write(
+                f'{rank}. {group["fingerprint"]} '
+                f'{group["count"]}x total {group["total_ms"]:.1f}ms '
+                f'avg {group["total_ms"] / group["count"]:.1f}ms '
+                f'max {group["max_ms"]:.1f}ms'
+            )
+            self.stdout.write(f'   {group["sql"][:300]}')
+            for origin in sorted(group['origins']):
+                self.stdout.write(f'   from {origin}')
+            for table in dict.fromkeys(group['scans']):
+                self.stdout.write(f'   sequential scan of {table}')
+            for table, columns in group['suggestions']:
+                self.stdout.write(self.style.WARNING(
+                    f'   suggest AddIndexConcurrently on {table} '
+                    f'({", ".join(columns)})'
+                ))
+            if options['plans'] and group['plan'] is not None:
+                self.stdout.write(f'   plan: {group["plan"]}')
+
+        if options['reset']:
+            open(path, 'w').close()
@@ -6,6 +6,9 @@ from django.core.management.base import BaseCommand
 
 class Command(BaseCommand):
     """Django Database connection testing"""
+    # runs before every container start, the system checks import the
+    # whole URLconf and Pillow, leave them to runserver and migrate
+    requires_system_checks = False
 
     def handle(self, *args, **options):
         self.stdout.write('Waiting for database')
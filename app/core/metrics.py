@@ -0,0 +1,41 @@
+import threading
+
+
+_collectors = []
+_lock = threading.Lock()
+
+
+def register(collector):
+    """Add a callable returning (name, help, type, samples) tuples
+
+    ``samples`` is a list of (labels dict, value). Collectors are asked
+    for their values on every scrape.
+    """
+    with _lock:
+        if collector not in _collectors:
+            _collectors.append(collector)
+    return collector
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    pairs = ','.join(
+        '{}="{}"'.format(key, str(value).replace('"', '\\"'))
+        for key, value in sorted(labels.items())
+    )
+    return '{' + pairs + '}'
+
+
+def render():
+    """All registered metrics in the Prometheus text format"""
+    with _lock:
+        collectors = list(_collectors)
+    lines = []
+    for collector in collectors:
+        for name, help_text, kind, samples in collector():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in samples:
+                lines.append(f'{name}{_labels(labels)} {value}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,301 @@
+import itertools
+import logging
+import os
+import sys
+import time
+import zlib
+
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
+from django.utils.cache import patch_vary_headers
+from rest_framework.exceptions import AuthenticationFailed
+
+from core import concurrency, profiling
+from core.authentication import ExpiringTokenAuthentication
+
+try:
+    import brotli
+except ImportError:  # optional, gzip is always available
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # optional, gzip is always available
+    zstandard = None
+
+
+logger = logging.getLogger(__name__)
+
+
+class _GzipEncoder:
+    def __init__(self, level):
+        self._obj = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def chunk(self, data):
+        return self._obj.compress(data) + self._obj.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self, data=b''):
+        return self._obj.compress(data) + self._obj.flush()
+
+
+class _BrotliEncoder:
+    def __init__(self, level):
+        self._obj = brotli.Compressor(quality=level)
+
+    def chunk(self, data):
+        return self._obj.process(data) + self._obj.flush()
+
+    def finish(self, data=b''):
+        return self._obj.process(data) + self._obj.finish()
+
+
+class _ZstdEncoder:
+    def __init__(self, level):
+        self._obj = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def chunk(self, data):
+        return self._obj.compress(data) + \
+            self._obj.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self, data=b''):
+        return self._obj.compress(data) + self._obj.flush()
+
+
+def available_encoders():
+    """Encoders usable in this environment, most preferred first"""
+    encoders = []
+    if brotli is not None:
+        encoders.append(('br', _BrotliEncoder))
+    if zstandard is not None:
+        encoders.append(('zstd', _ZstdEncoder))
+    encoders.append(('gzip', _GzipEncoder))
+    return encoders
+
+
+def parse_accept_encoding(header):
+    """Map of coding to quality from an Accept-Encoding header"""
+    accepted = {}
+    for part in header.split(','):
+        coding, _, params = part.strip().partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[coding] = quality
+    return accepted
+
+
+class CompressionMiddleware:
+    """Negotiated brotli, zstd or gzip compression of responses
+
+    Responses shorter than ``COMPRESSION_MIN_SIZE`` are left alone and
+    ``COMPRESSION_LEVELS`` trades CPU for bytes per coding. Streaming
+    responses are compressed chunk by chunk, each chunk flushed so the
+    client can decode it right away.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.min_size = getattr(settings, 'COMPRESSION_MIN_SIZE', 512)
+        self.levels = {
+            'gzip': 6, 'br': 4, 'zstd': 3,
+            **getattr(settings, 'COMPRESSION_LEVELS', {}),
+        }
+        self.encoders = available_encoders()
+
+    def _choose(self, request):
+        accepted = parse_accept_encoding(
+            request.META.get('HTTP_ACCEPT_ENCODING', '')
+        )
+        best = None
+        for coding, encoder in self.encoders:
+            quality = accepted.get(coding, accepted.get('*', 0))
+            if quality > 0 and (best is None or quality > best[0]):
+                best = (quality, coding, encoder)
+        return best and best[1:]
+
+    def __call__(self, request):
+        response = self.get_response(request)
+
+        if not response.streaming and len(response.content) < self.min_size:
+            return response
+        if response.has_header('Content-Encoding'):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        chosen = self._choose(request)
+        if chosen is None:
+            return response
+        coding, encoder = chosen
+        level = self.levels[coding]
+
+        if response.streaming:
+            response.streaming_content = self._stream(
+                encoder(level), response.streaming_content
+            )
+            del response['Content-Length']
+        else:
+            compressed = encoder(level).finish(response.content)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response['Content-Length'] = str(len(compressed))
+
+        # the body differs from the one the strong ETag was made for
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = coding
+        return response
+
+    @staticmethod
+    def _stream(encoder, chunks):
+        for data in chunks:
+            compressed = encoder.chunk(data)
+            if compressed:
+                yield compressed
+        yield encoder.finish()
+
+
+class ConcurrencyLimitMiddleware:
+    """Shed load with a fast 503 once the adaptive limits are reached
+
+    Requests are classified by ``core.concurrency.Limiter``, refused
+    ones never reach a view or the database and carry a Retry-After of
+    ``CONCURRENCY_RETRY_AFTER`` seconds. Paths under
+    ``CONCURRENCY_EXEMPT_PATHS`` are never limited. A streaming response
+    does its work while it is sent, it keeps its slot until closed.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.limiter = concurrency.limiter()
+        self.retry_after = getattr(settings, 'CONCURRENCY_RETRY_AFTER', 1)
+        self.exempt = tuple(getattr(
+            settings, 'CONCURRENCY_EXEMPT_PATHS', ('/metrics/',)
+        ))
+
+    def __call__(self, request):
+        if request.path.startswith(self.exempt):
+            return self.get_response(request)
+
+        name = self.limiter.classify(request.method, request.path)
+        if not self.limiter.acquire(name):
+            response = JsonResponse(
+                {'detail': 'Server is busy, try again later.'}, status=503
+            )
+            response['Retry-After'] = str(self.retry_after)
+            return response
+
+        start = time.monotonic()
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            self.limiter.release(name, time.monotonic() - start, True)
+            raise
+        failed = response.status_code >= 500
+        if not response.streaming:
+            self.limiter.release(name, time.monotonic() - start, failed)
+            return response
+
+        close = response.close
+
+        def release_on_close():
+            # a second close must not release the slot again
+            response.close = close
+            try:
+                close()
+            finally:
+                self.limiter.release(name, time.monotonic() - start, failed)
+        response.close = release_on_close
+        return response
+
+
+class ProfilingMiddleware:
+    """Sampling profiles of single requests
+
+    Staff users get the profile of a request instead of its response
+    by sending ``X-Profile: collapsed|speedscope`` or ``?profile=``.
+    With ``PROFILE_SAMPLE_EVERY`` set, one in that many requests is
+    profiled and the profile written to ``PROFILE_DIR``. Otherwise a
+    request only pays for a header and a query string lookup.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.every = getattr(settings, 'PROFILE_SAMPLE_EVERY', 0)
+        self.directory = getattr(settings, 'PROFILE_DIR', '/tmp/profiles')
+        self.interval = getattr(settings, 'PROFILE_INTERVAL', 0.005)
+        self.format = getattr(settings, 'PROFILE_FORMAT', 'collapsed')
+        self.counter = itertools.count(1)
+
+    @staticmethod
+    def _is_staff(request):
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_staff:
+            return True
+        try:
+            auth = ExpiringTokenAuthentication().authenticate(request)
+        except AuthenticationFailed:
+            return False
+        return auth is not None and auth[0].is_staff
+
+    def _requested(self, request):
+        """the format asked for by a staff user, else None"""
+        fmt = request.META.get('HTTP_X_PROFILE')
+        if fmt is None and 'profile=' in request.META.get('QUERY_STRING', ''):
+            fmt = request.GET.get('profile')
+        if fmt in ('1', 'true'):
+            fmt = 'collapsed'
+        if fmt not in profiling.FORMATS or not self._is_staff(request):
+            return None
+        return fmt
+
+    def __call__(self, request):
+        fmt = self._requested(request)
+        sampled = (
+            fmt is None and self.every and
+            next(self.counter) % self.every == 0
+        )
+        if fmt is None and not sampled:
+            return self.get_response(request)
+
+        with profiling.Sampler(self.interval, sys._getframe()) as sampler:
+            response = self.get_response(request)
+            if fmt and response.streaming:
+                # the body is dropped anyway, profile producing it
+                for _ in response.streaming_content:
+                    pass
+
+        name = f'{request.method} {request.path}'
+        if fmt is None:
+            self._store(sampler, name, request)
+            return response
+
+        content, content_type, _ = profiling.render(sampler, fmt, name)
+        profile = HttpResponse(content, content_type=content_type)
+        profile['X-Profile-Status'] = str(response.status_code)
+        profile['X-Profile-Duration'] = f'{sampler.duration:.6f}'
+        profile['X-Profile-Queries'] = str(len(sampler.queries))
+        profile['X-Profile-SQL-Time'] = f'{sampler.sql_time:.6f}'
+        return profile
+
+    def _store(self, sampler, name, request):
+        content, _, extension = profiling.render(sampler, self.format, name)
+        slug = request.path.strip('/').replace('/', '_') or 'root'
+        filename = os.path.join(
+            self.directory,
+            f'{int(time.time() * 1000)}-{request.method}-{slug}.{extension}'
+        )
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(filename, 'w') as profile:
+                profile.write(content)
+        except OSError:
+            logger.exception('Could not write profile %s', filename)
@@ -0,0 +1,150 @@
+import json
+import os
+
+from django.apps import apps
+from django.conf import settings
+from django.db import migrations
+
+from core.migration_operations import AddIndexConcurrently, Backfill, \
+    RemoveIndexConcurrently
+
+
+BASELINE_PATH = os.path.join(
+    os.path.dirname(__file__), 'migration_baseline.json'
+)
+
+# field arguments that never change the database schema. Django 3.0
+# keeps no default in the database, it is only written when a column
+# is added or made NOT NULL, and changing null is reported anyway
+NON_DB_ATTRS = {
+    'auto_now', 'auto_now_add', 'blank', 'choices', 'default', 'editable',
+    'error_messages', 'help_text', 'limit_choices_to', 'on_delete',
+    'related_name', 'related_query_name', 'validators', 'verbose_name',
+}
+
+ONLINE_OPERATIONS = (AddIndexConcurrently, RemoveIndexConcurrently, Backfill)
+
+
+def load_baseline(path=BASELINE_PATH):
+    """Migrations that shipped before the check, keyed by app label"""
+    with open(path) as baseline:
+        return {
+            (app_label, name)
+            for app_label, names in json.load(baseline).items()
+            for name in names
+        }
+
+
+def project_apps():
+    """labels of the apps living in this repository"""
+    return [
+        config.label for config in apps.get_app_configs()
+        if config.path.startswith(settings.BASE_DIR)
+    ]
+
+
+def _db_kwargs(field):
+    _, _, _, kwargs = field.deconstruct()
+    return {
+        key: value for key, value in kwargs.items()
+        if key not in NON_DB_ATTRS
+    }
+
+
+def _check_field(field):
+    if field.many_to_many:
+        return None
+    if field.is_relation:
+        return 'adds a foreign key, its index and constraint lock the table'
+    if field.unique or field.db_index:
+        return 'adds an indexed column, add it plain then ' \
+            'AddIndexConcurrently'
+    if _has_db_default(field):
+        return 'adds a column with a default, PostgreSQL 10 rewrites ' \
+            'the table: add it nullable, Backfill it in batches'
+    return None
+
+
+def _has_db_default(field):
+    """whether AddField writes a DEFAULT, the rules of the schema editor"""
+    if field.has_default():
+        return True
+    if getattr(field, 'auto_now', False) or \
+            getattr(field, 'auto_now_add', False):
+        return True
+    return not field.null and field.blank and field.empty_strings_allowed
+
+
+def _drops_constraint_only(old, new):
+    """an AlterField dropping a foreign key constraint, metadata only"""
+    old_kwargs, new_kwargs = _db_kwargs(old), _db_kwargs(new)
+    dropped = old_kwargs.pop('db_constraint', True) and \
+        not new_kwargs.pop('db_constraint', True)
+    return dropped and old_kwargs == new_kwargs and type(old) is type(new)
+
+
+def lint_migration(migration, state):
+    """Problems of the operations of a migration that block writes
+
+    ``state`` is the project state before the migration. Operations on
+    models created by the same migration are fine, the table is empty.
+    """
+    atomic = getattr(migration, 'atomic', True)
+    created = {
+        op.name_lower for op in migration.operations
+        if isinstance(op, migrations.CreateModel)
+    }
+    problems = []
+    # AlterField compares with the state left by the previous operations
+    state = state.clone()
+
+    for op in migration.operations:
+        model = getattr(op, 'model_name_lower', None) or \
+            getattr(op, 'name_lower', None)
+        if model in created:
+            op.state_forwards(migration.app_label, state)
+            continue
+
+        problem = None
+        if isinstance(op, ONLINE_OPERATIONS):
+            if atomic:
+                problem = 'needs a migration with atomic = False'
+        elif isinstance(op, migrations.AddIndex):
+            problem = 'CREATE INDEX blocks writes, use AddIndexConcurrently'
+        elif isinstance(op, migrations.RemoveIndex):
+            problem = 'DROP INDEX blocks writes, use RemoveIndexConcurrently'
+        elif isinstance(op, migrations.AddField):
+            problem = _check_field(op.field)
+        elif isinstance(op, migrations.AlterField):
+            old = state.models[migration.app_label, model] \
+                .get_field_by_name(op.name)
+            changed = _db_kwargs(old) != _db_kwargs(op.field) or \
+                type(old) is not type(op.field)
+            if changed and not _drops_constraint_only(old, op.field):
+                problem = 'may rewrite the table under an exclusive lock'
+        elif isinstance(op, (migrations.AddConstraint,
+                             migrations.AlterUniqueTogether,
+                             migrations.AlterIndexTogether)):
+            problem = 'builds an index or validates rows under a lock'
+        elif isinstance(op, (migrations.RunPython, migrations.RunSQL)):
+            if atomic:
+                problem = 'holds its locks until the whole migration ' \
+                    'commits, use Backfill in a non-atomic migration'
+
+        if problem:
+            problems.append(f'{op.describe()}: {problem}')
+        op.state_forwards(migration.app_label, state)
+    return problems
+
+
+def lint(loader, app_labels, baseline=frozenset()):
+    """(migration key, problem) of the migrations not in the baseline"""
+    found = []
+    for key in sorted(loader.disk_migrations):
+        if key[0] not in app_labels or key in baseline:
+            continue
+        migration = loader.disk_migrations[key]
+        state = loader.project_state(key, at_end=False)
+        for problem in lint_migration(migration, state):
+            found.append((key, problem))
+    return found
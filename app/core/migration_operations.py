@@ -0,0 +1,223 @@
+"""Migration operations that do not block writes on large tables
+
+Use them in migrations with ``atomic = False``: PostgreSQL can not
+build an index concurrently inside a transaction, and a backfill should
+commit batch by batch. ``lint_migrations`` flags the operations that
+take long locks instead.
+"""
+import time
+
+from django.db import migrations, transaction
+
+
+def _is_postgresql(schema_editor):
+    return schema_editor.connection.vendor == 'postgresql'
+
+
+def _require_non_atomic(schema_editor, name):
+    if schema_editor.atomic_migration:
+        raise ValueError(f'{name} needs a migration with atomic = False')
+
+
+def drop_invalid_index(schema_editor, name):
+    """drop an index an interrupted concurrent build left invalid"""
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT 1 FROM pg_index JOIN pg_class '
+            'ON pg_class.oid = pg_index.indexrelid '
+            'WHERE pg_class.relname = %s AND NOT pg_index.indisvalid',
+            [name]
+        )
+        invalid = cursor.fetchone()
+    if invalid:
+        schema_editor.execute(
+            schema_editor.sql_delete_index_concurrently % {
+                'name': schema_editor.quote_name(name)
+            }
+        )
+
+
+def create_index_concurrently(schema_editor, name, table, columns):
+    """CREATE INDEX CONCURRENTLY from raw SQL, for expression indexes
+
+    Django 3.0 only builds indexes on plain fields, RunPython functions
+    of a migration with ``atomic = False`` use this for the others.
+    ``columns`` is the SQL between the parentheses.
+    """
+    _require_non_atomic(schema_editor, 'CREATE INDEX CONCURRENTLY')
+    drop_invalid_index(schema_editor, name)
+    schema_editor.execute(
+        f'CREATE INDEX CONCURRENTLY IF NOT EXISTS '
+        f'{schema_editor.quote_name(name)} ON '
+        f'{schema_editor.quote_name(table)} ({columns})'
+    )
+
+
+def drop_index_concurrently(schema_editor, name):
+    """DROP INDEX CONCURRENTLY, the reverse of create_index_concurrently"""
+    _require_non_atomic(schema_editor, 'DROP INDEX CONCURRENTLY')
+    schema_editor.execute(
+        schema_editor.sql_delete_index_concurrently % {
+            'name': schema_editor.quote_name(name)
+        }
+    )
+
+
+class AddIndexConcurrently(migrations.AddIndex):
+    """AddIndex built with CREATE INDEX CONCURRENTLY on PostgreSQL
+
+    An invalid index left behind by an interrupted build is dropped
+    first, so rerunning the migration resumes cleanly. Other databases
+    get a plain CREATE INDEX.
+    """
+    atomic = False
+
+    def database_forwards(self, app_label, schema_editor, from_state,
+                          to_state):
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if not self.allow_migrate_model(schema_editor.connection.alias,
+                                        model):
+            return
+        if not _is_postgresql(schema_editor):
+            schema_editor.add_index(model, self.index)
+            return
+        _require_non_atomic(schema_editor, self.__class__.__name__)
+        drop_invalid_index(schema_editor, self.index.name)
+        schema_editor.add_index(model, self.index, concurrently=True)
+
+    def database_backwards(self, app_label, schema_editor, from_state,
+                           to_state):
+        model = from_state.apps.get_model(app_label, self.model_name)
+        if not self.allow_migrate_model(schema_editor.connection.alias,
+                                        model):
+            return
+        if not _is_postgresql(schema_editor):
+            schema_editor.remove_index(model, self.index)
+            return
+        _require_non_atomic(schema_editor, self.__class__.__name__)
+        schema_editor.remove_index(model, self.index, concurrently=True)
+
+    def describe(self):
+        return (
+            f'Concurrently create index {self.index.name} on field(s) '
+            f'{", ".join(self.index.fields)} of model {self.model_name}'
+        )
+
+
+class RemoveIndexConcurrently(migrations.RemoveIndex):
+    """RemoveIndex dropped with DROP INDEX CONCURRENTLY on PostgreSQL"""
+    atomic = False
+
+    def database_forwards(self, app_label, schema_editor, from_state,
+                          to_state):
+        model = from_state.apps.get_model(app_label, self.model_name)
+        if not self.allow_migrate_model(schema_editor.connection.alias,
+                                        model):
+            return
+        from_model_state = from_state.models[app_label, self.model_name_lower]
+        index = from_model_state.get_index_by_name(self.name)
+        if not _is_postgresql(schema_editor):
+            schema_editor.remove_index(model, index)
+            return
+        _require_non_atomic(schema_editor, self.__class__.__name__)
+        schema_editor.remove_index(model, index, concurrently=True)
+
+    def database_backwards(self, app_label, schema_editor, from_state,
+                           to_state):
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if not self.allow_migrate_model(schema_editor.connection.alias,
+                                        model):
+            return
+        to_model_state = to_state.models[app_label, self.model_name_lower]
+        index = to_model_state.get_index_by_name(self.name)
+        if not _is_postgresql(schema_editor):
+            schema_editor.add_index(model, index)
+            return
+        _require_non_atomic(schema_editor, self.__class__.__name__)
+        schema_editor.add_index(model, index, concurrently=True)
+
+    def describe(self):
+        return f'Concurrently remove index {self.name} from {self.model_name}'
+
+
+class Backfill(migrations.operations.base.Operation):
+    """Fill a column in primary key ordered batches
+
+    Rows matching ``where`` (by default those where the field is still
+    NULL) are updated to ``value``, an expression or constant, one
+    committed batch at a time with ``pause`` seconds in between to leave
+    room for the application's writes. As done rows no longer match
+    ``where``, an interrupted backfill resumes where it stopped.
+    """
+    reversible = True
+    reduces_to_sql = False
+    atomic = False
+
+    def __init__(self, model_name, field, value, where=None,
+                 batch_size=1000, pause=0.1):
+        self.model_name = model_name
+        self.field = field
+        self.value = value
+        self.where = where
+        self.batch_size = batch_size
+        self.pause = pause
+
+    def deconstruct(self):
+        kwargs = {
+            'model_name': self.model_name,
+            'field': self.field,
+            'value': self.value,
+        }
+        if self.where is not None:
+            kwargs['where'] = self.where
+        if self.batch_size != 1000:
+            kwargs['batch_size'] = self.batch_size
+        if self.pause != 0.1:
+            kwargs['pause'] = self.pause
+        return (self.__class__.__name__, [], kwargs)
+
+    def state_forwards(self, app_label, state):
+        pass
+
+    def database_forwards(self, app_label, schema_editor, from_state,
+                          to_state):
+        model = to_state.apps.get_model(app_label, self.model_name)
+        alias = schema_editor.connection.alias
+        if not self.allow_migrate_model(alias, model):
+            return
+        if _is_postgresql(schema_editor):
+            _require_non_atomic(schema_editor, self.__class__.__name__)
+        self.run(model, alias)
+
+    def run(self, model, alias):
+        """update every pending row, return the number updated"""
+        pending = model._base_manager.using(alias)
+        if self.where is None:
+            pending = pending.filter(**{f'{self.field}__isnull': True})
+        else:
+            pending = pending.filter(self.where)
+
+        total, last = 0, None
+        while True:
+            batch = pending.order_by('pk')
+            if last is not None:
+                batch = batch.filter(pk__gt=last)
+            ids = list(batch.values_list('pk', flat=True)[:self.batch_size])
+            if not ids:
+                return total
+            with transaction.atomic(using=alias):
+                total += model._base_manager.using(alias).filter(
+                    pk__in=ids
+                ).update(**{self.field: self.value})
+            last = ids[-1]
+            if len(ids) < self.batch_size:
+                return total
+            if self.pause:
+                time.sleep(self.pause)
+
+    def database_backwards(self, app_label, schema_editor, from_state,
+                           to_state):
+        pass
+
+    def describe(self):
+        return f'Backfill {self.model_name}.{self.field} in batches'
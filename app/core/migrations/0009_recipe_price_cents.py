@@ -0,0 +1,34 @@
+# Generated by Django 3.0.14 on 2026-10-19 12:59
+
+from django.db import migrations, models
+from django.db.models import F, IntegerField
+from django.db.models.functions import Cast, Round
+
+from core.migration_operations import AddIndexConcurrently, Backfill
+
+
+class Migration(migrations.Migration):
+    # the backfill commits batch by batch and the index is built
+    # concurrently, neither can run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('core', '0008_task'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='price_cents',
+            field=models.IntegerField(null=True),
+        ),
+        Backfill(
+            model_name='recipe',
+            field='price_cents',
+            value=Cast(Round(F('price') * 100), IntegerField()),
+        ),
+        AddIndexConcurrently(
+            model_name='recipe',
+            index=models.Index(fields=['user', 'time_minutes', 'price_cents'], name='core_recipe_user_id_c1f695_idx'),
+        ),
+    ]
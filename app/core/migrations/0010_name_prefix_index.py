@@ -0,0 +1,38 @@
+from django.db import migrations
+
+from core.migration_operations import create_index_concurrently, \
+    drop_index_concurrently
+
+
+TABLES = ('core_tag', 'core_ingredient')
+
+
+def create_indexes(apps, schema_editor):
+    # expression indexes need Django 3.2, create them by hand on PostgreSQL
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for table in TABLES:
+        create_index_concurrently(
+            schema_editor, f'{table}_user_lower_name_idx', table,
+            'user_id, lower(name) varchar_pattern_ops'
+        )
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for table in TABLES:
+        drop_index_concurrently(schema_editor, f'{table}_user_lower_name_idx')
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY can not run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('core', '0009_recipe_price_cents'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
@@ -0,0 +1,42 @@
+from django.db import migrations
+
+from core.migration_operations import create_index_concurrently, \
+    drop_index_concurrently
+
+
+INDEXES = (
+    ('core_tag', 'name'),
+    ('core_ingredient', 'name'),
+    ('core_recipe', 'title'),
+)
+
+
+def create_indexes(apps, schema_editor):
+    # expression indexes need Django 3.2, create them by hand on PostgreSQL
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for table, column in INDEXES:
+        create_index_concurrently(
+            schema_editor, f'{table}_lower_{column}_idx', table,
+            f'lower({column}) varchar_pattern_ops'
+        )
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for table, column in INDEXES:
+        drop_index_concurrently(schema_editor, f'{table}_lower_{column}_idx')
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY can not run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('core', '0010_name_prefix_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
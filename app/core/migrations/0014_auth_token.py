@@ -0,0 +1,57 @@
+# Generated by Django 3.0.14 on 2026-10-19 13:28
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from datetime import timedelta
+from django.utils import timezone
+
+
+BATCH_SIZE = 1000
+
+
+def copy_legacy_tokens(apps, schema_editor):
+    """keep existing clients logged in, their tokens now expire
+
+    Every batch commits on its own, a rerun skips the copied tokens.
+    """
+    alias = schema_editor.connection.alias
+    Token = apps.get_model('authtoken', 'Token')
+    AuthToken = apps.get_model('core', 'AuthToken')
+    expires = timezone.now() + timedelta(seconds=settings.AUTH_TOKEN_TTL)
+    tokens = Token.objects.using(alias).order_by('pk') \
+        .values_list('key', 'user_id')
+    batch = []
+    for key, user_id in tokens.iterator():
+        batch.append(AuthToken(key=key, user_id=user_id, expires=expires))
+        if len(batch) == BATCH_SIZE:
+            AuthToken.objects.using(alias).bulk_create(
+                batch, ignore_conflicts=True
+            )
+            batch = []
+    AuthToken.objects.using(alias).bulk_create(batch, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+    # the copy commits batch by batch instead of holding its locks
+    # until all tokens are copied
+    atomic = False
+
+    dependencies = [
+        ('core', '0013_sharding'),
+        ('authtoken', '0002_auto_20160226_1747'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuthToken',
+            fields=[
+                ('key', models.CharField(max_length=40, primary_key=True, serialize=False)),
+                ('device', models.CharField(blank=True, max_length=64)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('expires', models.DateTimeField(db_index=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='auth_tokens', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.RunPython(copy_legacy_tokens, migrations.RunPython.noop),
+    ]
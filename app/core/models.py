@@ -1,9 +1,13 @@
 import uuid
 import os
+import secrets
+from datetime import timedelta
+from decimal import Decimal, ROUND_HALF_UP
 from django.db import models
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, \
     PermissionsMixin
 from django.conf import settings
+from django.utils import timezone
 
 
 def recipe_image_file_path(instance, filename):
@@ -14,6 +18,39 @@ def recipe_image_file_path(instance, filename):
     return os.path.join('upload/recipe/', filename)
 
 
+def price_to_cents(price):
+    """Integer cents of a decimal, float or string price"""
+    return int((Decimal(str(price)) * 100).to_integral_value(ROUND_HALF_UP))
+
+
+def cents_to_str(cents):
+    """Two decimals string of a price in cents, without using Decimal"""
+    sign = '-' if cents < 0 else ''
+    cents = abs(cents)
+    return f'{sign}{cents // 100}.{cents % 100:02d}'
+
+
+class SoftDeleteQuerySet(models.QuerySet):
+    """Queryset for models that are flagged deleted before being purged"""
+
+    def alive(self):
+        return self.filter(deleted_at__isnull=True)
+
+    def deleted(self):
+        return self.filter(deleted_at__isnull=False)
+
+    def soft_delete(self):
+        """flag every row of the queryset deleted with one UPDATE"""
+        return self.update(deleted_at=timezone.now())
+
+
+class SoftDeleteManager(models.Manager.from_queryset(SoftDeleteQuerySet)):
+    """Default manager hiding soft deleted rows"""
+
+    def get_queryset(self):
+        return super().get_queryset().alive()
+
+
 class UserManager(BaseUserManager):
 
     def create_user(self, email, password=None, **extra_fields):
@@ -42,11 +79,26 @@ class User(AbstractBaseUser, PermissionsMixin):
     name = models.CharField(max_length=255)
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
+    deleted_at = models.DateTimeField(null=True, blank=True)
 
     objects = UserManager()
 
     USERNAME_FIELD = 'email'
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['deleted_at'], name='core_user_deleted_at_idx'
+            ),
+        ]
+
+    def soft_delete(self):
+        """Deactivate the user, the data is removed later by the purge"""
+        self.is_active = False
+        self.deleted_at = timezone.now()
+        self.save(update_fields=['is_active', 'deleted_at'])
+        self.auth_tokens.all().delete()
+
 
 class Tag(models.Model):
     """Tag to be used for recipe"""
@@ -54,7 +106,14 @@ class Tag(models.Model):
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
+        # the user may live in another database, see core/sharding.py
+        db_constraint=False
     )
+    # NULL only for rows the migration has not backfilled yet
+    updated_at = models.DateTimeField(auto_now=True, null=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['user', 'updated_at'])]
 
     def __str__(self):
         return self.name
@@ -65,8 +124,15 @@ class Ingredient(models.Model):
     name = models.CharField(max_length=255)
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
-        on_delete=models.CASCADE
+        on_delete=models.CASCADE,
+        # the user may live in another database, see core/sharding.py
+        db_constraint=False
     )
+    # NULL only for rows the migration has not backfilled yet
+    updated_at = models.DateTimeField(auto_now=True, null=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['user', 'updated_at'])]
 
     def __str__(self):
         return self.name
@@ -76,15 +142,206 @@ class Recipe(models.Model):
     """Recipe object"""
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
-        on_delete=models.CASCADE
+        on_delete=models.CASCADE,
+        # the user may live in another database, see core/sharding.py
+        db_constraint=False
     )
     title = models.CharField(max_length=255)
     price = models.DecimalField(max_digits=5, decimal_places=2)
+    # copy of price kept for cheap range filters and serialization, set
+    # by save(), NULL only for rows the migration has not backfilled yet
+    price_cents = models.IntegerField(null=True)
     time_minutes = models.IntegerField(default=0)
     link = models.CharField(max_length=255, blank=True)
     ingredient = models.ManyToManyField('Ingredient')
     tag = models.ManyToManyField('Tag')
     image = models.ImageField(null=True, upload_to=recipe_image_file_path)
+    deleted_at = models.DateTimeField(null=True, blank=True)
+    # NULL only for rows the migration has not backfilled yet
+    updated_at = models.DateTimeField(auto_now=True, null=True)
+
+    objects = SoftDeleteManager()
+    all_objects = SoftDeleteQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'updated_at']),
+            models.Index(fields=['user', 'time_minutes', 'price_cents']),
+            models.Index(
+                fields=['deleted_at'], name='core_recipe_deleted_at_idx'
+            ),
+        ]
 
     def __str__(self):
         return self.title
+
+    def save(self, *args, **kwargs):
+        if 'price' not in self.get_deferred_fields():
+            self.price_cents = price_to_cents(self.price)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'price' in update_fields and \
+                'price_cents' not in update_fields:
+            kwargs['update_fields'] = list(update_fields) + ['price_cents']
+        super().save(*args, **kwargs)
+
+    def soft_delete(self):
+        """Hide the recipe, the row is removed later by the purge"""
+        self.deleted_at = timezone.now()
+        self.save(update_fields=['deleted_at', 'updated_at'])
+
+
+class RecipeStat(models.Model):
+    """Incrementally maintained per user recipe counters"""
+    RECIPE = 'recipe'
+    TAG = 'tag'
+    INGREDIENT = 'ingredient'
+    PRICE = 'price'
+    TIME = 'time'
+    KIND_CHOICES = (
+        (RECIPE, 'Recipe'),
+        (TAG, 'Tag'),
+        (INGREDIENT, 'Ingredient'),
+        (PRICE, 'Price bucket'),
+        (TIME, 'Time bucket'),
+    )
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        # the user may live in another database, see core/sharding.py
+        db_constraint=False
+    )
+    kind = models.CharField(max_length=16, choices=KIND_CHOICES)
+    key = models.IntegerField(default=0)
+    count = models.IntegerField(default=0)
+    price_total = models.DecimalField(
+        max_digits=14, decimal_places=2, default=0
+    )
+    time_total = models.BigIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('user', 'kind', 'key')
+
+    def __str__(self):
+        return f'{self.kind}:{self.key}={self.count}'
+
+
+class Tombstone(models.Model):
+    """Record of a deleted recipe, tag or ingredient for delta sync"""
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        # the user may live in another database, see core/sharding.py
+        db_constraint=False
+    )
+    kind = models.CharField(max_length=16)
+    object_id = models.IntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['user', 'deleted_at'])]
+
+    def __str__(self):
+        return f'{self.kind}:{self.object_id}'
+
+
+class Task(models.Model):
+    """Background job waiting in the database queue"""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (FAILED, 'Failed'),
+    )
+
+    name = models.CharField(max_length=255)
+    payload = models.TextField(default='{}')
+    status = models.CharField(
+        max_length=16, choices=STATUS_CHOICES, default=QUEUED
+    )
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    locked_by = models.CharField(max_length=255, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'run_at'])]
+
+    def __str__(self):
+        return f'{self.name} ({self.status})'
+
+
+class IdempotencyKey(models.Model):
+    """Response stored for a client supplied Idempotency-Key"""
+    scope = models.CharField(max_length=64)
+    key = models.CharField(max_length=255)
+    request_hash = models.CharField(max_length=64)
+    status_code = models.IntegerField(null=True)
+    response_body = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        unique_together = ('scope', 'key')
+
+    def __str__(self):
+        return f'{self.scope}:{self.key}'
+
+
+class UserShard(models.Model):
+    """Database alias holding the recipe data of a user"""
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        primary_key=True
+    )
+    alias = models.CharField(max_length=64)
+    moving = models.BooleanField(default=False)
+
+    def __str__(self):
+        return f'{self.user_id}@{self.alias}'
+
+
+class AuthToken(models.Model):
+    """Expiring API token, a user can hold one per device"""
+    key = models.CharField(max_length=40, primary_key=True)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        related_name='auth_tokens',
+        on_delete=models.CASCADE
+    )
+    device = models.CharField(max_length=64, blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    expires = models.DateTimeField(db_index=True)
+
+    @classmethod
+    def issue(cls, user, device=''):
+        """New token of the user, replacing the one of the same device"""
+        if device:
+            cls.objects.filter(user=user, device=device).delete()
+        token = cls.objects.create(
+            key=secrets.token_hex(20), user=user, device=device,
+            expires=timezone.now() + timedelta(
+                seconds=settings.AUTH_TOKEN_TTL
+            )
+        )
+        stale = cls.objects.filter(user=user).order_by('-created') \
+            .values_list('key', flat=True)[settings.AUTH_TOKEN_MAX_PER_USER:]
+        if stale:
+            cls.objects.filter(key__in=list(stale)).delete()
+        return token
+
+    def refresh(self, now):
+        """Slide the expiry, writing at most once per refresh interval"""
+        expires = now + timedelta(seconds=settings.AUTH_TOKEN_TTL)
+        interval = timedelta(seconds=settings.AUTH_TOKEN_REFRESH_INTERVAL)
+        if expires - self.expires >= interval:
+            AuthToken.objects.filter(key=self.key).update(expires=expires)
+            self.expires = expires
+
+    def __str__(self):
+        return self.key
@@ -0,0 +1,144 @@
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from django.db import connections
+
+
+SQL_FRAME_LENGTH = 80
+
+
+def _path_prefixes():
+    return sorted(
+        (os.path.join(path, '') for path in sys.path if path),
+        key=len, reverse=True
+    )
+
+
+class Sampler:
+    """Statistical profiler of one thread, annotated with SQL timings
+
+    A daemon thread snapshots the stack of the profiled thread every
+    ``interval`` seconds. Frames above ``base`` (the middleware) are
+    left out, and a sample taken while a query runs gets the statement
+    as an extra leaf frame so database time shows up in the flamegraph.
+    """
+
+    def __init__(self, interval=0.005, base=None):
+        self.interval = interval
+        self.base = base
+        self.thread_id = threading.get_ident()
+        self.samples = Counter()
+        self.queries = []
+        self.duration = 0
+        self._sql = None
+        self._prefixes = _path_prefixes()
+        self._names = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _name(self, code):
+        name = self._names.get(code)
+        if name is None:
+            filename = code.co_filename
+            for prefix in self._prefixes:
+                if filename.startswith(prefix):
+                    filename = filename[len(prefix):]
+                    break
+            name = f'{code.co_name} ({filename}:{code.co_firstlineno})'
+            self._names[code] = name
+        return name
+
+    def _sample(self):
+        frame = sys._current_frames().get(self.thread_id)
+        stack = []
+        while frame is not None and frame is not self.base:
+            stack.append(self._name(frame.f_code))
+            frame = frame.f_back
+        if not stack:
+            return
+        stack.reverse()
+        sql = self._sql
+        if sql is not None:
+            stack.append('SQL ' + ' '.join(sql.split())[:SQL_FRAME_LENGTH])
+        self.samples[tuple(stack)] += 1
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def _execute(self, execute, sql, params, many, context):
+        self._sql = sql
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, time.perf_counter() - start))
+            self._sql = None
+
+    def __enter__(self):
+        self._wrappers = ExitStack()
+        for alias in connections:
+            self._wrappers.enter_context(
+                connections[alias].execute_wrapper(self._execute)
+            )
+        self._start = time.perf_counter()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.duration = time.perf_counter() - self._start
+        self._wrappers.close()
+
+    @property
+    def sql_time(self):
+        return sum(duration for _, duration in self.queries)
+
+    def collapsed(self):
+        """samples in the collapsed stack format of flamegraph.pl"""
+        return ''.join(
+            ';'.join(stack) + f' {count}\n'
+            for stack, count in sorted(self.samples.items())
+        )
+
+    def speedscope(self, name):
+        """samples as a speedscope sampled profile"""
+        frames, index = [], {}
+        samples, weights = [], []
+        for stack, count in sorted(self.samples.items()):
+            for frame in stack:
+                if frame not in index:
+                    index[frame] = len(frames)
+                    frames.append({'name': frame})
+            samples.append([index[frame] for frame in stack])
+            weights.append(count * self.interval)
+        return json.dumps({
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'name': name,
+            'shared': {'frames': frames},
+            'profiles': [{
+                'type': 'sampled', 'name': name, 'unit': 'seconds',
+                'startValue': 0, 'endValue': self.duration,
+                'samples': samples, 'weights': weights,
+            }],
+        })
+
+
+FORMATS = {
+    'collapsed': ('collapsed', 'text/plain'),
+    'speedscope': ('speedscope.json', 'application/json'),
+}
+
+
+def render(sampler, fmt, name):
+    """(content, content type, file extension) of a profile"""
+    extension, content_type = FORMATS[fmt]
+    if fmt == 'speedscope':
+        return sampler.speedscope(name), content_type, extension
+    return sampler.collapsed(), content_type, extension
@@ -0,0 +1,110 @@
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+
+from core import sharding
+from core.models import AuthToken, Tag, Ingredient, Recipe, RecipeStat, \
+    Tombstone
+
+
+DEFAULT_BATCH_SIZE = 500
+
+
+def _delete_image_files(names):
+    """remove image files once the rows referencing them are gone"""
+    for name in names:
+        default_storage.delete(name)
+
+
+def _purge_recipe_batch(queryset, batch_size):
+    """delete one bounded batch of recipes, return the number deleted"""
+    rows = list(queryset.values_list('id', 'image')[:batch_size])
+    if not rows:
+        return 0
+
+    ids = [recipe_id for recipe_id, _ in rows]
+    images = [image for _, image in rows if image]
+    with sharding.atomic():
+        Recipe.all_objects.filter(id__in=ids).delete()
+        transaction.on_commit(
+            lambda: _delete_image_files(images), using=sharding.current()
+        )
+    return len(ids)
+
+
+def _purge_batch(queryset, batch_size):
+    """delete one bounded batch of rows of the queryset"""
+    ids = list(queryset.values_list('pk', flat=True)[:batch_size])
+    if not ids:
+        return 0
+
+    with sharding.atomic():
+        queryset.model._base_manager.filter(pk__in=ids).delete()
+    return len(ids)
+
+
+def _drain(purge, queryset, batch_size):
+    """run the batch purge until nothing is left, return total deleted"""
+    total = 0
+    while True:
+        deleted = purge(queryset, batch_size)
+        total += deleted
+        if deleted < batch_size:
+            return total
+
+
+def purge_recipes(grace=timedelta(0), batch_size=DEFAULT_BATCH_SIZE):
+    """Delete recipes that were soft deleted before the grace period"""
+    cutoff = timezone.now() - grace
+    total = 0
+    for alias in sharding.shards():
+        with sharding.use(alias):
+            queryset = Recipe.all_objects.filter(deleted_at__lte=cutoff)
+            total += _drain(_purge_recipe_batch, queryset, batch_size)
+    return total
+
+
+def purge_recipe(recipe_id):
+    """Delete a single recipe if it is still flagged deleted"""
+    return _purge_recipe_batch(
+        Recipe.all_objects.deleted().filter(id=recipe_id), 1
+    )
+
+
+def purge_user(user, batch_size=DEFAULT_BATCH_SIZE):
+    """Delete all data of a user in bounded batches, then the user
+
+    Runs in the shard context of the user, the cascade deleting the user
+    only reaches the rows on 'default'.
+    """
+    _drain(
+        _purge_recipe_batch,
+        Recipe.all_objects.filter(user=user),
+        batch_size
+    )
+    _drain(_purge_batch, Tag.objects.filter(user=user), batch_size)
+    _drain(_purge_batch, Ingredient.objects.filter(user=user), batch_size)
+    _drain(_purge_batch, RecipeStat.objects.filter(user=user), batch_size)
+    _drain(_purge_batch, Tombstone.objects.filter(user=user), batch_size)
+    user.delete()
+
+
+def purge_users(grace=timedelta(0), batch_size=DEFAULT_BATCH_SIZE):
+    """Purge every user that was soft deleted before the grace period"""
+    cutoff = timezone.now() - grace
+    users = get_user_model().objects.filter(deleted_at__lte=cutoff)
+    count = 0
+    for user in users.iterator():
+        with sharding.for_user(user.id):
+            purge_user(user, batch_size)
+        count += 1
+    return count
+
+
+def purge_tokens(batch_size=DEFAULT_BATCH_SIZE):
+    """Delete expired auth tokens, each batch in its own transaction"""
+    expired = AuthToken.objects.filter(expires__lte=timezone.now())
+    return _drain(_purge_batch, expired, batch_size)
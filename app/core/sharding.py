@@ -0,0 +1,342 @@
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, connections, transaction
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from core.checks import cache_is_shared
+from core.models import Tag, Ingredient, Recipe, RecipeStat, Tombstone, \
+    UserShard
+
+
+# models whose rows live on the shard of their user, everything else
+# (users, tokens, tasks, the shard map itself) stays on 'default'
+SHARDED_MODELS = (
+    Tag, Ingredient, Recipe, Recipe.tag.through, Recipe.ingredient.through,
+    RecipeStat, Tombstone,
+)
+_sharded = {model._meta.label_lower for model in SHARDED_MODELS}
+
+# tables given a disjoint id range per shard so rows keep their ids
+# when a user moves, see set_sequences
+SEQUENCE_MODELS = (Tag, Ingredient, Recipe)
+
+DEFAULT_BATCH_SIZE = 500
+
+_local = threading.local()
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def shards():
+    """Database aliases holding recipe data, 'default' first"""
+    return list(_setting('SHARDS', ['default']))
+
+
+def is_sharded(model):
+    return model._meta.label_lower in _sharded
+
+
+class ShardMoving(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Your data is being moved, retry in a moment.'
+    default_code = 'shard_moving'
+
+    def __init__(self, wait):
+        super().__init__()
+        # DRF turns this into a Retry-After header
+        self.wait = wait
+
+
+class ShardMoveError(Exception):
+    pass
+
+
+def _cache_key(user_id):
+    return f'shard:{user_id}'
+
+
+def invalidate(user_id):
+    cache.delete(_cache_key(user_id))
+
+
+def _cache_seconds():
+    return _setting('SHARD_CACHE_SECONDS', 60)
+
+
+def lookup(user_id, fresh=False):
+    """(alias, moving) of a user, assigning a shard on first use
+
+    The map is cached for SHARD_CACHE_SECONDS, writes pass ``fresh`` to
+    read it from the database so they never miss a move in progress.
+    """
+    aliases = shards()
+    if len(aliases) == 1:
+        return aliases[0], False
+
+    key = _cache_key(user_id)
+    entry = None if fresh else cache.get(key)
+    if entry is None:
+        row = UserShard.objects.filter(user_id=user_id).first()
+        if row is None:
+            targets = _setting('SHARD_NEW_USERS', None) or aliases
+            try:
+                with transaction.atomic(using='default'):
+                    row = UserShard.objects.create(
+                        user_id=user_id,
+                        alias=targets[user_id % len(targets)]
+                    )
+            except IntegrityError:
+                # assigned by a concurrent request
+                row = UserShard.objects.get(user_id=user_id)
+        entry = (row.alias, row.moving)
+        if not fresh:
+            cache.set(key, entry, _cache_seconds())
+    return entry
+
+
+def shard_for(user_id, fresh=False):
+    """Database alias holding the recipe data of a user"""
+    return lookup(user_id, fresh)[0]
+
+
+def current():
+    """Alias sharded queries without an instance go to"""
+    return getattr(_local, 'alias', 'default')
+
+
+def activate(alias):
+    _local.alias = alias
+
+
+def deactivate():
+    _local.__dict__.pop('alias', None)
+
+
+@contextmanager
+def use(alias):
+    """Route sharded queries to ``alias`` inside the block"""
+    previous = getattr(_local, 'alias', None)
+    activate(alias)
+    try:
+        yield alias
+    finally:
+        if previous is None:
+            deactivate()
+        else:
+            activate(previous)
+
+
+def for_user(user_id):
+    """Route sharded queries to the shard of a user inside the block
+
+    Used by tasks and commands, which may write, so the map is read
+    uncached.
+    """
+    return use(shard_for(user_id, fresh=True))
+
+
+def atomic():
+    """Transaction on the shard of the current context"""
+    return transaction.atomic(using=current())
+
+
+class ShardRouter:
+    """Send the recipe data of each user to the database of its shard
+
+    An instance is read and written where it was loaded from or, when it
+    is new, on its user's shard. Queries without an instance go to the
+    alias activated with ``use``/``for_user``, views do that once the
+    user is authenticated.
+    """
+
+    def _route(self, model, instance=None, fresh=False):
+        if not is_sharded(model):
+            if instance is not None and is_sharded(type(instance)):
+                # e.g. the user of a recipe
+                return 'default'
+            return None
+        if instance is not None:
+            if not is_sharded(type(instance)):
+                # reverse relation of a user
+                return shard_for(instance.pk, fresh)
+            if instance._state.db:
+                return instance._state.db
+            if getattr(instance, 'user_id', None):
+                return shard_for(instance.user_id, fresh)
+        return current()
+
+    def db_for_read(self, model, instance=None, **hints):
+        return self._route(model, instance)
+
+    def db_for_write(self, model, instance=None, **hints):
+        return self._route(model, instance, fresh=True)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if is_sharded(type(obj1)) != is_sharded(type(obj2)):
+            # the user of a row lives on 'default'
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return None
+
+
+class ShardedViewMixin:
+    """Route the sharded queries of a view to the user's shard
+
+    Writes read the shard map uncached and are refused with 503 while
+    the user is moved to another shard, reads use the cached map and
+    keep being served from the old shard until its rows are removed.
+    """
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if not request.user.is_authenticated:
+            return
+        safe = request.method in ('GET', 'HEAD', 'OPTIONS')
+        alias, moving = lookup(request.user.pk, fresh=not safe)
+        if moving and not safe:
+            raise ShardMoving(_setting('SHARD_MOVE_RETRY_AFTER', 5))
+        activate(alias)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        deactivate()
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+def set_sequences(alias):
+    """Start the ids of a shard in its own range of SHARD_ID_SPAN ids
+
+    Ids then stay unique across shards and moved rows keep their ids.
+    """
+    span = _setting('SHARD_ID_SPAN', 10 ** 8)
+    start = shards().index(alias) * span
+    connection = connections[alias]
+    with connection.cursor() as cursor:
+        for model in SEQUENCE_MODELS:
+            table = model._meta.db_table
+            high = model._base_manager.using(alias).filter(
+                id__gte=start, id__lt=start + span
+            ).order_by('-id').values_list('id', flat=True).first()
+            value = high or start
+            if not value:
+                continue
+            if connection.vendor == 'postgresql':
+                cursor.execute(
+                    "SELECT setval(pg_get_serial_sequence(%s, 'id'), %s)",
+                    [table, value]
+                )
+            elif connection.vendor == 'sqlite':
+                cursor.execute(
+                    'DELETE FROM sqlite_sequence WHERE name = %s', [table]
+                )
+                cursor.execute(
+                    'INSERT INTO sqlite_sequence (name, seq) VALUES (%s, %s)',
+                    [table, value]
+                )
+
+
+def _copy(model, queryset, target, batch_size, keep_pk=True):
+    """insert the rows of a queryset on another database in batches"""
+    count = 0
+    batch = []
+    for obj in queryset.iterator(chunk_size=batch_size):
+        if not keep_pk:
+            obj.pk = None
+        batch.append(obj)
+        if len(batch) == batch_size:
+            model._base_manager.using(target).bulk_create(batch)
+            count += len(batch)
+            batch = []
+    if batch:
+        model._base_manager.using(target).bulk_create(batch)
+        count += len(batch)
+    return count
+
+
+def _user_rows(user_id, alias):
+    """querysets of all sharded rows of a user, parents first"""
+    recipes = Recipe.all_objects.using(alias).filter(user_id=user_id)
+    return (
+        (Tag, Tag.objects.using(alias).filter(user_id=user_id), True),
+        (Ingredient,
+         Ingredient.objects.using(alias).filter(user_id=user_id), True),
+        (Recipe, recipes, True),
+        (Recipe.tag.through, Recipe.tag.through.objects.using(alias)
+         .filter(recipe__in=recipes.values('id')), False),
+        (Recipe.ingredient.through, Recipe.ingredient.through.objects
+         .using(alias).filter(recipe__in=recipes.values('id')), False),
+        (RecipeStat,
+         RecipeStat.objects.using(alias).filter(user_id=user_id), False),
+        (Tombstone,
+         Tombstone.objects.using(alias).filter(user_id=user_id), False),
+    )
+
+
+def move_user(user, target, batch_size=DEFAULT_BATCH_SIZE, settle=None):
+    """Move the recipe data of a user to another shard
+
+    Writes of the user are refused while the rows are copied, reads are
+    served from the old shard until the map is switched. The old rows
+    are removed last, once every process's cached map has expired.
+    Needs a cache shared by all processes. Returns the number of rows
+    moved.
+    """
+    if target not in shards():
+        raise ShardMoveError(f'Unknown shard {target}')
+    if not cache_is_shared():
+        raise ShardMoveError(
+            'Moves need a cache shared by all processes, the cached '
+            'shard maps of the other workers can not be invalidated'
+        )
+    source = shard_for(user.pk, fresh=True)
+    if source == target:
+        return 0
+    if settle is None:
+        settle = _setting('SHARD_MOVE_SETTLE', 2)
+
+    UserShard.objects.filter(user_id=user.pk).update(moving=True)
+    invalidate(user.pk)
+    # let writes that read the map before the flag finish
+    time.sleep(settle)
+
+    try:
+        with transaction.atomic(using=target):
+            moved = sum(
+                _copy(model, queryset, target, batch_size, keep_pk)
+                for model, queryset, keep_pk in _user_rows(user.pk, source)
+            )
+            set_sequences(target)
+    except IntegrityError as error:
+        UserShard.objects.filter(user_id=user.pk).update(moving=False)
+        invalidate(user.pk)
+        raise ShardMoveError(
+            f'Ids of user {user.pk} collide on {target}, '
+            f'run init_shards first: {error}'
+        )
+    except Exception:
+        UserShard.objects.filter(user_id=user.pk).update(moving=False)
+        invalidate(user.pk)
+        raise
+
+    UserShard.objects.filter(user_id=user.pk).update(
+        alias=target, moving=False
+    )
+    invalidate(user.pk)
+    # reads may still use a cached map pointing to the old shard, also
+    # one cached by a request that read the row just before the switch
+    time.sleep(settle + _cache_seconds())
+
+    # raw deletes, the rows still exist so no signal may record them
+    # as deleted in the stats or the tombstones
+    with transaction.atomic(using=source):
+        for model, queryset, _ in reversed(_user_rows(user.pk, source)):
+            queryset._raw_delete(source)
+    return moved
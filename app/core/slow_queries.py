@@ -0,0 +1,248 @@
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+
+
+_LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r'\bIN \((?:\?|%s)(?:, (?:\?|%s))*\)')
+_WHITESPACE = re.compile(r'\s+')
+_WHERE = re.compile(
+    r'\bWHERE\b(.*?)(?:\bGROUP BY\b|\bORDER BY\b|\bLIMIT\b|$)', re.S
+)
+_CONDITION = re.compile(
+    r'"(\w+)"\."(\w+)" (<=|>=|=|<|>|IN\b|IS\b|LIKE\b|BETWEEN\b)'
+)
+_SQLITE_SCAN = re.compile(r'^SCAN (?:TABLE )?(\w+)(?! USING)')
+# SELECTs that lock rows or change state when run, EXPLAIN ANALYZE would
+# take the locks or bump the sequence a second time
+_SIDE_EFFECTS = re.compile(
+    r'\bFOR (?:NO KEY |KEY )?(?:UPDATE|SHARE)\b|'
+    r'\b(?:nextval|setval|pg_notify|pg_(?:try_)?advisory_\w+)\s*\(',
+    re.I
+)
+
+EQUALITY = ('=', 'IN', 'IS')
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_sql(sql):
+    """Replace literals so repeated statements group together"""
+    sql = _LITERAL.sub('?', sql)
+    sql = _IN_LIST.sub('IN (...)', sql)
+    return _WHITESPACE.sub(' ', sql).strip()
+
+
+def fingerprint(sql):
+    """Short stable id of the normalized statement"""
+    return hashlib.sha1(normalize_sql(sql).encode()).hexdigest()[:16]
+
+
+def seq_scans(vendor, plan):
+    """Tables read without an index according to a captured plan"""
+    if vendor == 'postgresql':
+        tables = []
+
+        def walk(node):
+            if node.get('Node Type') == 'Seq Scan':
+                tables.append(node['Relation Name'])
+            for child in node.get('Plans', ()):
+                walk(child)
+        for entry in plan:
+            walk(entry['Plan'])
+        return tables
+    return [
+        match.group(1) for match in
+        (_SQLITE_SCAN.match(row[-1]) for row in plan) if match
+    ]
+
+
+def suggest_index(sql, table):
+    """Columns of ``table`` worth indexing for the WHERE of ``sql``
+
+    Columns compared for equality come first, then range conditions,
+    the usual order for a composite index.
+    """
+    where = _WHERE.search(sql)
+    if not where:
+        return []
+    equal, ranged = [], []
+    for owner, column, operator in _CONDITION.findall(where.group(1)):
+        if owner != table:
+            continue
+        target = equal if operator in EQUALITY else ranged
+        if column not in equal and column not in ranged:
+            target.append(column)
+    return equal + ranged
+
+
+def explain_prefix(vendor, sql):
+    """EXPLAIN to capture the plan of ``sql`` with, None to skip it"""
+    if not sql.lstrip().upper().startswith('SELECT'):
+        return None
+    if vendor == 'postgresql':
+        if _SIDE_EFFECTS.search(sql):
+            return 'EXPLAIN (FORMAT JSON) '
+        return 'EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) '
+    if vendor == 'sqlite':
+        return 'EXPLAIN QUERY PLAN '
+    return None
+
+
+def _origin():
+    """innermost frame of the project's own code"""
+    base = os.path.join(settings.BASE_DIR, '')
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(base) and filename != __file__:
+            return (
+                f'{filename[len(base):]}:{frame.f_lineno} '
+                f'{frame.f_code.co_name}'
+            )
+        frame = frame.f_back
+    return ''
+
+
+class QueryAnalyzer:
+    """Database execution wrapper recording slow queries with their plan
+
+    A statement slower than ``threshold`` ms is sampled with probability
+    ``sample_rate``. The first time a SELECT fingerprint is seen in the
+    process its plan is captured, with ``EXPLAIN (ANALYZE, BUFFERS)`` on
+    PostgreSQL, which runs the query once more, or ``EXPLAIN QUERY
+    PLAN`` on SQLite. Locking reads and calls to nextval, setval,
+    pg_notify or advisory locks only get a plain EXPLAIN, running them
+    again is not harmless. Samples are appended as JSON lines to ``path``.
+    The EXPLAIN runs in a savepoint and failures to record are only
+    logged, the query itself already succeeded.
+    """
+
+    def __init__(self, threshold, sample_rate=1.0, path=None):
+        self.threshold = threshold
+        self.sample_rate = sample_rate
+        self.path = path
+        self.explained = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        if getattr(self._local, 'explaining', False):
+            return execute(sql, params, many, context)
+        start = time.perf_counter()
+        result = execute(sql, params, many, context)
+        elapsed = (time.perf_counter() - start) * 1000
+        if elapsed >= self.threshold and not many and \
+                random.random() < self.sample_rate:
+            try:
+                self.record(context['connection'], sql, params, elapsed)
+            except Exception:
+                logger.exception('Could not record slow query %s', sql)
+        return result
+
+    def explain(self, connection, sql, params):
+        """the plan of a SELECT, None for other statements"""
+        prefix = explain_prefix(connection.vendor, sql)
+        if prefix is None:
+            return None
+        self._local.explaining = True
+        try:
+            # a failing EXPLAIN must not abort the caller's transaction
+            with transaction.atomic(using=connection.alias, savepoint=True):
+                with connection.cursor() as cursor:
+                    cursor.execute(prefix + sql, params)
+                    rows = cursor.fetchall()
+        finally:
+            self._local.explaining = False
+        if connection.vendor == 'postgresql':
+            plan = rows[0][0]
+            return json.loads(plan) if isinstance(plan, str) else plan
+        return [list(row) for row in rows]
+
+    def record(self, connection, sql, params, elapsed):
+        key = fingerprint(sql)
+        sample = {
+            'fingerprint': key,
+            'sql': normalize_sql(sql),
+            'ms': round(elapsed, 3),
+            'origin': _origin(),
+            'vendor': connection.vendor,
+            'at': time.time(),
+        }
+        with self._lock:
+            first = key not in self.explained
+            self.explained.setdefault(key, None)
+        if first:
+            plan = self.explain(connection, sql, params)
+            sample['plan'] = plan
+            if plan is not None:
+                sample['scans'] = seq_scans(connection.vendor, plan)
+            self.explained[key] = plan
+        if self.path:
+            line = json.dumps(sample, default=str) + '\n'
+            with self._lock, open(self.path, 'a') as log:
+                log.write(line)
+        return sample
+
+
+def install(sender, connection, **kwargs):
+    """connection_created receiver adding the process analyzer"""
+    if analyzer not in connection.execute_wrappers:
+        connection.execute_wrappers.append(analyzer)
+
+
+analyzer = QueryAnalyzer(
+    getattr(settings, 'SLOW_QUERY_MS', 100),
+    getattr(settings, 'SLOW_QUERY_SAMPLE_RATE', 1.0),
+    getattr(settings, 'SLOW_QUERY_LOG', None),
+)
+
+
+def read_log(path):
+    """samples of a slow query log, skipping a partially written line"""
+    samples = []
+    with open(path) as log:
+        for line in log:
+            try:
+                samples.append(json.loads(line))
+            except ValueError:
+                continue
+    return samples
+
+
+def aggregate(samples):
+    """Per fingerprint totals, the most expensive first"""
+    groups = defaultdict(lambda: {
+        'count': 0, 'total_ms': 0, 'max_ms': 0, 'origins': set(),
+        'plan': None, 'scans': [],
+    })
+    for sample in samples:
+        group = groups[sample['fingerprint']]
+        group['fingerprint'] = sample['fingerprint']
+        group['sql'] = sample['sql']
+        group['count'] += 1
+        group['total_ms'] += sample['ms']
+        group['max_ms'] = max(group['max_ms'], sample['ms'])
+        if sample.get('origin'):
+            group['origins'].add(sample['origin'])
+        if sample.get('plan') is not None:
+            group['plan'] = sample['plan']
+            group['scans'] = sample.get('scans', [])
+    for group in groups.values():
+        group['suggestions'] = [
+            (table, columns) for table, columns in (
+                (table, suggest_index(group['sql'], table))
+                for table in dict.fromkeys(group['scans'])
+            ) if columns
+        ]
+    return sorted(groups.values(), key=lambda g: g['total_ms'], reverse=True)
@@ -0,0 +1,99 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+
+
+BUDGETS_PATH = os.path.join(os.path.dirname(__file__), 'startup_budgets.json')
+REPORTS_DIR = os.path.join(settings.BASE_DIR, 'benchmarks', 'importtime')
+
+# wall time budgets are multiplied by this to absorb slow CI machines
+TIME_FACTOR = float(os.environ.get('STARTUP_BUDGET_TIME_FACTOR', '1'))
+
+# seconds a single run may take before it is considered hung
+TIMEOUT = 60
+
+# interpreter arguments of each measured entry point, none of them may
+# need the database, a command waiting for it would only measure that
+TARGETS = {
+    'setup': ['-c', 'import django; django.setup()'],
+    'wsgi': ['-c', 'import app.wsgi'],
+    'check': ['manage.py', 'check'],
+}
+
+
+def load_budgets(path=BUDGETS_PATH):
+    """Return the committed startup budgets keyed by target"""
+    with open(path) as budgets:
+        return json.load(budgets)
+
+
+def parse_importtime(output):
+    """(module, self us, cumulative us) of ``-X importtime`` output"""
+    modules = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        modules.append((name.strip(), int(own), int(cumulative)))
+    return modules
+
+
+def measure(target, repeat=3, timeout=TIMEOUT):
+    """Best wall time in ms of a target and the modules it imported"""
+    best, modules = None, []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        try:
+            result = subprocess.run(
+                [sys.executable, '-X', 'importtime'] + TARGETS[target],
+                cwd=settings.BASE_DIR, capture_output=True, text=True,
+                timeout=timeout,
+                env={
+                    **os.environ,
+                    'DJANGO_SETTINGS_MODULE': settings.SETTINGS_MODULE,
+                }
+            )
+        except subprocess.TimeoutExpired:
+            raise RuntimeError(
+                f'{target} did not finish within {timeout}s, is it '
+                f'waiting on a service?'
+            ) from None
+        elapsed = (time.perf_counter() - start) * 1000
+        if result.returncode:
+            raise RuntimeError(f'{target} failed:\n{result.stderr}')
+        if best is None or elapsed < best:
+            best, modules = elapsed, parse_importtime(result.stderr)
+    return best, modules
+
+
+def format_report(target, elapsed, modules, top=40):
+    """Slowest imports of a target by cumulative time"""
+    lines = [
+        f'# {target}: {elapsed:.0f}ms wall, {len(modules)} modules, '
+        f'python {sys.version_info[0]}.{sys.version_info[1]}',
+        '# cumulative_us  self_us  module',
+    ]
+    for name, own, cumulative in sorted(
+            modules, key=lambda module: -module[2])[:top]:
+        lines.append(f'{cumulative:>14}  {own:>7}  {name}')
+    return '\n'.join(lines) + '\n'
+
+
+def check_budget(target, elapsed, modules, budget):
+    """Messages describing how a target exceeds its budget"""
+    errors = []
+    limit = budget.get('ms')
+    if limit is not None and elapsed > limit * TIME_FACTOR:
+        errors.append(
+            f'{target} took {elapsed:.0f}ms, budget is '
+            f'{limit * TIME_FACTOR:.0f}ms'
+        )
+    imported = {name for name, _, _ in modules}
+    for name in budget.get('forbid', []):
+        if name in imported:
+            errors.append(f'{target} imported {name}')
+    return errors
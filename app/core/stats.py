@@ -0,0 +1,314 @@
+from bisect import bisect_right
+from decimal import Decimal
+from functools import reduce
+from operator import or_
+
+from django.db.models import Case, Count, F, IntegerField, Q, Sum, When
+from django.db.models.signals import m2m_changed, post_save, pre_delete, \
+    pre_save
+from django.dispatch import receiver
+
+from core import sharding
+from core.models import Tag, Ingredient, Recipe, RecipeStat
+
+
+# upper bounds of the histogram buckets, the last bucket is open ended
+PRICE_BUCKETS = (5, 10, 20, 50, 100)
+TIME_BUCKETS = (15, 30, 60, 120)
+
+RELATED_KINDS = {
+    Recipe.tag.through: (RecipeStat.TAG, 'tag_id'),
+    Recipe.ingredient.through: (RecipeStat.INGREDIENT, 'ingredient_id'),
+}
+
+
+def _counters(user_id, pairs):
+    """the counter rows of a user for (kind, key) pairs"""
+    keys = {}
+    for kind, key in pairs:
+        keys.setdefault(kind, set()).add(key)
+    return RecipeStat.objects.filter(
+        reduce(or_, (Q(kind=kind, key__in=keys[kind]) for kind in keys)),
+        user_id=user_id
+    )
+
+
+def _bump(user_id, counts, **totals):
+    """add ``counts``, amounts keyed by (kind, key), to the counters
+
+    The rows are updated with one UPDATE per distinct amount. Only when
+    it matches fewer rows than asked, the first time a key is counted,
+    the missing rows are looked up, created and updated.
+    """
+    pairs_by_amount = {}
+    for pair, amount in counts.items():
+        if amount or totals:
+            pairs_by_amount.setdefault(amount, set()).add(pair)
+    for amount, pairs in pairs_by_amount.items():
+        updates = {'count': F('count') + amount}
+        for field, value in totals.items():
+            updates[field] = F(field) + value
+        if _counters(user_id, pairs).update(**updates) == len(pairs):
+            continue
+        missing = pairs - set(
+            _counters(user_id, pairs).values_list('kind', 'key')
+        )
+        if not missing:
+            continue
+        RecipeStat.objects.bulk_create(
+            [RecipeStat(user_id=user_id, kind=kind, key=key)
+             for kind, key in missing],
+            ignore_conflicts=True
+        )
+        _counters(user_id, missing).update(**updates)
+
+
+def record_related(user_id, related, sign=1):
+    """Count recipes gaining (sign=1) or losing (sign=-1) tags/ingredients
+
+    ``related`` maps RecipeStat.TAG or INGREDIENT to the ids, all of them
+    are counted with a single query.
+    """
+    _bump(user_id, {
+        (kind, key): sign for kind, keys in related.items() for key in keys
+    })
+
+
+def record_counts(user_id, counts):
+    """Add amounts keyed by (kind, key), e.g. recipes gaining a tag"""
+    _bump(user_id, counts)
+
+
+def record_recipes(user_id, changes):
+    """apply the changes between old and new (price, time) of recipes
+
+    ``changes`` holds (old, new) pairs, None for a recipe that is not
+    counted, all of them are applied with a constant number of queries.
+    """
+    count, price, time, buckets = 0, Decimal(0), 0, {}
+    changed = False
+    for old, new in changes:
+        if old == new:
+            continue
+        changed = True
+        old_price, old_time = old or (0, 0)
+        new_price, new_time = new or (0, 0)
+        count += (new is not None) - (old is not None)
+        price += Decimal(new_price) - Decimal(old_price)
+        time += new_time - old_time
+        for kind, edges, index in ((RecipeStat.PRICE, PRICE_BUCKETS, 0),
+                                   (RecipeStat.TIME, TIME_BUCKETS, 1)):
+            old_bucket = old and bisect_right(edges, old[index])
+            new_bucket = new and bisect_right(edges, new[index])
+            if old_bucket == new_bucket:
+                continue
+            if old is not None:
+                key = (kind, old_bucket)
+                buckets[key] = buckets.get(key, 0) - 1
+            if new is not None:
+                key = (kind, new_bucket)
+                buckets[key] = buckets.get(key, 0) + 1
+    if not changed:
+        return
+    _bump(
+        user_id, {(RecipeStat.RECIPE, 0): count},
+        price_total=price, time_total=time
+    )
+    _bump(user_id, buckets)
+
+
+def _record_recipe(user_id, old, new):
+    """apply the change between old and new (price, time) of a recipe"""
+    record_recipes(user_id, [(old, new)])
+
+
+def _record_recipe_related(recipe, sign):
+    """add or remove every tag and ingredient of a recipe"""
+    record_related(recipe.user_id, {
+        kind: through.objects.filter(recipe_id=recipe.id)
+        .values_list(field, flat=True)
+        for through, (kind, field) in RELATED_KINDS.items()
+    }, sign)
+
+
+def _recipe_values(recipe):
+    """the stats relevant part of a recipe, None when it is not counted"""
+    if recipe.deleted_at is not None:
+        return None
+    return (Decimal(str(recipe.price)), recipe.time_minutes)
+
+
+@receiver(pre_save, sender=Recipe)
+def _remember_recipe(sender, instance, raw=False, **kwargs):
+    instance._stats_old = None
+    if raw or instance.pk is None:
+        return
+    old = Recipe.all_objects.filter(pk=instance.pk) \
+        .values_list('price', 'time_minutes', 'deleted_at').first()
+    if old and old[2] is None:
+        instance._stats_old = (old[0], old[1])
+
+
+@receiver(post_save, sender=Recipe)
+def _recipe_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    old = getattr(instance, '_stats_old', None)
+    new = _recipe_values(instance)
+    _record_recipe(instance.user_id, old, new)
+    if not created and (old is None) != (new is None):
+        _record_recipe_related(instance, 1 if new else -1)
+
+
+@receiver(pre_delete, sender=Recipe)
+def _recipe_deleted(sender, instance, **kwargs):
+    if instance.deleted_at is None:
+        _record_recipe(instance.user_id, _recipe_values(instance), None)
+        _record_recipe_related(instance, -1)
+
+
+@receiver(pre_delete, sender=Tag)
+@receiver(pre_delete, sender=Ingredient)
+def _related_deleted(sender, instance, **kwargs):
+    kind = RecipeStat.TAG if sender is Tag else RecipeStat.INGREDIENT
+    RecipeStat.objects.filter(
+        user_id=instance.user_id, kind=kind, key=instance.id
+    ).delete()
+
+
+def _changed_keys(through, field, instance, reverse, pk_set):
+    """the pairs an m2m remove or clear is actually going to drop"""
+    if reverse:
+        rows = through.objects.filter(
+            **{field: instance.id}, recipe__deleted_at__isnull=True
+        )
+        if pk_set is not None:
+            rows = rows.filter(recipe_id__in=pk_set)
+        return rows.count()
+    rows = through.objects.filter(recipe_id=instance.id)
+    if pk_set is not None:
+        rows = rows.filter(**{f'{field}__in': pk_set})
+    return list(rows.values_list(field, flat=True))
+
+
+@receiver(m2m_changed, sender=Recipe.tag.through)
+@receiver(m2m_changed, sender=Recipe.ingredient.through)
+def _related_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    kind, field = RELATED_KINDS[sender]
+    if not reverse and instance.deleted_at is not None:
+        return
+
+    if action in ('pre_remove', 'pre_clear'):
+        instance._stats_removed = _changed_keys(
+            sender, field, instance, reverse, pk_set
+        )
+    elif action in ('post_remove', 'post_clear'):
+        removed = getattr(instance, '_stats_removed', None)
+        if reverse:
+            _bump(instance.user_id, {(kind, instance.id): -(removed or 0)})
+        else:
+            record_related(instance.user_id, {kind: removed or []}, -1)
+    elif action == 'post_add' and pk_set:
+        if reverse:
+            added = Recipe.objects.filter(id__in=pk_set).count()
+            _bump(instance.user_id, {(kind, instance.id): added})
+        else:
+            record_related(instance.user_id, {kind: pk_set}, 1)
+
+
+def _bucket_case(field, edges):
+    """SQL expression returning the histogram bucket of a column"""
+    return Case(
+        *[When(**{f'{field}__lt': edge}, then=index)
+          for index, edge in enumerate(edges)],
+        default=len(edges),
+        output_field=IntegerField()
+    )
+
+
+def recompute(user):
+    """Rebuild the counters of a user from scratch with aggregate queries"""
+    recipes = Recipe.objects.filter(user=user).order_by()
+    totals = recipes.aggregate(
+        count=Count('id'),
+        price=Sum('price'),
+        time=Sum('time_minutes')
+    )
+    stats = [RecipeStat(
+        user=user, kind=RecipeStat.RECIPE, key=0, count=totals['count'],
+        price_total=totals['price'] or 0, time_total=totals['time'] or 0
+    )]
+    grouped = (
+        (RecipeStat.TAG, recipes.filter(tag__isnull=False)
+         .values_list('tag')),
+        (RecipeStat.INGREDIENT, recipes.filter(ingredient__isnull=False)
+         .values_list('ingredient')),
+        (RecipeStat.PRICE, recipes.annotate(
+            bucket=_bucket_case('price', PRICE_BUCKETS)
+        ).values_list('bucket')),
+        (RecipeStat.TIME, recipes.annotate(
+            bucket=_bucket_case('time_minutes', TIME_BUCKETS)
+        ).values_list('bucket')),
+    )
+    for kind, queryset in grouped:
+        stats.extend(
+            RecipeStat(user=user, kind=kind, key=key, count=count)
+            for key, count in queryset.annotate(n=Count('id'))
+        )
+
+    with sharding.atomic():
+        RecipeStat.objects.filter(user=user).delete()
+        RecipeStat.objects.bulk_create(stats)
+
+
+def _histogram(edges, counts):
+    bounds = (0,) + tuple(edges) + (None,)
+    return [
+        {'min': bounds[index], 'max': bounds[index + 1],
+         'count': counts.get(index, 0)}
+        for index in range(len(edges) + 1)
+    ]
+
+
+def user_stats(user):
+    """Aggregates of a user read from the counters only"""
+    by_kind = {kind: {} for kind, _ in RecipeStat.KIND_CHOICES}
+    totals = None
+    for stat in RecipeStat.objects.filter(user=user, count__gt=0):
+        by_kind[stat.kind][stat.key] = stat.count
+        if stat.kind == RecipeStat.RECIPE:
+            totals = stat
+
+    count = totals.count if totals else 0
+    names = {}
+    for kind, model in ((RecipeStat.TAG, Tag),
+                        (RecipeStat.INGREDIENT, Ingredient)):
+        names[kind] = dict(
+            model.objects.filter(id__in=by_kind[kind])
+            .values_list('id', 'name')
+        )
+
+    return {
+        'recipe_count': count,
+        'average_price': (
+            (totals.price_total / count).quantize(Decimal('0.01'))
+            if count else None
+        ),
+        'average_time_minutes': (
+            round(totals.time_total / count, 2) if count else None
+        ),
+        'tag': [
+            {'id': key, 'name': names[RecipeStat.TAG].get(key),
+             'count': value}
+            for key, value in sorted(by_kind[RecipeStat.TAG].items())
+        ],
+        'ingredient': [
+            {'id': key, 'name': names[RecipeStat.INGREDIENT].get(key),
+             'count': value}
+            for key, value in sorted(by_kind[RecipeStat.INGREDIENT].items())
+        ],
+        'price_histogram': _histogram(
+            PRICE_BUCKETS, by_kind[RecipeStat.PRICE]
+        ),
+        'time_histogram': _histogram(TIME_BUCKETS, by_kind[RecipeStat.TIME]),
+    }
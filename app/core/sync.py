@@ -0,0 +1,105 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from core import sharding
+from core.models import Tag, Ingredient, Recipe, Tombstone
+
+
+# tombstones older than this are pruned, older cursors need a full sync
+TOMBSTONE_TTL = timedelta(days=getattr(settings, 'SYNC_TOMBSTONE_DAYS', 30))
+
+KINDS = {Recipe: 'recipe', Tag: 'tag', Ingredient: 'ingredient'}
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(moment):
+    """Opaque sync token for a point in time"""
+    return str(int(moment.timestamp() * 1000000))
+
+
+def decode_cursor(cursor):
+    """Point in time of a sync token, raises InvalidCursor"""
+    try:
+        micros = int(cursor)
+        return datetime.fromtimestamp(micros / 1000000, tz=dt_timezone.utc)
+    except (TypeError, ValueError, OverflowError, OSError):
+        raise InvalidCursor(cursor)
+
+
+def next_cursor(now=None):
+    """Cursor for the next sync, taken before reading the changes
+
+    ``updated_at`` is stamped before the row commits, a row stamped just
+    before the cursor but committed after the read would be skipped for
+    good. The cursor lags by SYNC_CURSOR_OVERLAP seconds so such rows
+    are sent again next time, clients apply changes idempotently.
+    """
+    now = now or timezone.now()
+    overlap = getattr(settings, 'SYNC_CURSOR_OVERLAP', 30)
+    return encode_cursor(now - timedelta(seconds=overlap))
+
+
+@receiver(post_save, sender=Recipe)
+def _recipe_soft_deleted(sender, instance, update_fields=None, raw=False,
+                         **kwargs):
+    if raw or instance.deleted_at is None:
+        return
+    if update_fields and 'deleted_at' in update_fields:
+        Tombstone.objects.create(
+            user_id=instance.user_id, kind='recipe', object_id=instance.id
+        )
+
+
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def _deleted(sender, instance, **kwargs):
+    # soft deleted recipes already got their tombstone
+    if getattr(instance, 'deleted_at', None) is not None:
+        return
+    Tombstone.objects.create(
+        user_id=instance.user_id, kind=KINDS[sender], object_id=instance.id
+    )
+
+
+def prune_tombstones(now=None):
+    """Delete tombstones no client cursor is expected to need anymore"""
+    now = now or timezone.now()
+    return sum(
+        Tombstone.objects.using(alias)
+        .filter(deleted_at__lt=now - TOMBSTONE_TTL).delete()[0]
+        for alias in sharding.shards()
+    )
+
+
+def changes(user, since=None):
+    """Rows of a user changed or deleted since a point in time
+
+    Returns querysets of the changed recipes, tags and ingredients, the
+    deleted ids per kind and whether a full sync was needed. Without
+    ``since``, or when it is older than the kept tombstones, everything
+    is returned and the client is expected to replace its copy.
+    """
+    full = since is None or since < timezone.now() - TOMBSTONE_TTL
+    querysets = {
+        'recipe': Recipe.objects.filter(user=user),
+        'tag': Tag.objects.filter(user=user),
+        'ingredient': Ingredient.objects.filter(user=user),
+    }
+    deleted = {kind: [] for kind in querysets}
+    if not full:
+        for kind in querysets:
+            querysets[kind] = querysets[kind].filter(updated_at__gte=since)
+        tombstones = Tombstone.objects.filter(
+            user=user, deleted_at__gte=since
+        ).values_list('kind', 'object_id')
+        for kind, object_id in tombstones:
+            deleted[kind].append(object_id)
+    return querysets, deleted, full
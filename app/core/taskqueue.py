@@ -0,0 +1,210 @@
+import json
+import logging
+import os
+import signal
+import socket
+import threading
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import F, Q
+from django.utils import timezone
+
+from core.models import Task
+
+
+logger = logging.getLogger(__name__)
+
+_registry = {}
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def task(func=None, *, max_attempts=5):
+    """Register a function as a background task
+
+    The decorated function gains ``delay(*args, **kwargs)`` queuing a
+    call, the arguments must be JSON serializable. Delivery is at least
+    once, a task may run again after its worker died, so it has to be
+    idempotent.
+    """
+    def register(func):
+        name = f'{func.__module__}.{func.__name__}'
+        _registry[name] = func
+
+        def delay(*args, **kwargs):
+            return enqueue(name, *args, max_attempts=max_attempts, **kwargs)
+
+        func.task_name = name
+        func.delay = delay
+        return func
+
+    if func is None:
+        return register
+    return register(func)
+
+
+def enqueue(name, *args, max_attempts=5, countdown=0, **kwargs):
+    """Queue a registered task, or run it now when tasks are eager
+
+    Queuing inside a transaction commits the task with the data it
+    refers to, a rollback drops both.
+    """
+    if name not in _registry:
+        raise KeyError(f'Unknown task {name}')
+    if _setting('TASKS_ALWAYS_EAGER', False):
+        _registry[name](*args, **kwargs)
+        return None
+    return Task.objects.create(
+        name=name,
+        payload=json.dumps({'args': args, 'kwargs': kwargs}),
+        max_attempts=max_attempts,
+        run_at=timezone.now() + timedelta(seconds=countdown)
+    )
+
+
+def backoff(attempts):
+    """Seconds to wait before retrying after the given failed attempts"""
+    base = _setting('TASKS_RETRY_BACKOFF', 10)
+    return min(base * 2 ** (attempts - 1), _setting('TASKS_MAX_BACKOFF', 3600))
+
+
+def _claimable(now):
+    """tasks that are due, or whose worker died while running them"""
+    stale = now - timedelta(seconds=_setting('TASKS_LOCK_TIMEOUT', 600))
+    return Q(status=Task.QUEUED, run_at__lte=now) | \
+        Q(status=Task.RUNNING, locked_at__lt=stale)
+
+
+def claim(worker_id, limit=1):
+    """Lock up to ``limit`` due tasks for a worker
+
+    Each task is taken with a conditional UPDATE, so concurrent workers
+    in any thread or process never hold the same task at the same time.
+    A lock older than TASKS_LOCK_TIMEOUT is taken over, the worker may
+    have died after running the task but before deleting it: delivery is
+    at least once, not exactly once.
+    """
+    now = timezone.now()
+    candidates = Task.objects.filter(_claimable(now)) \
+        .order_by('run_at').values_list('id', flat=True)[:limit * 2]
+    claimed = []
+    for task_id in candidates:
+        taken = Task.objects.filter(_claimable(now), id=task_id).update(
+            status=Task.RUNNING,
+            locked_at=now,
+            locked_by=worker_id,
+            attempts=F('attempts') + 1
+        )
+        if taken:
+            claimed.append(Task.objects.get(id=task_id))
+            if len(claimed) == limit:
+                break
+    return claimed
+
+
+def execute(task):
+    """Run a claimed task, delete it on success or schedule a retry"""
+    try:
+        func = _registry[task.name]
+        payload = json.loads(task.payload)
+        func(*payload['args'], **payload['kwargs'])
+    except Exception:
+        error = traceback.format_exc()
+        logger.exception('Task %s failed', task.name)
+        if task.attempts >= task.max_attempts:
+            fields = {'status': Task.FAILED}
+        else:
+            fields = {
+                'status': Task.QUEUED,
+                'run_at': timezone.now() + timedelta(
+                    seconds=backoff(task.attempts)
+                ),
+            }
+        Task.objects.filter(id=task.id).update(
+            last_error=error, locked_at=None, locked_by='', **fields
+        )
+        return False
+    Task.objects.filter(id=task.id).delete()
+    return True
+
+
+def run_pending(worker_id='sync', limit=None):
+    """Run due tasks in the calling thread until none are left
+
+    Returns the number of tasks run, tests use it to drain the queue.
+    """
+    count = 0
+    while limit is None or count < limit:
+        tasks = claim(worker_id)
+        if not tasks:
+            break
+        execute(tasks[0])
+        count += 1
+    return count
+
+
+class Worker:
+    """Poll the queue from a number of threads"""
+
+    def __init__(self, threads=1, poll=1.0, burst=False):
+        self.threads = threads
+        self.poll = poll
+        self.burst = burst
+        self.stopping = threading.Event()
+        self.id = f'{socket.gethostname()}:{os.getpid()}'
+
+    def _loop(self, index):
+        worker_id = f'{self.id}:{index}'
+        while not self.stopping.is_set():
+            close_old_connections()
+            try:
+                tasks = claim(worker_id)
+                if tasks:
+                    execute(tasks[0])
+            except Exception:
+                # e.g. a lost connection while claiming or while recording
+                # the outcome, the task is retried once its lock is stale
+                logger.exception('Worker %s failed', worker_id)
+                close_old_connections()
+                self.stopping.wait(self.poll)
+                continue
+            if not tasks:
+                if self.burst:
+                    break
+                self.stopping.wait(self.poll)
+        close_old_connections()
+
+    def _terminate(self, signum, frame):
+        logger.info('Worker %s stopping on signal %s', self.id, signum)
+        self.stopping.set()
+
+    def run(self):
+        """Run until stopped, SIGTERM lets the running tasks finish"""
+        previous = None
+        if threading.current_thread() is threading.main_thread():
+            previous = signal.signal(signal.SIGTERM, self._terminate)
+        threads = [
+            threading.Thread(target=self._loop, args=(index,), daemon=True)
+            for index in range(self.threads)
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(0.5)
+        except KeyboardInterrupt:
+            self.stopping.set()
+            for thread in threads:
+                thread.join()
+        finally:
+            if previous is not None:
+                signal.signal(signal.SIGTERM, previous)
+
+    def stop(self):
+        self.stopping.set()
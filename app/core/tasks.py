@@ -0,0 +1,47 @@
+from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
+
+from core import purge, sharding, stats
+from core.models import Recipe
+from core.taskqueue import task
+
+
+@task
+def purge_recipe(recipe_id, user_id=None):
+    """Delete a soft deleted recipe and its image"""
+    aliases = (
+        [sharding.shard_for(user_id, fresh=True)] if user_id is not None
+        else sharding.shards()
+    )
+    for alias in aliases:
+        with sharding.use(alias):
+            purge.purge_recipe(recipe_id)
+
+
+@task
+def purge_user(user_id):
+    """Delete a soft deleted user with all of its data"""
+    user = get_user_model().objects.filter(
+        id=user_id, deleted_at__isnull=False
+    ).first()
+    if user is not None:
+        with sharding.for_user(user.id):
+            purge.purge_user(user)
+
+
+@task
+def recompute_stats(user_id):
+    """Rebuild the recipe statistics of a user"""
+    user = get_user_model().objects.filter(id=user_id).first()
+    if user is not None:
+        with sharding.for_user(user.id):
+            stats.recompute(user)
+
+
+@task
+def delete_file(name):
+    """Remove a file no row refers to anymore"""
+    for alias in sharding.shards():
+        if Recipe.all_objects.using(alias).filter(image=name).exists():
+            return
+    default_storage.delete(name)
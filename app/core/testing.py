@@ -0,0 +1,74 @@
+import json
+import os
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from core.slow_queries import normalize_sql
+
+
+BUDGETS_PATH = os.path.join(os.path.dirname(__file__), 'query_budgets.json')
+
+# wall time budgets are multiplied by this to absorb slow CI machines
+TIME_FACTOR = float(os.environ.get('QUERY_BUDGET_TIME_FACTOR', '1'))
+
+# writes read the shard map uncached once there are several shards
+SHARD_LOOKUPS = int(len(settings.SHARDS) > 1)
+
+
+def load_budgets(path=BUDGETS_PATH):
+    """Return the committed per endpoint budgets keyed by url name"""
+    with open(path) as budgets:
+        return json.load(budgets)
+
+
+def format_queries(queries):
+    """Describe captured queries, repeated statements (N+1) first"""
+    counts = Counter(normalize_sql(query['sql']) for query in queries)
+    lines = [
+        f'  {count}x {sql}' for sql, count in counts.most_common()
+    ]
+    return '\n'.join(lines)
+
+
+class QueryBudgetMixin:
+    """TestCase mixin failing when an API call exceeds its budget
+
+    Budgets live in ``core/query_budgets.json`` keyed by url name, with
+    a maximum number of queries and optionally of milliseconds.
+    """
+    query_budgets = None
+
+    @classmethod
+    def get_query_budgets(cls):
+        if cls.query_budgets is None:
+            cls.query_budgets = load_budgets()
+        return cls.query_budgets
+
+    @contextmanager
+    def assertWithinBudget(self, url_name):
+        budget = self.get_query_budgets().get(url_name)
+        if budget is None:
+            self.fail(f'No query budget committed for {url_name}')
+
+        start = time.perf_counter()
+        with CaptureQueriesContext(connection) as context:
+            yield context
+        elapsed = (time.perf_counter() - start) * 1000
+
+        queries = context.captured_queries
+        if len(queries) > budget['queries']:
+            self.fail(
+                f'{url_name} executed {len(queries)} queries, budget is '
+                f'{budget["queries"]}:\n{format_queries(queries)}'
+            )
+        limit = budget.get('ms')
+        if limit is not None and elapsed > limit * TIME_FACTOR:
+            self.fail(
+                f'{url_name} took {elapsed:.1f}ms, budget is '
+                f'{limit * TIME_FACTOR:.1f}ms:\n{format_queries(queries)}'
+            )
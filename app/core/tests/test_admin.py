@@ -1,6 +1,64 @@
-from django.test import TestCase, Client
+from unittest.mock import MagicMock, patch
+
+from django.contrib.admin.sites import site
+from django.test import TestCase, Client, RequestFactory
 from django.contrib.auth import get_user_model
 from django.urls import reverse
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from core.admin import EstimatedCountPaginator
+from core.models import Tag, Ingredient, Recipe
+
+
+def postgresql(reltuples):
+    """connections stand-in whose pg_class estimate is ``reltuples``"""
+    connection = MagicMock(vendor='postgresql')
+    cursor = connection.cursor.return_value.__enter__.return_value
+    cursor.fetchone.return_value = (reltuples,)
+    return {'default': connection}
+
+
+class EstimatedCountPaginatorTests(TestCase):
+
+    def setUp(self):
+        user = get_user_model().objects.create_user('m@gmail.com', 'pass')
+        Recipe.objects.create(user=user, title='Dal', price=5)
+        self.recipes = Recipe.objects.order_by('id')
+
+    def test_unfiltered_recipes_use_estimate(self):
+        """Test the soft delete condition does not force a COUNT(*)"""
+        paginator = EstimatedCountPaginator(self.recipes, 100)
+
+        with patch('core.admin.connections', postgresql(250000)):
+            self.assertEqual(paginator.count, 250000)
+
+    def test_filtered_changelist_counts_exactly(self):
+        paginator = EstimatedCountPaginator(self.recipes, 100, filtered=True)
+
+        with patch('core.admin.connections', postgresql(250000)):
+            self.assertEqual(paginator.count, 1)
+
+    def test_small_tables_count_exactly(self):
+        paginator = EstimatedCountPaginator(self.recipes, 100)
+
+        with patch('core.admin.connections', postgresql(50)):
+            self.assertEqual(paginator.count, 1)
+
+    def test_admin_tells_filtered_from_request(self):
+        model_admin = site._registry[Recipe]
+        factory = RequestFactory()
+
+        def filtered(**params):
+            request = factory.get('/', params)
+            return model_admin.get_paginator(
+                request, self.recipes, 100
+            ).filtered
+
+        self.assertFalse(filtered())
+        self.assertFalse(filtered(p='2', o='1', q=' '))
+        self.assertTrue(filtered(q='dal'))
+        self.assertTrue(filtered(user__id__exact='1'))
 
 
 class AdminSiteTests(TestCase):
@@ -25,3 +83,63 @@ class AdminSiteTests(TestCase):
 
         self.assertContains(res, self.user.name)
         self.assertContains(res, self.user.email)
+
+    def test_user_search_by_exact_email(self):
+        """Test the email search is an equality the unique index serves"""
+        url = reverse('admin:core_user_changelist')
+
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.get(url, {'q': ' test@LondonAppDev.com '})
+
+        self.assertContains(res, self.user.name)
+        searches = [
+            query['sql'] for query in queries
+            if 'test@londonappdev.com' in query['sql']
+        ]
+        self.assertTrue(searches)
+        for sql in searches:
+            self.assertIn('"core_user"."email" = ', sql)
+            self.assertNotIn('UPPER', sql)
+            self.assertNotIn('LIKE', sql)
+
+    def create_recipes(self, count):
+        for i in range(count):
+            recipe = Recipe.objects.create(
+                user=self.user, title=f'Recipe {i}', price=5
+            )
+            recipe.tag.add(Tag.objects.create(user=self.user, name=f'T{i}'))
+
+    def test_recipe_changelist_queries_constant(self):
+        """Test the recipe changelist does not query per row"""
+        url = reverse('admin:core_recipe_changelist')
+        self.create_recipes(2)
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(url)
+        self.create_recipes(10)
+        with CaptureQueriesContext(connection) as many:
+            res = self.client.get(url)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(few), len(many))
+
+    def test_recipe_search_by_title_prefix(self):
+        """Test recipes are searched by case insensitive title prefix"""
+        Recipe.objects.create(user=self.user, title='Dal Tadka', price=5)
+        Recipe.objects.create(user=self.user, title='Paneer Dal', price=5)
+        url = reverse('admin:core_recipe_changelist')
+
+        res = self.client.get(url, {'q': 'dal'})
+
+        self.assertContains(res, 'Dal Tadka')
+        self.assertNotContains(res, 'Paneer Dal')
+
+    def test_recipe_change_page_uses_autocomplete(self):
+        """Test the recipe form does not render every tag"""
+        Ingredient.objects.create(user=self.user, name='Unrelated salt')
+        recipe = Recipe.objects.create(user=self.user, title='Dal', price=5)
+        url = reverse('admin:core_recipe_change', args=[recipe.id])
+
+        res = self.client.get(url)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotContains(res, 'Unrelated salt')
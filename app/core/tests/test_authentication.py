@@ -0,0 +1,98 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import exceptions
+from rest_framework.test import APIClient
+
+from core.authentication import ExpiringTokenAuthentication
+from core.models import AuthToken
+
+
+ME_URL = reverse('user:me')
+
+
+def expire(token, seconds=1):
+    AuthToken.objects.filter(key=token.key).update(
+        expires=timezone.now() - timedelta(seconds=seconds)
+    )
+
+
+class ExpiringTokenTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'manish@gmail.com', 'testpass'
+        )
+        self.client = APIClient()
+
+    def test_valid_token_authenticates(self):
+        token = AuthToken.issue(self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+        res = self.client.get(ME_URL)
+
+        self.assertEqual(res.status_code, 200)
+
+    def test_expired_token_rejected_in_one_query(self):
+        token = AuthToken.issue(self.user)
+        expire(token)
+
+        with self.assertNumQueries(1):
+            with self.assertRaisesMessage(exceptions.AuthenticationFailed,
+                                          'Token has expired.'):
+                ExpiringTokenAuthentication().authenticate_credentials(
+                    token.key
+                )
+
+    @override_settings(AUTH_TOKEN_TTL=3600,
+                       AUTH_TOKEN_REFRESH_INTERVAL=600)
+    def test_expiry_slides_at_most_once_per_interval(self):
+        token = AuthToken.issue(self.user)
+        authenticate = ExpiringTokenAuthentication().authenticate_credentials
+
+        with self.assertNumQueries(1):
+            authenticate(token.key)
+
+        AuthToken.objects.filter(key=token.key).update(
+            expires=timezone.now() + timedelta(seconds=2000)
+        )
+        with self.assertNumQueries(2):
+            authenticate(token.key)
+        token.refresh_from_db()
+        self.assertGreater(
+            token.expires, timezone.now() + timedelta(seconds=3500)
+        )
+
+    def test_token_per_device(self):
+        phone = AuthToken.issue(self.user, 'phone')
+        laptop = AuthToken.issue(self.user, 'laptop')
+        rotated = AuthToken.issue(self.user, 'phone')
+
+        keys = set(AuthToken.objects.values_list('key', flat=True))
+        self.assertEqual(keys, {laptop.key, rotated.key})
+        self.assertNotEqual(phone.key, rotated.key)
+
+    @override_settings(AUTH_TOKEN_MAX_PER_USER=2)
+    def test_oldest_tokens_dropped_beyond_max(self):
+        for _ in range(3):
+            AuthToken.issue(self.user)
+
+        self.assertEqual(AuthToken.objects.filter(user=self.user).count(), 2)
+
+    def test_purge_expired_tokens_command(self):
+        kept = AuthToken.issue(self.user)
+        for _ in range(5):
+            expire(AuthToken.issue(self.user), seconds=60)
+        out = StringIO()
+
+        call_command('purge_expired_tokens', '--batch-size', '2', stdout=out)
+
+        self.assertIn('Purged 5 expired tokens', out.getvalue())
+        self.assertEqual(
+            list(AuthToken.objects.values_list('key', flat=True)), [kept.key]
+        )
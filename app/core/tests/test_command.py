@@ -1,9 +1,13 @@
 from unittest.mock import patch
 
+from django.conf import settings
+from django.contrib.auth import get_user_model
 from django.core.management import call_command
 from django.db.utils import OperationalError
 from django.test import TestCase
 
+from core.models import Tag, Ingredient, Recipe
+
 
 class CommandTest(TestCase):
     def test_wait_for_db_ready(self):
@@ -20,3 +24,64 @@ class CommandTest(TestCase):
             gi.side_effect = [OperationalError] * 5 + [True]
             call_command('wait_for_db')
             self.assertEqual(gi.call_count, 6)
+
+
+class PurgeDeletedCommandTest(TestCase):
+    databases = set(settings.SHARDS)
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'test@londonappdev.com',
+            'testpass'
+        )
+
+    def sample_recipe(self, user, **params):
+        return Recipe.objects.create(
+            user=user, title='Sample', price=5, **params
+        )
+
+    def test_purge_deleted_recipes(self):
+        """Test only soft deleted recipes are purged, in batches"""
+        kept = self.sample_recipe(self.user)
+        for _ in range(5):
+            recipe = self.sample_recipe(self.user)
+            recipe.tag.add(Tag.objects.create(user=self.user, name='x'))
+            recipe.soft_delete()
+
+        call_command('purge_deleted', batch_size=2)
+
+        self.assertEqual(list(Recipe.all_objects.all()), [kept])
+        self.assertEqual(Recipe.tag.through.objects.count(), 0)
+
+    def test_purge_respects_grace_period(self):
+        """Test recently deleted recipes survive with a grace period"""
+        self.sample_recipe(self.user).soft_delete()
+
+        call_command('purge_deleted', grace_hours=1)
+
+        self.assertEqual(Recipe.all_objects.count(), 1)
+
+    @patch('core.purge.transaction.on_commit',
+           side_effect=lambda f, using=None: f())
+    @patch('core.purge.default_storage')
+    def test_purge_deleted_user(self, storage, on_commit):
+        """Test a soft deleted user is purged with all of its data"""
+        other = get_user_model().objects.create_user(
+            'other@londonappdev.com',
+            'testpass'
+        )
+        self.sample_recipe(other)
+        self.sample_recipe(self.user, image='upload/recipe/a.jpg')
+        Tag.objects.create(user=self.user, name='Vegan')
+        Ingredient.objects.create(user=self.user, name='Salt')
+        self.user.soft_delete()
+
+        call_command('purge_deleted')
+
+        self.assertFalse(
+            get_user_model().objects.filter(id=self.user.id).exists()
+        )
+        self.assertEqual(Recipe.all_objects.count(), 1)
+        self.assertEqual(Tag.objects.count(), 0)
+        self.assertEqual(Ingredient.objects.count(), 0)
+        storage.delete.assert_called_once_with('upload/recipe/a.jpg')
@@ -0,0 +1,206 @@
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+
+from core import concurrency, metrics
+from core.middleware import ConcurrencyLimitMiddleware
+
+
+CLASSES = {
+    'read': {'initial': 2, 'min': 1, 'max': 4, 'latency': 0.5,
+             'share': 1.0},
+    'write': {'initial': 2, 'min': 1, 'max': 4, 'latency': 0.5,
+              'share': 0.75},
+    'expensive': {'initial': 2, 'min': 1, 'max': 4, 'latency': 0.5,
+                  'share': 0.5},
+}
+
+
+class AdaptiveLimitTests(TestCase):
+
+    def test_slow_requests_shrink_the_limit(self):
+        limit = concurrency.AdaptiveLimit(10, 2, 20, latency=0.1)
+
+        limit.acquire()
+        limit.release(0.5, now=0)
+
+        self.assertEqual(limit.limit, 9)
+        for second in range(1, 51):
+            limit.acquire()
+            limit.release(0.5, now=second)
+        self.assertEqual(limit.limit, 2)
+
+    def test_limit_shrinks_once_per_latency_window(self):
+        """Test a burst of slow completions counts as one decrease"""
+        limit = concurrency.AdaptiveLimit(10, 2, 20, latency=0.1)
+
+        for _ in range(5):
+            limit.acquire()
+        for _ in range(5):
+            limit.release(0.5, now=100)
+        self.assertEqual(limit.limit, 9)
+
+        limit.acquire()
+        limit.release(0.5, now=100.2)
+        self.assertAlmostEqual(limit.limit, 8.1)
+
+    def test_failures_shrink_the_limit(self):
+        limit = concurrency.AdaptiveLimit(10, 2, 20, latency=1)
+
+        limit.acquire()
+        limit.release(0.01, failed=True)
+
+        self.assertEqual(limit.limit, 9)
+
+    def test_fast_requests_grow_a_used_limit(self):
+        limit = concurrency.AdaptiveLimit(4, 1, 5, latency=1)
+
+        for _ in range(2):
+            limit.acquire()
+        limit.release(0.01)
+
+        self.assertEqual(limit.limit, 4.25)
+
+    def test_fast_requests_do_not_grow_an_idle_limit(self):
+        limit = concurrency.AdaptiveLimit(4, 1, 5, latency=1)
+
+        limit.acquire()
+        limit.release(0.01)
+
+        self.assertEqual(limit.limit, 4)
+
+    def test_acquire_refused_at_the_limit(self):
+        limit = concurrency.AdaptiveLimit(2, 1, 5, latency=1)
+
+        self.assertTrue(limit.acquire())
+        self.assertTrue(limit.acquire())
+        self.assertFalse(limit.acquire())
+        self.assertEqual(limit.shed, 1)
+
+
+class LimiterTests(TestCase):
+
+    def setUp(self):
+        self.limiter = concurrency.Limiter(CLASSES, max_inflight=4)
+
+    def test_classify(self):
+        classify = self.limiter.classify
+        self.assertEqual(classify('GET', '/api/recipe/recipes/'), 'read')
+        self.assertEqual(classify('PATCH', '/api/recipe/recipes/1/'),
+                         'write')
+        self.assertEqual(
+            classify('POST', '/api/recipe/recipe/1/upload-image/'),
+            'expensive'
+        )
+        self.assertEqual(classify('POST', '/api/user/create/'), 'expensive')
+        self.assertEqual(classify('GET', '/api/user/create/'), 'read')
+
+    def test_expensive_shed_before_reads(self):
+        """Test uploads are refused while reads are still admitted"""
+        self.assertTrue(self.limiter.acquire('read'))
+        self.assertTrue(self.limiter.acquire('expensive'))
+
+        self.assertFalse(self.limiter.acquire('expensive'))
+        self.assertTrue(self.limiter.acquire('write'))
+        self.assertFalse(self.limiter.acquire('write'))
+        self.assertTrue(self.limiter.acquire('read'))
+        self.assertEqual(self.limiter.limits['expensive'].shed, 1)
+
+    def test_collect_exports_state(self):
+        self.limiter.acquire('read')
+
+        samples = {name: values for name, _, _, values
+                   in self.limiter.collect()}
+
+        self.assertIn(({'class': 'read'}, 1),
+                      samples['api_concurrency_inflight'])
+        self.assertIn(({'class': 'write'}, 2.0),
+                      samples['api_concurrency_limit'])
+
+
+class ConcurrencyLimitMiddlewareTests(TestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.middleware = ConcurrencyLimitMiddleware(
+            lambda request: HttpResponse('ok')
+        )
+        self.middleware.limiter = concurrency.Limiter(
+            CLASSES, max_inflight=4
+        )
+
+    def test_request_released_after_response(self):
+        res = self.middleware(self.factory.get('/api/recipe/recipes/'))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(self.middleware.limiter.inflight(), 0)
+
+    def test_streaming_response_released_on_close(self):
+        """Test a streamed response keeps its slot until it is closed"""
+        middleware = ConcurrencyLimitMiddleware(
+            lambda request: StreamingHttpResponse(iter([b'[', b']']))
+        )
+        middleware.limiter = self.middleware.limiter
+
+        res = middleware(self.factory.get('/api/recipe/recipes/'))
+        self.assertEqual(middleware.limiter.inflight(), 1)
+
+        self.assertEqual(b''.join(res), b'[]')
+        res.close()
+        res.close()
+        self.assertEqual(middleware.limiter.inflight(), 0)
+
+    def test_shed_request_gets_503_with_retry_after(self):
+        self.middleware.limiter.acquire('read')
+        self.middleware.limiter.acquire('read')
+
+        res = self.middleware(self.factory.get('/api/recipe/recipes/'))
+
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(res['Retry-After'], '1')
+
+    def test_exempt_path_not_limited(self):
+        self.middleware.limiter.acquire('read')
+        self.middleware.limiter.acquire('read')
+
+        res = self.middleware(self.factory.get('/metrics/'))
+
+        self.assertEqual(res.status_code, 200)
+
+    def test_server_error_shrinks_the_limit(self):
+        middleware = ConcurrencyLimitMiddleware(
+            lambda request: HttpResponse(status=500)
+        )
+        middleware.limiter = self.middleware.limiter
+
+        middleware(self.factory.post('/api/recipe/recipes/'))
+
+        self.assertLess(middleware.limiter.limits['write'].limit, 2)
+
+
+class MetricsViewTests(TestCase):
+
+    def test_limiter_state_exported(self):
+        concurrency.limiter()
+
+        res = self.client.get(reverse('metrics'))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(b'api_concurrency_limit{class="read"}', res.content)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_token_required_when_configured(self):
+        res = self.client.get(reverse('metrics'))
+        self.assertEqual(res.status_code, 401)
+
+        res = self.client.get(reverse('metrics'),
+                              HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(res.status_code, 200)
+
+    def test_render_labels(self):
+        def collector():
+            return [('jobs', 'Jobs', 'gauge', [({'queue': 'a"b'}, 3)])]
+        metrics.register(collector)
+        self.addCleanup(metrics._collectors.remove, collector)
+
+        self.assertIn('jobs{queue="a\\"b"} 3\n', metrics.render())
@@ -0,0 +1,69 @@
+import gzip
+
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+
+from core import middleware
+
+
+BODY = b'{"title": "Paneer Tikka Masala"}' * 100
+
+
+def view(body=BODY, streaming=False):
+    def get_response(request):
+        if streaming:
+            return StreamingHttpResponse(iter([body[:1000], body[1000:]]))
+        response = HttpResponse(body)
+        response['ETag'] = '"abc"'
+        return response
+    return get_response
+
+
+class CompressionMiddlewareTests(TestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def request(self, accept='gzip'):
+        return self.factory.get('/', HTTP_ACCEPT_ENCODING=accept)
+
+    def test_gzip_compresses_large_response(self):
+        """Test large responses are gzipped and the ETag weakened"""
+        response = middleware.CompressionMiddleware(view())(self.request())
+
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.content), BODY)
+        self.assertEqual(response['ETag'], 'W/"abc"')
+        self.assertIn('Accept-Encoding', response['Vary'])
+
+    @override_settings(COMPRESSION_MIN_SIZE=10000)
+    def test_small_response_untouched(self):
+        """Test responses under the threshold are not compressed"""
+        response = middleware.CompressionMiddleware(view())(self.request())
+
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(response.content, BODY)
+
+    def test_unsupported_encoding_untouched(self):
+        """Test clients not accepting a known coding get plain content"""
+        for accept in ('identity', 'gzip;q=0', ''):
+            response = middleware.CompressionMiddleware(view())(
+                self.request(accept)
+            )
+            self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_streaming_response(self):
+        """Test streamed content is compressed chunk by chunk"""
+        response = middleware.CompressionMiddleware(
+            view(streaming=True)
+        )(self.request())
+
+        content = b''.join(response.streaming_content)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(content), BODY)
+
+    def test_parse_accept_encoding(self):
+        self.assertEqual(
+            middleware.parse_accept_encoding('br;q=0.5, gzip, zstd;q=x'),
+            {'br': 0.5, 'gzip': 1.0, 'zstd': 0.0}
+        )
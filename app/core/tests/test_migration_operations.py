@@ -0,0 +1,218 @@
+from io import StringIO
+from unittest.mock import MagicMock
+
+from django.core.management import call_command
+from django.db import connection, migrations, models
+from django.db.migrations.loader import MigrationLoader
+from django.db.models import F, IntegerField, Q
+from django.db.models.functions import Cast
+from django.test import TestCase, TransactionTestCase
+from django.contrib.auth import get_user_model
+
+from core import migration_lint
+from core.migration_operations import AddIndexConcurrently, Backfill, \
+    RemoveIndexConcurrently, create_index_concurrently
+from core.models import Recipe
+
+
+INDEX = models.Index(fields=['name'], name='core_tag_name_test_idx')
+
+
+def migration(operations, atomic=True):
+    instance = migrations.Migration('9999_test', 'core')
+    instance.operations = operations
+    instance.atomic = atomic
+    return instance
+
+
+class BackfillTests(TestCase):
+
+    def setUp(self):
+        user = get_user_model().objects.create_user('m@gmail.com', 'pass')
+        for minutes in range(5):
+            Recipe.objects.create(
+                user=user, title='Dal', time_minutes=minutes + 1, price=1
+            )
+        self.backfill = Backfill(
+            'recipe', 'price_cents', Cast(F('time_minutes'), IntegerField()),
+            where=Q(price_cents=100), batch_size=2, pause=0
+        )
+
+    def test_backfill_in_batches(self):
+        updated = self.backfill.run(Recipe, 'default')
+
+        self.assertEqual(updated, 5)
+        self.assertEqual(
+            sorted(Recipe.objects.values_list('price_cents', flat=True)),
+            [1, 2, 3, 4, 5]
+        )
+
+    def test_backfill_resumes_with_pending_rows(self):
+        Recipe.objects.filter(time_minutes__lte=3).update(price_cents=-1)
+
+        self.assertEqual(self.backfill.run(Recipe, 'default'), 2)
+        self.assertEqual(self.backfill.run(Recipe, 'default'), 0)
+
+    def test_deconstruct(self):
+        name, args, kwargs = self.backfill.deconstruct()
+
+        self.assertEqual(name, 'Backfill')
+        self.assertEqual(kwargs['batch_size'], 2)
+        self.assertEqual(kwargs['where'], Q(price_cents=100))
+
+
+class ConcurrentIndexTests(TransactionTestCase):
+
+    def indexes(self):
+        with connection.cursor() as cursor:
+            return connection.introspection.get_constraints(
+                cursor, 'core_tag'
+            )
+
+    def test_add_and_remove_index(self):
+        """Test the index operations fall back to plain DDL off postgres"""
+        state = MigrationLoader(connection).project_state()
+        added = state.clone()
+        add = AddIndexConcurrently('tag', INDEX)
+        add.state_forwards('core', added)
+
+        with connection.schema_editor(atomic=False) as editor:
+            add.database_forwards('core', editor, state, added)
+        self.assertIn(INDEX.name, self.indexes())
+
+        removed = added.clone()
+        remove = RemoveIndexConcurrently('tag', INDEX.name)
+        remove.state_forwards('core', removed)
+        with connection.schema_editor(atomic=False) as editor:
+            remove.database_forwards('core', editor, added, removed)
+        self.assertNotIn(INDEX.name, self.indexes())
+
+    def test_raw_concurrent_index(self):
+        """Test expression indexes are built concurrently outside atomic"""
+        editor = MagicMock(atomic_migration=False)
+        editor.quote_name.side_effect = lambda name: f'"{name}"'
+        cursor = editor.connection.cursor.return_value.__enter__.return_value
+        cursor.fetchone.return_value = None
+
+        create_index_concurrently(
+            editor, 'core_tag_lower_name_idx', 'core_tag', 'lower(name)'
+        )
+
+        editor.execute.assert_called_once_with(
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS '
+            '"core_tag_lower_name_idx" ON "core_tag" (lower(name))'
+        )
+        editor.atomic_migration = True
+        with self.assertRaises(ValueError):
+            create_index_concurrently(
+                editor, 'core_tag_lower_name_idx', 'core_tag', 'lower(name)'
+            )
+
+
+class LintMigrationsTests(TestCase):
+
+    def setUp(self):
+        self.state = MigrationLoader(None).project_state()
+
+    def lint(self, operations, atomic=True):
+        return migration_lint.lint_migration(
+            migration(operations, atomic), self.state
+        )
+
+    def test_plain_index_flagged(self):
+        problems = self.lint([migrations.AddIndex('tag', INDEX)])
+
+        self.assertEqual(len(problems), 1)
+        self.assertIn('AddIndexConcurrently', problems[0])
+
+    def test_concurrent_index_needs_non_atomic_migration(self):
+        add = AddIndexConcurrently('tag', INDEX)
+
+        self.assertEqual(len(self.lint([add])), 1)
+        self.assertEqual(self.lint([add], atomic=False), [])
+
+    def test_indexed_field_flagged(self):
+        field = models.CharField(max_length=10, default='', db_index=True)
+
+        problems = self.lint([migrations.AddField('recipe', 'slug', field)])
+
+        self.assertIn('indexed column', problems[0])
+
+    def test_not_null_field_with_default_flagged(self):
+        field = models.IntegerField(default=0)
+
+        problems = self.lint([migrations.AddField('recipe', 'rank', field)])
+
+        self.assertEqual(len(problems), 1)
+        self.assertIn('add it nullable, Backfill', problems[0])
+
+    def test_auto_now_field_flagged(self):
+        field = models.DateTimeField(auto_now=True)
+
+        problems = self.lint([migrations.AddField('tag', 'seen_at', field)])
+
+        self.assertEqual(len(problems), 1)
+        self.assertIn('with a default', problems[0])
+
+    def test_nullable_field_allowed(self):
+        field = models.IntegerField(null=True)
+
+        self.assertEqual(
+            self.lint([migrations.AddField('recipe', 'rank', field)]), []
+        )
+
+    def test_alter_field_without_schema_change_allowed(self):
+        field = models.CharField(max_length=255, help_text='Tag name')
+
+        self.assertEqual(
+            self.lint([migrations.AlterField('tag', 'name', field)]), []
+        )
+
+    def test_dropping_foreign_key_constraint_allowed(self):
+        field = models.ForeignKey(
+            'core.User', on_delete=models.CASCADE, db_constraint=False
+        )
+        operation = migrations.AlterField('tag', 'user', field)
+
+        self.assertEqual(self.lint([operation]), [])
+
+    def test_adding_foreign_key_constraint_flagged(self):
+        # the user foreign keys are already without constraint
+        field = models.ForeignKey('core.User', on_delete=models.CASCADE)
+
+        problems = self.lint([migrations.AlterField('tag', 'user', field)])
+
+        self.assertEqual(len(problems), 1)
+
+    def test_alter_field_added_in_same_migration(self):
+        operations = [
+            migrations.AddField(
+                'tag', 'seen_at', models.DateTimeField(null=True)
+            ),
+            migrations.AlterField(
+                'tag', 'seen_at',
+                models.DateTimeField(null=True, auto_now=True)
+            ),
+        ]
+
+        self.assertEqual(self.lint(operations), [])
+
+    def test_new_model_not_flagged(self):
+        operations = [
+            migrations.CreateModel('Note', [
+                ('id', models.AutoField(primary_key=True)),
+                ('text', models.TextField()),
+            ]),
+            migrations.AddIndex('note', models.Index(
+                fields=['text'], name='core_note_text_idx'
+            )),
+        ]
+
+        self.assertEqual(self.lint(operations), [])
+
+    def test_shipped_migrations_pass(self):
+        out = StringIO()
+
+        call_command('lint_migrations', stdout=out)
+
+        self.assertIn('No blocking operations', out.getvalue())
@@ -1,4 +1,6 @@
 """"""
+from decimal import Decimal
+
 from django.test import TestCase
 from django.contrib.auth import get_user_model
 from unittest.mock import patch
@@ -74,6 +76,30 @@ class ModelTests(TestCase):
         )
         self.assertEqual(str(recipe), recipe.title)
 
+    def test_recipe_price_cents(self):
+        """test the price is mirrored as integer cents"""
+        recipe = models.Recipe.objects.create(
+            user=sample_user(),
+            title='Poha',
+            price=4.35
+        )
+        self.assertEqual(recipe.price_cents, 435)
+        self.assertEqual(models.cents_to_str(recipe.price_cents), '4.35')
+        self.assertEqual(models.cents_to_str(-5), '-0.05')
+
+    def test_recipe_price_cents_with_update_fields(self):
+        """test saving only the price also writes the cents"""
+        recipe = models.Recipe.objects.create(
+            user=sample_user(),
+            title='Poha',
+            price=4.35
+        )
+        recipe.price = Decimal('6.10')
+        recipe.save(update_fields=['price'])
+
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.price_cents, 610)
+
     @patch('uuid.uuid4')
     def test_recipe_filename_uuid(self, mock_uuid):
         """test the file is saved in  correct location"""
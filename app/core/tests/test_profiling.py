@@ -0,0 +1,106 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from django.contrib.auth import get_user_model
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+
+from core import profiling
+from core.middleware import ProfilingMiddleware
+from core.models import AuthToken, Tag
+
+
+def slow_view(request):
+    """spends time in python and in a query"""
+    deadline = time.perf_counter() + 0.05
+    while time.perf_counter() < deadline:
+        pass
+    list(Tag.objects.all())
+    return HttpResponse('ok', status=201)
+
+
+class SamplerTests(TestCase):
+
+    def test_samples_and_queries_recorded(self):
+        with profiling.Sampler(interval=0.001) as sampler:
+            slow_view(None)
+
+        self.assertTrue(sampler.samples)
+        self.assertEqual(len(sampler.queries), 1)
+        self.assertIn('slow_view (core/tests/test_profiling.py:',
+                      sampler.collapsed())
+
+    def test_speedscope_format(self):
+        with profiling.Sampler(interval=0.001) as sampler:
+            slow_view(None)
+
+        profile = json.loads(sampler.speedscope('GET /'))
+
+        samples = profile['profiles'][0]['samples']
+        self.assertEqual(len(samples), len(sampler.samples))
+        frame = profile['shared']['frames'][samples[0][-1]]
+        self.assertIn('name', frame)
+
+
+@override_settings(PROFILE_SAMPLE_EVERY=0)
+class ProfilingMiddlewareTests(TestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.middleware = ProfilingMiddleware(slow_view)
+        self.staff = get_user_model().objects.create_user(
+            'staff@gmail.com', 'testpass', is_staff=True
+        )
+        self.token = AuthToken.issue(self.staff)
+
+    def get(self, path='/api/recipe/tags/', **extra):
+        return self.middleware(self.factory.get(path, **extra))
+
+    def test_not_profiled_without_flag(self):
+        res = self.get(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(res.content, b'ok')
+
+    def test_staff_gets_profile(self):
+        res = self.get(HTTP_X_PROFILE='collapsed',
+                       HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res['X-Profile-Status'], '201')
+        self.assertEqual(res['X-Profile-Queries'], '1')
+        self.assertIn(b'slow_view', res.content)
+
+    def test_query_flag_speedscope(self):
+        res = self.get('/api/recipe/tags/?profile=speedscope',
+                       HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+        self.assertEqual(res['Content-Type'], 'application/json')
+        self.assertEqual(json.loads(res.content)['name'],
+                         'GET /api/recipe/tags/')
+
+    def test_non_staff_not_profiled(self):
+        user = get_user_model().objects.create_user('u@gmail.com', 'pass')
+        token = AuthToken.issue(user)
+
+        res = self.get(HTTP_X_PROFILE='collapsed',
+                       HTTP_AUTHORIZATION=f'Token {token.key}')
+
+        self.assertEqual(res.content, b'ok')
+
+    def test_sampled_requests_stored(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+
+        with self.settings(PROFILE_SAMPLE_EVERY=2, PROFILE_DIR=directory):
+            middleware = ProfilingMiddleware(slow_view)
+            for _ in range(4):
+                res = middleware(self.factory.get('/api/recipe/tags/'))
+
+        self.assertEqual(res.content, b'ok')
+        names = sorted(os.listdir(directory))
+        self.assertEqual(len(names), 2)
+        self.assertTrue(names[0].endswith('-GET-api_recipe_tags.collapsed'))
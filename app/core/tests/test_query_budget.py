@@ -0,0 +1,35 @@
+from django.test import TestCase
+
+from core import testing
+from core.models import Tag
+
+
+class QueryBudgetMixinTests(testing.QueryBudgetMixin, TestCase):
+    query_budgets = {'tags': {'queries': 1}}
+
+    def test_within_budget(self):
+        """Test a call within its budget passes"""
+        with self.assertWithinBudget('tags'):
+            list(Tag.objects.all())
+
+    def test_over_budget_reports_queries(self):
+        """Test exceeding the budget fails listing the repeated SQL"""
+        with self.assertRaises(AssertionError) as context:
+            with self.assertWithinBudget('tags'):
+                for pk in (1, 2, 3):
+                    list(Tag.objects.filter(pk=pk))
+
+        message = str(context.exception)
+        self.assertIn('executed 3 queries, budget is 1', message)
+        self.assertIn('3x SELECT', message)
+
+    def test_unknown_budget(self):
+        """Test a missing budget is reported"""
+        with self.assertRaises(AssertionError):
+            with self.assertWithinBudget('missing'):
+                pass
+
+    def test_committed_budgets_load(self):
+        """Test the committed budgets file is valid"""
+        budgets = testing.load_budgets()
+        self.assertEqual(budgets['recipe:recipe-list']['queries'], 4)
@@ -0,0 +1,159 @@
+from io import StringIO
+from unittest import skipUnless
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import checks, sharding
+from core.models import Tag, Recipe, RecipeStat, UserShard
+
+
+RECIPES_URL = reverse('recipe:recipe-list')
+# stands in for memcached/redis, caches nothing so it is never stale
+SHARED_CACHE = {
+    'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}
+}
+LOCAL_CACHE = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+}
+
+
+class ShardLookupTests(TestCase):
+
+    @override_settings(SHARDS=['default', 'shard1'], CACHES=LOCAL_CACHE)
+    def test_sharding_requires_shared_cache(self):
+        errors = checks.check_shared_cache(None)
+        self.assertEqual([error.id for error in errors], ['core.E001'])
+
+        with self.settings(CACHES=SHARED_CACHE):
+            self.assertEqual(checks.check_shared_cache(None), [])
+
+    @override_settings(DEBUG=False, CACHES=LOCAL_CACHE, SHARDS=['default'])
+    def test_per_process_cache_warned_in_production(self):
+        errors = checks.check_shared_cache(None)
+        self.assertEqual([error.id for error in errors], ['core.W001'])
+
+    @override_settings(SHARDS=['default'])
+    def test_single_shard_needs_no_lookup(self):
+        """Test without shards everything stays on default for free"""
+        with self.assertNumQueries(0):
+            self.assertEqual(sharding.shard_for(1), 'default')
+
+    def test_use_restores_previous_alias(self):
+        """Test nested shard contexts unwind"""
+        with sharding.use('a'):
+            with sharding.use('b'):
+                self.assertEqual(sharding.current(), 'b')
+            self.assertEqual(sharding.current(), 'a')
+        self.assertEqual(sharding.current(), 'default')
+
+
+# run with DJANGO_SETTINGS_MODULE=app.test_sharded_settings, which
+# defines a 'shard1' database and SHARDS = ['default', 'shard1']
+@skipUnless('shard1' in settings.SHARDS, 'needs a shard1 database')
+class ShardedRecipeTests(TestCase):
+    databases = set(settings.SHARDS)
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            'shard@londonappdev.com',
+            'testpass'
+        )
+        UserShard.objects.create(user=self.user, alias='shard1')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_recipe(self):
+        with sharding.for_user(self.user.id):
+            tag = Tag.objects.create(user=self.user, name='Vegan')
+        res = self.client.post(RECIPES_URL, {
+            'title': 'Curry', 'time_minutes': 20, 'price': '7.00',
+            'tag': [tag.id],
+        })
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        return res.data['id'], tag.id
+
+    def test_rows_are_written_to_the_user_shard(self):
+        """Test the recipe, its tags and counters land on the shard"""
+        recipe_id, tag_id = self.create_recipe()
+
+        recipe = Recipe.objects.using('shard1').get(id=recipe_id)
+        self.assertEqual(list(recipe.tag.values_list('id', flat=True)),
+                         [tag_id])
+        self.assertFalse(Recipe.objects.using('default').exists())
+        self.assertTrue(RecipeStat.objects.using('shard1').filter(
+            user_id=self.user.id, kind=RecipeStat.TAG, key=tag_id, count=1
+        ).exists())
+
+        res = self.client.get(RECIPES_URL)
+        self.assertEqual([r['id'] for r in res.data], [recipe_id])
+
+    def test_writes_refused_while_moving(self):
+        """Test writes get 503 with Retry-After during a move"""
+        UserShard.objects.filter(user=self.user).update(moving=True)
+        sharding.invalidate(self.user.id)
+
+        res = self.client.post(RECIPES_URL, {
+            'title': 'Curry', 'time_minutes': 20, 'price': '7.00'
+        })
+        self.assertEqual(res.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertIn('Retry-After', res)
+        self.assertEqual(self.client.get(RECIPES_URL).status_code,
+                         status.HTTP_200_OK)
+
+    @override_settings(CACHES=SHARED_CACHE, SHARD_CACHE_SECONDS=0)
+    def test_move_user_shard(self):
+        """Test moving a user copies its rows and removes the old ones"""
+        recipe_id, tag_id = self.create_recipe()
+
+        call_command('move_user_shard', email=self.user.email,
+                     to='default', settle=0, stdout=StringIO())
+
+        self.assertEqual(sharding.shard_for(self.user.id), 'default')
+        self.assertFalse(Recipe.all_objects.using('shard1').exists())
+        self.assertFalse(RecipeStat.objects.using('shard1').exists())
+        recipe = Recipe.objects.using('default').get(id=recipe_id)
+        self.assertEqual(list(recipe.tag.values_list('id', flat=True)),
+                         [tag_id])
+        self.assertTrue(RecipeStat.objects.using('default').filter(
+            user_id=self.user.id, kind=RecipeStat.TAG, key=tag_id, count=1
+        ).exists())
+
+        res = self.client.get(RECIPES_URL)
+        self.assertEqual([r['id'] for r in res.data], [recipe_id])
+
+    @override_settings(CACHES=LOCAL_CACHE)
+    def test_move_refused_without_shared_cache(self):
+        """Test other workers' cached maps could not be invalidated"""
+        with self.assertRaisesMessage(sharding.ShardMoveError, 'shared'):
+            sharding.move_user(self.user, 'default', settle=0)
+
+        self.assertEqual(sharding.shard_for(self.user.id), 'shard1')
+
+    def test_writes_read_the_map_uncached(self):
+        """Test a cached map can not hide a move from a write"""
+        self.assertEqual(sharding.lookup(self.user.id), ('shard1', False))
+        UserShard.objects.filter(user=self.user).update(moving=True)
+
+        res = self.client.post(RECIPES_URL, {
+            'title': 'Curry', 'time_minutes': 20, 'price': '7.00'
+        })
+
+        self.assertEqual(res.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    def test_init_shards_gives_disjoint_ids(self):
+        """Test every shard allocates ids from its own range"""
+        call_command('init_shards', stdout=StringIO())
+
+        with sharding.for_user(self.user.id):
+            tag = Tag.objects.create(user=self.user, name='Vegan')
+
+        self.assertGreaterEqual(tag.id, settings.SHARD_ID_SPAN)
@@ -0,0 +1,153 @@
+import os
+import shutil
+import tempfile
+from io import StringIO
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import DatabaseError, connection
+from django.test import TestCase
+
+from core import slow_queries
+from core.models import Recipe
+
+
+class NormalizeTests(TestCase):
+
+    def test_literals_and_in_lists_grouped(self):
+        first = "SELECT * FROM t WHERE a = 1 AND b IN (1, 2, 3) AND c = 'x'"
+        second = "SELECT * FROM t WHERE a = 7 AND b IN (4)   AND c = 'y'"
+
+        self.assertEqual(
+            slow_queries.normalize_sql(first),
+            'SELECT * FROM t WHERE a = ? AND b IN (...) AND c = ?'
+        )
+        self.assertEqual(slow_queries.fingerprint(first),
+                         slow_queries.fingerprint(second))
+
+    def test_suggest_index_equality_first(self):
+        sql = (
+            'SELECT "core_recipe"."id" FROM "core_recipe" WHERE '
+            '("core_recipe"."time_minutes" < %s AND '
+            '"core_recipe"."title" = %s) ORDER BY "core_recipe"."id"'
+        )
+
+        self.assertEqual(slow_queries.suggest_index(sql, 'core_recipe'),
+                         ['title', 'time_minutes'])
+        self.assertEqual(slow_queries.suggest_index(sql, 'core_tag'), [])
+
+    def test_postgresql_seq_scans(self):
+        plan = [{'Plan': {
+            'Node Type': 'Hash Join', 'Plans': [
+                {'Node Type': 'Seq Scan', 'Relation Name': 'core_recipe'},
+                {'Node Type': 'Index Scan', 'Relation Name': 'core_tag'},
+            ],
+        }}]
+
+        self.assertEqual(slow_queries.seq_scans('postgresql', plan),
+                         ['core_recipe'])
+
+    def test_side_effects_not_analyzed(self):
+        """Test locking or state changing SELECTs are not run again"""
+        analyze = 'EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) '
+        plain = 'EXPLAIN (FORMAT JSON) '
+        cases = [
+            ('SELECT * FROM "core_task" WHERE "status" = %s', analyze),
+            ('SELECT * FROM "core_task" LIMIT 10 FOR UPDATE SKIP LOCKED',
+             plain),
+            ('SELECT "id" FROM "core_recipe" FOR NO KEY UPDATE', plain),
+            ('SELECT "id" FROM "core_recipe" FOR SHARE', plain),
+            ("SELECT nextval('core_recipe_id_seq')", plain),
+            ('SELECT setval(%s, %s)', plain),
+            ("SELECT pg_notify('events', %s)", plain),
+            ('SELECT pg_try_advisory_xact_lock(%s)', plain),
+            ('UPDATE "core_recipe" SET "title" = %s', None),
+        ]
+        for sql, prefix in cases:
+            self.assertEqual(
+                slow_queries.explain_prefix('postgresql', sql), prefix, sql
+            )
+
+
+class QueryAnalyzerTests(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'slow.log')
+        self.analyzer = slow_queries.QueryAnalyzer(0, path=self.path)
+        self.user = get_user_model().objects.create_user('m@gmail.com', 'p')
+
+    def run_queries(self):
+        with connection.execute_wrapper(self.analyzer):
+            list(Recipe.all_objects.filter(title='Dal'))
+            list(Recipe.all_objects.filter(title='Soup'))
+            list(Recipe.all_objects.filter(user=self.user))
+
+    def test_plan_captured_once_per_fingerprint(self):
+        self.run_queries()
+
+        samples = slow_queries.read_log(self.path)
+        self.assertEqual(len(samples), 3)
+        self.assertEqual(samples[0]['fingerprint'],
+                         samples[1]['fingerprint'])
+        self.assertIn('core_recipe', samples[0]['scans'])
+        self.assertNotIn('plan', samples[1])
+        self.assertEqual(samples[2]['scans'], [])
+        self.assertTrue(samples[0]['origin'].startswith(
+            'core/tests/test_slow_queries.py:'
+        ))
+
+    def test_writes_not_explained(self):
+        with connection.execute_wrapper(self.analyzer):
+            Recipe.objects.filter(title='Dal').update(price_cents=1)
+
+        sample = slow_queries.read_log(self.path)[0]
+        self.assertIsNone(sample['plan'])
+
+    def test_unwritable_log_does_not_fail_the_query(self):
+        analyzer = slow_queries.QueryAnalyzer(
+            0, path=os.path.join(self.directory, 'missing', 'slow.log')
+        )
+
+        with connection.execute_wrapper(analyzer), \
+                self.assertLogs('core.slow_queries', 'ERROR'):
+            self.assertEqual(list(Recipe.all_objects.filter(title='x')), [])
+
+    def test_failing_explain_keeps_the_transaction_usable(self):
+        with patch.object(slow_queries.QueryAnalyzer, 'explain',
+                          side_effect=DatabaseError('explain')), \
+                connection.execute_wrapper(self.analyzer), \
+                self.assertLogs('core.slow_queries', 'ERROR'):
+            list(Recipe.all_objects.filter(title='x'))
+
+        self.assertEqual(Recipe.objects.count(), 0)
+
+    def test_explain_runs_in_a_savepoint(self):
+        with patch.object(connection, 'savepoint',
+                          wraps=connection.savepoint) as savepoint, \
+                connection.execute_wrapper(self.analyzer):
+            list(Recipe.all_objects.filter(title='x'))
+
+        savepoint.assert_called()
+
+    def test_fast_queries_ignored(self):
+        analyzer = slow_queries.QueryAnalyzer(10 ** 6, path=self.path)
+
+        with connection.execute_wrapper(analyzer):
+            list(Recipe.objects.all())
+
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_report_command(self):
+        self.run_queries()
+        out = StringIO()
+
+        call_command('slow_queries', '--log', self.path, stdout=out)
+
+        report = out.getvalue()
+        self.assertIn('2x total', report)
+        self.assertIn('sequential scan of core_recipe', report)
+        self.assertIn('suggest AddIndexConcurrently on core_recipe (title)',
+                      report)
@@ -0,0 +1,54 @@
+import os
+from unittest import skipUnless
+from unittest.mock import patch
+
+from django.test import SimpleTestCase
+
+from core import startup
+
+
+class StartupBudgetTests(SimpleTestCase):
+
+    def test_parse_importtime(self):
+        """Test -X importtime lines are parsed into module timings"""
+        output = (
+            'import time: self [us] | cumulative | imported package\n'
+            'import time:       120 |        120 |   zlib\n'
+            'import time:       300 |        420 | gzip\n'
+        )
+        self.assertEqual(startup.parse_importtime(output), [
+            ('zlib', 120, 120), ('gzip', 300, 420)
+        ])
+
+    def test_hung_target_times_out(self):
+        """Test a target that never exits fails instead of hanging"""
+        targets = {'hang': ['-c', 'import time; time.sleep(30)']}
+
+        with patch.dict(startup.TARGETS, targets):
+            with self.assertRaisesRegex(RuntimeError, 'within 0.5s'):
+                startup.measure('hang', repeat=1, timeout=0.5)
+
+    def test_entry_points_import_budget(self):
+        """Test no entry point imports a module its budget forbids"""
+        budgets = startup.load_budgets()
+        self.assertEqual(set(budgets), set(startup.TARGETS))
+        for target, budget in budgets.items():
+            if not budget.get('forbid'):
+                continue
+            _, modules = startup.measure(target, repeat=1)
+            errors = startup.check_budget(
+                target, 0, modules, {'forbid': budget['forbid']}
+            )
+            self.assertFalse(errors, '\n'.join(errors))
+
+    @skipUnless(
+        os.environ.get('STARTUP_BUDGET_TESTS'),
+        'wall time depends on the machine, set STARTUP_BUDGET_TESTS=1'
+    )
+    def test_entry_points_within_budget(self):
+        """Test each entry point starts within its committed budget"""
+        budgets = startup.load_budgets()
+        for target, budget in budgets.items():
+            elapsed, modules = startup.measure(target)
+            errors = startup.check_budget(target, elapsed, modules, budget)
+            self.assertFalse(errors, '\n'.join(errors))
@@ -0,0 +1,145 @@
+import os
+import signal
+import threading
+from datetime import timedelta
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.db import InterfaceError
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from core import taskqueue
+from core.models import Task
+
+
+calls = []
+
+
+@taskqueue.task(max_attempts=2)
+def record(value):
+    calls.append(value)
+
+
+@taskqueue.task(max_attempts=2)
+def explode():
+    raise RuntimeError('boom')
+
+
+class TaskQueueTests(TestCase):
+
+    def setUp(self):
+        calls.clear()
+
+    def test_enqueue_and_run(self):
+        """Test queued tasks run once and are removed"""
+        record.delay(1)
+        record.delay(2)
+
+        self.assertEqual(calls, [])
+        self.assertEqual(taskqueue.run_pending(), 2)
+        self.assertEqual(calls, [1, 2])
+        self.assertEqual(Task.objects.count(), 0)
+
+    @override_settings(TASKS_ALWAYS_EAGER=True)
+    def test_eager_runs_inline(self):
+        """Test eager mode runs the task without queuing it"""
+        record.delay(3)
+
+        self.assertEqual(calls, [3])
+        self.assertEqual(Task.objects.count(), 0)
+
+    def test_countdown_delays_task(self):
+        """Test a task is not run before its countdown"""
+        record.delay(4, countdown=60)
+
+        self.assertEqual(taskqueue.run_pending(), 0)
+        Task.objects.update(run_at=timezone.now())
+        self.assertEqual(taskqueue.run_pending(), 1)
+
+    def test_retry_with_backoff_then_fail(self):
+        """Test failing tasks are retried later, then marked failed"""
+        explode.delay()
+
+        with self.assertLogs('core.taskqueue', 'ERROR'):
+            self.assertEqual(taskqueue.run_pending(), 1)
+        task = Task.objects.get()
+        self.assertEqual(task.status, Task.QUEUED)
+        self.assertEqual(task.attempts, 1)
+        self.assertGreater(task.run_at, timezone.now())
+        self.assertIn('boom', task.last_error)
+
+        Task.objects.update(run_at=timezone.now())
+        with self.assertLogs('core.taskqueue', 'ERROR'):
+            taskqueue.run_pending()
+        task.refresh_from_db()
+        self.assertEqual(task.status, Task.FAILED)
+        self.assertEqual(taskqueue.run_pending(), 0)
+
+    def test_claimed_task_not_claimed_twice(self):
+        """Test a running task is invisible to other workers"""
+        record.delay(5)
+
+        self.assertEqual(len(taskqueue.claim('a')), 1)
+        self.assertEqual(taskqueue.claim('b'), [])
+
+    def test_stale_lock_is_reclaimed(self):
+        """Test tasks of a crashed worker are picked up again"""
+        record.delay(6)
+        taskqueue.claim('dead')
+        Task.objects.update(locked_at=timezone.now() - timedelta(hours=1))
+
+        self.assertEqual(taskqueue.run_pending(), 1)
+        self.assertEqual(calls, [6])
+
+    def test_unknown_task(self):
+        with self.assertRaises(KeyError):
+            taskqueue.enqueue('nope')
+
+
+class RunWorkerCommandTests(TransactionTestCase):
+
+    def setUp(self):
+        calls.clear()
+
+    def test_run_worker_burst(self):
+        """Test the worker command drains the queue and exits"""
+        for value in range(3):
+            record.delay(value)
+
+        call_command('run_worker', burst=True, threads=2)
+
+        self.assertEqual(sorted(calls), [0, 1, 2])
+
+    def test_worker_survives_database_errors(self):
+        """Test a failure recording a task does not kill the thread"""
+        record.delay(1)
+        execute = taskqueue.execute
+        failures = [InterfaceError('connection already closed')]
+
+        def flaky(task):
+            if failures:
+                raise failures.pop()
+            return execute(task)
+
+        # the lock of the task hit by the error goes stale immediately
+        with patch('core.taskqueue.execute', side_effect=flaky), \
+                override_settings(TASKS_LOCK_TIMEOUT=0), \
+                self.assertLogs('core.taskqueue', 'ERROR'):
+            taskqueue.Worker(poll=0.01, burst=True).run()
+
+        self.assertEqual(calls, [1])
+        self.assertFalse(Task.objects.exists())
+
+    def test_worker_stops_on_sigterm(self):
+        """Test SIGTERM stops a polling worker and restores the handler"""
+        previous = signal.getsignal(signal.SIGTERM)
+        timer = threading.Timer(
+            0.2, os.kill, args=(os.getpid(), signal.SIGTERM)
+        )
+        timer.start()
+
+        taskqueue.Worker(poll=0.05).run()
+
+        timer.join()
+        self.assertEqual(signal.getsignal(signal.SIGTERM), previous)
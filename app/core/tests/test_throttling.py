@@ -0,0 +1,126 @@
+from unittest.mock import patch
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, RequestFactory
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import throttling
+
+
+class FakeView:
+    throttle_scope = 'test'
+    action = 'list'
+
+
+class FakeTimer:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class SlidingWindowThrottleTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            'test@londonappdev.com',
+            'testpass'
+        )
+        self.request = RequestFactory().get('/')
+        self.request.user = self.user
+        self.timer = FakeTimer(1000.0)
+
+    def throttle(self):
+        throttle = throttling.EndpointRateThrottle()
+        throttle.timer = self.timer
+        return throttle
+
+    @patch.dict(throttling.SlidingWindowRateThrottle.THROTTLE_RATES,
+                {'test': '3/min'})
+    def test_limit_within_window(self):
+        """Test requests over the rate are rejected with a wait"""
+        for _ in range(3):
+            self.assertTrue(
+                self.throttle().allow_request(self.request, FakeView())
+            )
+        throttle = self.throttle()
+        self.assertFalse(throttle.allow_request(self.request, FakeView()))
+        self.assertGreater(throttle.wait(), 0)
+
+    @patch.dict(throttling.SlidingWindowRateThrottle.THROTTLE_RATES,
+                {'test': '3/min'})
+    def test_previous_window_is_weighted(self):
+        """Test the previous window counts by its overlap"""
+        self.timer.now = 1020.0
+        for _ in range(3):
+            self.throttle().allow_request(self.request, FakeView())
+
+        # half way into the next window half of the 3 requests still count
+        self.timer.now = 1110.0
+        self.assertTrue(
+            self.throttle().allow_request(self.request, FakeView())
+        )
+        self.assertFalse(
+            self.throttle().allow_request(self.request, FakeView())
+        )
+
+        # a window later the old requests have expired
+        self.timer.now = 1170.0
+        self.assertTrue(
+            self.throttle().allow_request(self.request, FakeView())
+        )
+
+    @patch.dict(throttling.SlidingWindowRateThrottle.THROTTLE_RATES,
+                {'test': '3/min', 'test.list': '1/min'})
+    def test_action_scope_takes_precedence(self):
+        """Test a rate for the viewset action overrides the view rate"""
+        self.assertTrue(
+            self.throttle().allow_request(self.request, FakeView())
+        )
+        self.assertFalse(
+            self.throttle().allow_request(self.request, FakeView())
+        )
+
+    def test_view_without_scope_not_throttled(self):
+        """Test views without a throttle scope are exempt"""
+        view = FakeView()
+        view.throttle_scope = None
+        for _ in range(5):
+            self.assertTrue(self.throttle().allow_request(self.request, view))
+
+
+class ThrottleApiTests(TestCase):
+    databases = set(settings.SHARDS)
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            'test@londonappdev.com',
+            'testpass'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def tearDown(self):
+        cache.clear()
+
+    @patch.dict(throttling.SlidingWindowRateThrottle.THROTTLE_RATES,
+                {'recipe': '2/min'})
+    def test_throttled_response_has_retry_after(self):
+        """Test throttled calls get a 429 with a Retry-After header"""
+        url = reverse('recipe:recipe-list')
+        for _ in range(2):
+            res = self.client.get(url)
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        res = self.client.get(url)
+
+        self.assertEqual(res.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertGreaterEqual(int(res['Retry-After']), 1)
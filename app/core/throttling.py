@@ -0,0 +1,125 @@
+from django.core.cache import caches
+from django.conf import settings
+from rest_framework import throttling
+
+
+class SlidingWindowRateThrottle(throttling.SimpleRateThrottle):
+    """Sliding window counter kept in a shared cache
+
+    Each window is a single cache counter updated with atomic ``incr``,
+    so concurrent workers sharing memcached/redis agree on the count.
+    The rate is estimated by weighting the previous window with the
+    part of it still inside the sliding window.
+    """
+    cache = caches[getattr(settings, 'THROTTLE_CACHE', 'default')]
+    cache_format = 'throttle:%(scope)s:%(ident)s'
+
+    def _incr(self, key):
+        """atomically increment a window counter, creating it if needed"""
+        self.cache.add(key, 0, self.duration * 2)
+        try:
+            return self.cache.incr(key)
+        except ValueError:
+            # evicted between add and incr
+            self.cache.set(key, 1, self.duration * 2)
+            return 1
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+
+        self.now = self.timer()
+        window = int(self.now // self.duration)
+        current_key = f'{self.key}:{window}'
+        self.current = self._incr(current_key)
+        self.previous = self.cache.get(f'{self.key}:{window - 1}', 0)
+        self.elapsed = (self.now % self.duration) / self.duration
+
+        estimate = self.previous * (1 - self.elapsed) + self.current
+        if estimate > self.num_requests:
+            # rejected requests do not use up the quota
+            self.cache.decr(current_key)
+            self.current -= 1
+            return False
+        return True
+
+    def wait(self):
+        """Seconds until the estimated rate drops below the limit"""
+        room = self.num_requests - self.current - 1
+        if room < 0:
+            # the current window alone is full, wait for the next one
+            # and for this window's weight to decay in it
+            decay = 1 - (self.num_requests - 1) / max(self.current, 1)
+            wait = (1 - self.elapsed + max(decay, 0)) * self.duration
+        elif self.previous:
+            needed = 1 - room / self.previous
+            wait = max(needed - self.elapsed, 0) * self.duration
+        else:
+            wait = 0
+        # DRF only sends Retry-After for a non zero wait
+        return max(wait, 1)
+
+
+class UserRateThrottle(SlidingWindowRateThrottle):
+    """Overall rate of an authenticated user across the API"""
+    scope = 'user'
+
+    def get_cache_key(self, request, view):
+        if not request.user.is_authenticated:
+            return None
+        return self.cache_format % {
+            'scope': self.scope,
+            'ident': request.user.pk
+        }
+
+
+class AnonRateThrottle(SlidingWindowRateThrottle):
+    """Overall rate of anonymous clients, keyed by address"""
+    scope = 'anon'
+
+    def get_cache_key(self, request, view):
+        if request.user.is_authenticated:
+            return None
+        return self.cache_format % {
+            'scope': self.scope,
+            'ident': self.get_ident(request)
+        }
+
+
+class EndpointRateThrottle(SlidingWindowRateThrottle):
+    """Per endpoint rate of a client, from the view's ``throttle_scope``
+
+    A rate registered for ``<throttle_scope>.<action>`` takes precedence,
+    so expensive viewset actions can get a tighter quota.
+    """
+    scope_attr = 'throttle_scope'
+
+    def __init__(self):
+        # the rate is only known once the view is
+        pass
+
+    def allow_request(self, request, view):
+        scope = getattr(view, self.scope_attr, None)
+        if not scope:
+            return True
+        action_scope = f'{scope}.{getattr(view, "action", None)}'
+        self.scope = (
+            action_scope if action_scope in self.THROTTLE_RATES else scope
+        )
+        if self.scope not in self.THROTTLE_RATES:
+            return True
+
+        self.rate = self.get_rate()
+        self.num_requests, self.duration = self.parse_rate(self.rate)
+        return super().allow_request(request, view)
+
+    def get_cache_key(self, request, view):
+        if request.user.is_authenticated:
+            ident = request.user.pk
+        else:
+            ident = self.get_ident(request)
+        return self.cache_format % {'scope': self.scope, 'ident': ident}
@@ -3,3 +3,8 @@ from django.apps import AppConfig
 
 class RecipeConfig(AppConfig):
     name = 'recipe'
+
+    def ready(self):
+        # connect the receivers invalidating the autocomplete and
+        # similarity caches
+        from recipe import autocomplete, similarity  # noqa: F401
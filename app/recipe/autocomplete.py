@@ -0,0 +1,106 @@
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.functions import Lower
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from core.models import Tag, Ingredient
+
+
+# users whose names are kept in memory by each process
+CACHE_USERS = getattr(settings, 'AUTOCOMPLETE_CACHE_USERS', 256)
+# users with more names than this are served by the prefix index
+CACHE_MAX_NAMES = getattr(settings, 'AUTOCOMPLETE_CACHE_MAX_NAMES', 200000)
+
+
+class NameIndex:
+    """Names of a user sorted case insensitively for prefix lookups"""
+
+    def __init__(self, rows):
+        rows = sorted((name.lower(), pk, name) for name, pk in rows)
+        self.keys = [row[0] for row in rows]
+        self.rows = [(pk, name) for _, pk, name in rows]
+
+    def search(self, prefix, limit):
+        prefix = prefix.lower()
+        start = bisect_left(self.keys, prefix)
+        end = start
+        while (end < len(self.keys) and end - start < limit and
+               self.keys[end].startswith(prefix)):
+            end += 1
+        return self.rows[start:end]
+
+
+_indexes = OrderedDict()
+_lock = threading.Lock()
+
+
+def _version_key(model, user_id):
+    return f'autocomplete:{model._meta.label_lower}:{user_id}'
+
+
+def invalidate(model, user_id):
+    """Make every process rebuild the names of a user on next lookup"""
+    key = _version_key(model, user_id)
+    if not cache.add(key, 1, None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, None)
+
+
+def clear():
+    """Forget the names held by this process"""
+    with _lock:
+        _indexes.clear()
+
+
+def _search_database(model, user, prefix, limit):
+    """served by the (user_id, lower(name)) index on PostgreSQL"""
+    return list(
+        model.objects.filter(user=user)
+        .annotate(lower_name=Lower('name'))
+        .filter(lower_name__startswith=prefix.lower())
+        .order_by('lower_name', 'id')
+        .values_list('id', 'name')[:limit]
+    )
+
+
+def search(model, user, prefix, limit):
+    """Return (id, name) of the first names of a user with the prefix"""
+    version = cache.get(_version_key(model, user.id), 0)
+    key = (model, user.id)
+    with _lock:
+        entry = _indexes.get(key)
+        if entry is not None:
+            _indexes.move_to_end(key)
+    if entry is not None and entry[0] == version:
+        index = entry[1]
+        if index is None:
+            return _search_database(model, user, prefix, limit)
+        return index.search(prefix, limit)
+
+    rows = model.objects.filter(user=user) \
+        .values_list('name', 'id')[:CACHE_MAX_NAMES + 1]
+    rows = list(rows)
+    index = NameIndex(rows) if len(rows) <= CACHE_MAX_NAMES else None
+    with _lock:
+        _indexes[key] = (version, index)
+        _indexes.move_to_end(key)
+        while len(_indexes) > CACHE_USERS:
+            _indexes.popitem(last=False)
+    if index is None:
+        return _search_database(model, user, prefix, limit)
+    return index.search(prefix, limit)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def _names_changed(sender, instance, **kwargs):
+    invalidate(sender, instance.user_id)
@@ -1,5 +1,8 @@
 from rest_framework import serializers
-from core.models import Tag, Ingredient, Recipe
+from rest_framework.relations import MANY_RELATION_KWARGS
+
+from core import sharding, stats
+from core.models import Tag, Ingredient, Recipe, RecipeStat, cents_to_str
 
 
 class TagSerializer(serializers.ModelSerializer):
@@ -19,17 +22,107 @@ class IngredientSerializer(serializers.ModelSerializer):
         read_only_fields = ('id',)
 
 
-class RecipeSerializer(serializers.ModelSerializer):
+class PriceField(serializers.DecimalField):
+    """Recipe price written as a decimal and read from the cents column"""
+
+    def __init__(self, **kwargs):
+        super().__init__(
+            max_digits=5, decimal_places=2, source='*', **kwargs
+        )
+
+    def to_representation(self, recipe):
+        if recipe.price_cents is None:
+            return super().to_representation(recipe.price)
+        return cents_to_str(recipe.price_cents)
+
+    def to_internal_value(self, data):
+        return {'price': super().to_internal_value(data)}
+
+
+class OwnedManyRelatedField(serializers.ManyRelatedField):
+    """List of primary keys looked up together with one IN query"""
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail('empty')
+
+        child = self.child_relation
+        pks = []
+        for item in data:
+            if isinstance(item, bool):
+                child.fail('incorrect_type', data_type='bool')
+            try:
+                pks.append(int(item))
+            except (TypeError, ValueError):
+                child.fail('incorrect_type', data_type=type(item).__name__)
+        pks = list(dict.fromkeys(pks))
+
+        found = child.get_queryset().in_bulk(pks)
+        for pk in pks:
+            if pk not in found:
+                child.fail('does_not_exist', pk_value=pk)
+        return [found[pk] for pk in pks]
+
+
+class OwnedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """Primary key of a row belonging to the requesting user"""
+
+    def get_queryset(self):
+        request = self.context.get('request')
+        queryset = super().get_queryset()
+        if request is None or not request.user.is_authenticated:
+            return queryset.none()
+        return queryset.filter(user=request.user)
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_kwargs = {'child_relation': cls(*args, **kwargs)}
+        for key in kwargs:
+            if key in MANY_RELATION_KWARGS:
+                list_kwargs[key] = kwargs[key]
+        return OwnedManyRelatedField(**list_kwargs)
+
+
+class SparseFieldsMixin:
+    """Keep only context['fields'] and nest the context['expand'] ones"""
+    expandable = {
+        'tag': TagSerializer,
+        'ingredient': IngredientSerializer,
+    }
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        for name in self.context.get('expand') or ():
+            self.fields[name] = self.expandable[name](
+                many=True, read_only=True
+            )
+        fields = self.context.get('fields')
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+class RecipeSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """serializer for Recipe objects"""
-    ingredient = serializers.PrimaryKeyRelatedField(
+    price = PriceField()
+    ingredient = OwnedPrimaryKeyRelatedField(
         many=True,
         queryset=Ingredient.objects.all()
     )
-    tag = serializers.PrimaryKeyRelatedField(
+    tag = OwnedPrimaryKeyRelatedField(
         many=True,
         queryset=Tag.objects.all()
     )
 
+    # many to many fields written as a diff of the through rows
+    RELATED = (
+        ('tag', Recipe.tag.through, 'tag_id', RecipeStat.TAG),
+        ('ingredient', Recipe.ingredient.through, 'ingredient_id',
+         RecipeStat.INGREDIENT),
+    )
+
     class Meta:
         model = Recipe
         fields = ('id', 'title', 'ingredient', 'tag', 'time_minutes',
@@ -37,6 +130,50 @@ class RecipeSerializer(serializers.ModelSerializer):
                   )
         read_only_fields = ('id',)
 
+    def _pop_related(self, validated_data):
+        return {
+            name: {obj.id for obj in validated_data.pop(name)}
+            for name, *_ in self.RELATED if name in validated_data
+        }
+
+    def _write_related(self, recipe, related, created=False):
+        """insert and delete only the through rows that changed"""
+        for name, through, field, kind in self.RELATED:
+            if name not in related:
+                continue
+            wanted = related[name]
+            existing = set() if created else set(
+                through.objects.filter(recipe_id=recipe.id)
+                .values_list(field, flat=True)
+            )
+            removed = existing - wanted
+            added = wanted - existing
+            if removed:
+                through.objects.filter(
+                    recipe_id=recipe.id, **{f'{field}__in': removed}
+                ).delete()
+                stats.record_related(recipe.user_id, {kind: removed}, -1)
+            if added:
+                through.objects.bulk_create([
+                    through(**{'recipe_id': recipe.id, field: pk})
+                    for pk in added
+                ])
+                stats.record_related(recipe.user_id, {kind: added})
+
+    def create(self, validated_data):
+        related = self._pop_related(validated_data)
+        with sharding.atomic():
+            recipe = super().create(validated_data)
+            self._write_related(recipe, related, created=True)
+        return recipe
+
+    def update(self, instance, validated_data):
+        related = self._pop_related(validated_data)
+        with sharding.atomic():
+            instance = super().update(instance, validated_data)
+            self._write_related(instance, related)
+        return instance
+
 
 class RecipeDetailSerializer(RecipeSerializer):
     """serialized Recipe detail fields"""
@@ -50,3 +187,64 @@ class RecipeImageSerializer(serializers.ModelSerializer):
         model = Recipe
         fields = ('id', 'image')
         read_only_fields = ('id',)
+
+
+class RecipeBatchEditSerializer(serializers.Serializer):
+    """serializer for batch editing many recipes at once"""
+    ids = serializers.ListField(
+        child=serializers.IntegerField(),
+        allow_empty=False,
+        max_length=1000
+    )
+    add_tag = serializers.ListField(
+        child=serializers.IntegerField(), required=False, max_length=1000
+    )
+    remove_tag = serializers.ListField(
+        child=serializers.IntegerField(), required=False, max_length=1000
+    )
+    add_ingredient = serializers.ListField(
+        child=serializers.IntegerField(), required=False, max_length=1000
+    )
+    remove_ingredient = serializers.ListField(
+        child=serializers.IntegerField(), required=False, max_length=1000
+    )
+    price = serializers.DecimalField(
+        max_digits=5, decimal_places=2, required=False
+    )
+    time_minutes = serializers.IntegerField(required=False)
+
+    def _validate_owned(self, model, value):
+        """check every id belongs to the user in a single query"""
+        ids = set(value)
+        user = self.context['request'].user
+        found = set(
+            model.objects.filter(user=user, id__in=ids)
+            .values_list('id', flat=True)
+        )
+        missing = ids - found
+        if missing:
+            raise serializers.ValidationError(
+                f'Invalid pk {sorted(missing)} - object does not exist.'
+            )
+        return list(ids)
+
+    def validate_add_tag(self, value):
+        return self._validate_owned(Tag, value)
+
+    def validate_remove_tag(self, value):
+        return self._validate_owned(Tag, value)
+
+    def validate_add_ingredient(self, value):
+        return self._validate_owned(Ingredient, value)
+
+    def validate_remove_ingredient(self, value):
+        return self._validate_owned(Ingredient, value)
+
+
+class ShoppingListSerializer(serializers.Serializer):
+    """recipes of a meal plan, repeated ids count repeatedly"""
+    ids = serializers.ListField(
+        child=serializers.IntegerField(),
+        allow_empty=False,
+        max_length=1000
+    )
@@ -0,0 +1,52 @@
+from collections import Counter
+
+from django.db.models import Aggregate, CharField
+
+from core import sharding
+from core.models import Recipe
+
+
+class IdList(Aggregate):
+    """Comma separated values of a group, unordered"""
+    function = 'GROUP_CONCAT'
+    output_field = CharField()
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        return super().as_sql(
+            compiler, connection, function='STRING_AGG',
+            template="%(function)s(CAST(%(expressions)s AS text), ',')",
+            **extra_context
+        )
+
+
+def items(user, recipe_ids):
+    """Ingredients of the given recipes of a user, one dict per ingredient
+
+    Computed by a single query grouping the recipe/ingredient through
+    rows, read with a server side cursor so a very large plan can be
+    streamed. A recipe listed twice counts its ingredients twice. The
+    shard is bound now, the rows may be read after the view returned.
+    """
+    planned = Counter(recipe_ids)
+    rows = Recipe.ingredient.through.objects \
+        .using(sharding.current()) \
+        .filter(
+            recipe_id__in=list(planned),
+            recipe__user=user,
+            recipe__deleted_at__isnull=True
+        ) \
+        .values('ingredient_id', 'ingredient__name') \
+        .annotate(recipes=IdList('recipe_id')) \
+        .order_by('ingredient__name', 'ingredient_id')
+    return _items(rows, planned)
+
+
+def _items(rows, planned):
+    for row in rows.iterator():
+        recipes = sorted(int(pk) for pk in row['recipes'].split(','))
+        yield {
+            'id': row['ingredient_id'],
+            'name': row['ingredient__name'],
+            'count': sum(planned[pk] for pk in recipes),
+            'recipes': recipes,
+        }
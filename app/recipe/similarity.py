@@ -0,0 +1,177 @@
+import math
+import threading
+from collections import Counter, OrderedDict, defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from core.models import Tag, Ingredient, Recipe
+
+try:
+    import numpy
+except ImportError:  # optional, scored with an inverted index without it
+    numpy = None
+
+
+# users whose feature matrix is kept in memory by each process
+CACHE_USERS = getattr(settings, 'SIMILARITY_CACHE_USERS', 64)
+
+METRICS = ('jaccard', 'cosine')
+
+
+def _features(user):
+    """(recipe_id, feature) pairs, tags even and ingredients odd"""
+    alive = {'recipe__user': user, 'recipe__deleted_at__isnull': True}
+    tags = Recipe.tag.through.objects.filter(**alive) \
+        .values_list('recipe_id', 'tag_id')
+    ingredients = Recipe.ingredient.through.objects.filter(**alive) \
+        .values_list('recipe_id', 'ingredient_id')
+    pairs = [(recipe_id, tag_id * 2) for recipe_id, tag_id in tags]
+    pairs.extend(
+        (recipe_id, ingredient_id * 2 + 1)
+        for recipe_id, ingredient_id in ingredients
+    )
+    return pairs
+
+
+class FeatureMatrix:
+    """Sparse recipe x (tag, ingredient) incidence of a user's recipes
+
+    Stored as coordinate arrays, the overlap of one recipe with all the
+    others is a single vectorized ``bincount`` over the rows holding one
+    of its features.
+    """
+
+    def __init__(self, pairs):
+        self.ids = sorted({recipe_id for recipe_id, _ in pairs})
+        self.position = {pk: index for index, pk in enumerate(self.ids)}
+        rows = [self.position[recipe_id] for recipe_id, _ in pairs]
+        cols = [feature for _, feature in pairs]
+        if numpy is not None:
+            self.rows = numpy.array(rows, dtype=numpy.int64)
+            self.cols = numpy.array(cols, dtype=numpy.int64)
+            self.sizes = numpy.bincount(self.rows, minlength=len(self.ids))
+        else:
+            self.features = defaultdict(set)
+            self.postings = defaultdict(list)
+            for row, col in zip(rows, cols):
+                self.features[row].add(col)
+                self.postings[col].append(row)
+
+    def _rank_numpy(self, row, metric, limit):
+        query = self.cols[self.rows == row]
+        overlap = numpy.bincount(
+            self.rows[numpy.isin(self.cols, query)],
+            minlength=len(self.ids)
+        ).astype(numpy.float64)
+        if metric == 'cosine':
+            scores = overlap / numpy.sqrt(self.sizes * len(query))
+        else:
+            scores = overlap / (self.sizes + len(query) - overlap)
+        scores[row] = 0
+        candidates = numpy.flatnonzero(scores)
+        # best score first, ties by id as rows follow the sorted ids
+        order = numpy.lexsort((candidates, -scores[candidates]))[:limit]
+        best = candidates[order]
+        return zip(best.tolist(), scores[best].tolist())
+
+    def _rank_python(self, row, metric, limit):
+        query = self.features[row]
+        overlap = Counter()
+        for feature in query:
+            overlap.update(self.postings[feature])
+        overlap.pop(row, None)
+        scores = []
+        for other, count in overlap.items():
+            size = len(self.features[other])
+            if metric == 'cosine':
+                score = count / math.sqrt(size * len(query))
+            else:
+                score = count / (size + len(query) - count)
+            scores.append((other, score))
+        scores.sort(key=lambda item: (-item[1], item[0]))
+        return scores[:limit]
+
+    def similar(self, recipe_id, metric='jaccard', limit=10):
+        """(recipe_id, score) of the most similar recipes, best first"""
+        row = self.position.get(recipe_id)
+        if row is None:
+            return []
+        rank = self._rank_numpy if numpy is not None else self._rank_python
+        return [
+            (self.ids[other], score)
+            for other, score in rank(row, metric, limit)
+        ]
+
+
+_matrices = OrderedDict()
+_lock = threading.Lock()
+
+
+def _version_key(user_id):
+    return f'similarity:{user_id}'
+
+
+def invalidate(user_id):
+    """Make every process rebuild the matrix of a user on next use"""
+    key = _version_key(user_id)
+    if not cache.add(key, 1, None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, None)
+
+
+def clear():
+    """Forget the matrices held by this process"""
+    with _lock:
+        _matrices.clear()
+
+
+def matrix(user):
+    """Feature matrix of a user, rebuilt when it was invalidated"""
+    version = cache.get(_version_key(user.id), 0)
+    with _lock:
+        entry = _matrices.get(user.id)
+        if entry is not None:
+            _matrices.move_to_end(user.id)
+    if entry is not None and entry[0] == version:
+        return entry[1]
+
+    built = FeatureMatrix(_features(user))
+    with _lock:
+        _matrices[user.id] = (version, built)
+        _matrices.move_to_end(user.id)
+        while len(_matrices) > CACHE_USERS:
+            _matrices.popitem(last=False)
+    return built
+
+
+def similar(user, recipe_id, metric='jaccard', limit=10):
+    """Rank the other recipes of a user by overlap with one recipe"""
+    return matrix(user).similar(recipe_id, metric, limit)
+
+
+def _invalidate_on_commit(user_id, using):
+    invalidate(user_id)
+    # and again once committed, through rows are often written after
+    # the recipe is saved and a rebuild in between would miss them
+    transaction.on_commit(lambda: invalidate(user_id), using=using)
+
+
+@receiver(m2m_changed, sender=Recipe.tag.through)
+@receiver(m2m_changed, sender=Recipe.ingredient.through)
+def _related_changed(sender, instance, action, using, **kwargs):
+    if action.startswith('post_'):
+        _invalidate_on_commit(instance.user_id, using)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def _recipes_changed(sender, instance, using, **kwargs):
+    _invalidate_on_commit(instance.user_id, using)
@@ -0,0 +1,118 @@
+import asyncio
+import json
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from rest_framework.exceptions import AuthenticationFailed
+
+from core.authentication import ExpiringTokenAuthentication
+from core.events import RESYNC, broker
+
+
+EVENTS_PATH = '/api/recipe/events/'
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _token(scope):
+    """key from an ``Authorization: Token`` header or ``?token=``
+
+    Browsers' EventSource can not set headers, hence the query string.
+    """
+    for name, value in scope.get('headers', ()):
+        if name == b'authorization':
+            keyword, _, key = value.decode('latin1').partition(' ')
+            if keyword == 'Token':
+                return key.strip()
+    query = parse_qs(scope.get('query_string', b'').decode('latin1'))
+    return query.get('token', [None])[0]
+
+
+def _authenticate(key):
+    close_old_connections()
+    try:
+        user, _ = ExpiringTokenAuthentication().authenticate_credentials(key)
+    except AuthenticationFailed:
+        return None
+    return user.id
+
+
+def format_event(event):
+    """an event in the text/event-stream format"""
+    if event is RESYNC:
+        return 'event: resync\ndata: {}\n\n'
+    return (
+        f'event: {event["type"]}\nid: {event["cursor"]}\n'
+        f'data: {json.dumps(event)}\n\n'
+    )
+
+
+async def _disconnected(receive):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+
+async def events_application(scope, receive, send):
+    """Stream the change events of the authenticated user
+
+    Each event names a changed recipe, tag or ingredient and carries a
+    sync cursor, a ``resync`` event means events were dropped because
+    the client read too slowly and it should call the sync endpoint.
+    A comment line is sent as heartbeat when nothing happened.
+    """
+    key = _token(scope)
+    user_id = key and await sync_to_async(
+        _authenticate, thread_sensitive=True
+    )(key)
+    if not user_id:
+        await send({
+            'type': 'http.response.start', 'status': 401,
+            'headers': [(b'content-type', b'application/json')],
+        })
+        await send({
+            'type': 'http.response.body',
+            'body': b'{"detail": "Invalid token."}',
+        })
+        return
+
+    subscription = broker.subscribe(user_id)
+    disconnected = asyncio.ensure_future(_disconnected(receive))
+    heartbeat = _setting('EVENTS_HEARTBEAT', 15)
+    try:
+        await send({
+            'type': 'http.response.start', 'status': 200,
+            'headers': [
+                (b'content-type', b'text/event-stream'),
+                (b'cache-control', b'no-cache'),
+                # keep nginx from buffering the stream
+                (b'x-accel-buffering', b'no'),
+            ],
+        })
+        body = f'retry: {_setting("EVENTS_RETRY_MS", 3000)}\n\n'
+        while True:
+            await send({
+                'type': 'http.response.body',
+                'body': body.encode(), 'more_body': True,
+            })
+            event = asyncio.ensure_future(subscription.get())
+            done, _ = await asyncio.wait(
+                {event, disconnected}, timeout=heartbeat,
+                return_when=asyncio.FIRST_COMPLETED
+            )
+            if disconnected in done:
+                event.cancel()
+                break
+            if event in done:
+                body = format_event(event.result())
+            else:
+                event.cancel()
+                body = ': heartbeat\n\n'
+    finally:
+        broker.unsubscribe(subscription)
+        disconnected.cancel()
@@ -0,0 +1,120 @@
+from unittest.mock import patch
+
+from asgiref.sync import async_to_sync
+from asgiref.testing import ApplicationCommunicator
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+
+from core.events import broker
+from core.models import AuthToken, Recipe
+from recipe.sse import EVENTS_PATH, events_application
+
+
+def sample_event(recipe_id=1):
+    return {'type': 'recipe', 'id': recipe_id, 'action': 'saved',
+            'cursor': '1'}
+
+
+class EventStreamTests(TestCase):
+    """Test the server-sent change events"""
+    databases = set(settings.SHARDS)
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'manish@gmail.com',
+            'testpass'
+        )
+        self.token = AuthToken.issue(self.user)
+
+    def scope(self, token=None):
+        return {
+            'type': 'http', 'method': 'GET', 'path': EVENTS_PATH,
+            'query_string': f'token={token}'.encode() if token else b'',
+            'headers': [],
+        }
+
+    def stream(self, steps, token=None):
+        """run the stream, steps(communicator) returns what it reads"""
+        async def run():
+            communicator = ApplicationCommunicator(
+                events_application, self.scope(token or self.token.key)
+            )
+            try:
+                return await steps(communicator)
+            finally:
+                await communicator.send_input({'type': 'http.disconnect'})
+                await communicator.wait(1)
+        return async_to_sync(run)()
+
+    @staticmethod
+    async def read(communicator):
+        message = await communicator.receive_output(1)
+        return message.get('body', b'').decode()
+
+    def test_invalid_token_rejected(self):
+        async def steps(communicator):
+            return await communicator.receive_output(1)
+
+        start = self.stream(steps, token='bad')
+
+        self.assertEqual(start['status'], 401)
+
+    def test_events_of_the_user_are_streamed(self):
+        other = get_user_model().objects.create_user('o@gmail.com', 'pass')
+
+        async def steps(communicator):
+            start = await communicator.receive_output(1)
+            retry = await self.read(communicator)
+            broker.deliver(other.id, sample_event(7))
+            broker.deliver(self.user.id, sample_event(5))
+            return start, retry, await self.read(communicator)
+
+        start, retry, body = self.stream(steps)
+
+        self.assertEqual(start['status'], 200)
+        self.assertIn((b'content-type', b'text/event-stream'),
+                      start['headers'])
+        self.assertTrue(retry.startswith('retry:'))
+        self.assertTrue(body.startswith('event: recipe\nid: 1\n'))
+        self.assertIn('"id": 5', body)
+
+    @override_settings(EVENTS_HEARTBEAT=0.01)
+    def test_heartbeat_when_idle(self):
+        async def steps(communicator):
+            await communicator.receive_output(1)
+            await self.read(communicator)
+            return await self.read(communicator)
+
+        self.assertEqual(self.stream(steps), ': heartbeat\n\n')
+
+    @override_settings(EVENTS_QUEUE_SIZE=2)
+    def test_slow_client_gets_resync(self):
+        """events beyond the queue are replaced by a resync event"""
+        async def steps(communicator):
+            await communicator.receive_output(1)
+            await self.read(communicator)
+            for recipe_id in range(3):
+                broker.deliver(self.user.id, sample_event(recipe_id))
+            return await self.read(communicator)
+
+        self.assertEqual(self.stream(steps), 'event: resync\ndata: {}\n\n')
+
+    @patch('core.events.transaction.on_commit',
+           side_effect=lambda f, using=None: f())
+    @patch('core.events.broker.publish')
+    def test_saving_a_recipe_publishes(self, publish, on_commit):
+        recipe = Recipe.objects.create(
+            user=self.user, title='Dal', time_minutes=5, price=2
+        )
+
+        publish.assert_called_once()
+        user_id, event = publish.call_args[0]
+        self.assertEqual(user_id, self.user.id)
+        self.assertEqual(
+            (event['type'], event['id'], event['action']),
+            ('recipe', recipe.id, 'saved')
+        )
+
+        recipe.soft_delete()
+        self.assertEqual(publish.call_args[0][1]['action'], 'deleted')
@@ -1,11 +1,16 @@
+from unittest.mock import patch
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.urls import reverse
 from django.test import TestCase
+from django.core.cache import cache
 
 from rest_framework import status
 from rest_framework.test import APIClient
 from core.models import Ingredient
 
+from recipe import autocomplete
 from recipe.serializers import IngredientSerializer
 
 INGREDIENT_URL = reverse('recipe:ingredient-list')
@@ -26,6 +31,7 @@ class PublicIngredientsApiTests(TestCase):
 
 class PrivateIngredientApiTests(TestCase):
     """Test related to authorized user only"""
+    databases = set(settings.SHARDS)
 
     def setUp(self):
         self.client = APIClient()
@@ -81,3 +87,67 @@ class PrivateIngredientApiTests(TestCase):
         res = self.client.post(INGREDIENT_URL, payload)
 
         self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class IngredientAutocompleteTests(TestCase):
+    """Test the ingredient prefix autocomplete"""
+    databases = set(settings.SHARDS)
+
+    def setUp(self):
+        cache.clear()
+        autocomplete.clear()
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'manish@gmail.com',
+            'testpass'
+        )
+        self.client.force_authenticate(self.user)
+        for name in ('salt', 'Saffron', 'sage', 'Sugar', 'Kale'):
+            Ingredient.objects.create(user=self.user, name=name)
+
+    def test_prefix_case_insensitive_sorted(self):
+        """names starting with the prefix are returned alphabetically"""
+        res = self.client.get(INGREDIENT_URL, {'prefix': 'SA'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [row['name'] for row in res.data], ['Saffron', 'sage', 'salt']
+        )
+
+    def test_prefix_limit(self):
+        res = self.client.get(INGREDIENT_URL, {'prefix': 's', 'limit': 2})
+
+        self.assertEqual([row['name'] for row in res.data],
+                         ['Saffron', 'sage'])
+
+    def test_cache_serves_repeated_lookups(self):
+        """the names are loaded once and reloaded after a create"""
+        self.client.get(INGREDIENT_URL, {'prefix': 's'})
+
+        with self.assertNumQueries(0):
+            self.client.get(INGREDIENT_URL, {'prefix': 'su'})
+
+        self.client.post(INGREDIENT_URL, {'name': 'Sumac'})
+        res = self.client.get(INGREDIENT_URL, {'prefix': 'su'})
+        self.assertEqual([row['name'] for row in res.data],
+                         ['Sugar', 'Sumac'])
+
+    def test_prefix_limited_to_user(self):
+        user2 = get_user_model().objects.create_user(
+            'other@gmail.com',
+            'testOther'
+        )
+        Ingredient.objects.create(user=user2, name='Sago')
+
+        res = self.client.get(INGREDIENT_URL, {'prefix': 'sag'})
+
+        self.assertEqual([row['name'] for row in res.data], ['sage'])
+
+    @patch('recipe.autocomplete.CACHE_MAX_NAMES', 2)
+    def test_database_fallback_for_large_users(self):
+        """users over the cache size are served by the prefix index"""
+        res = self.client.get(INGREDIENT_URL, {'prefix': 'sa'})
+
+        self.assertEqual(
+            [row['name'] for row in res.data], ['Saffron', 'sage', 'salt']
+        )
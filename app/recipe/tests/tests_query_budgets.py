@@ -0,0 +1,55 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+from django.test import TestCase
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Tag, Ingredient, Recipe
+from core.testing import QueryBudgetMixin
+
+
+def sample_recipes(user, count):
+    """create recipes each with its own tag and ingredient"""
+    for i in range(count):
+        recipe = Recipe.objects.create(
+            user=user, title=f'Recipe {i}', time_minutes=10, price=5
+        )
+        recipe.tag.add(Tag.objects.create(user=user, name=f'Tag {i}'))
+        recipe.ingredient.add(
+            Ingredient.objects.create(user=user, name=f'Ingredient {i}')
+        )
+        yield recipe
+
+
+class RecipeQueryBudgetTests(QueryBudgetMixin, TestCase):
+    """Recipe endpoints stay within their committed query budgets"""
+    databases = set(settings.SHARDS)
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'manish@gmail.com',
+            'testpass'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_list_endpoints_any_size(self):
+        """list budgets hold no matter how many rows exist"""
+        for count in (1, 10):
+            list(sample_recipes(self.user, count))
+            for url_name in ('recipe:recipe-list', 'recipe:tag-list',
+                             'recipe:ingredient-list', 'recipe:stats'):
+                with self.assertWithinBudget(url_name):
+                    res = self.client.get(reverse(url_name))
+                self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_recipe_detail(self):
+        recipe = next(sample_recipes(self.user, 1))
+
+        with self.assertWithinBudget('recipe:recipe-detail'):
+            res = self.client.get(
+                reverse('recipe:recipe-detail', args=[recipe.id])
+            )
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
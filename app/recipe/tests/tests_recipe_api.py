@@ -1,16 +1,24 @@
 """"""
 import tempfile
 import os
+from datetime import timedelta
 from PIL import Image
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework import status
 from rest_framework.test import APIClient
-from core.models import Recipe, Tag, Ingredient
+from core.models import IdempotencyKey, Recipe, RecipeStat, Tag, \
+    Ingredient
+from core.testing import SHARD_LOOKUPS
 from recipe.serializers import RecipeSerializer, RecipeDetailSerializer
 
 RECIPES_URL = reverse('recipe:recipe-list')
+BATCH_EDIT_URL = reverse('recipe:recipe-batch-edit')
 
 # /api/recipe/recipes/
 # /api/recipe/recipes/1/
@@ -26,6 +34,11 @@ def detail_url(recipe_id):
     return reverse('recipe:recipe-detail', args=[recipe_id])
 
 
+def clone_url(recipe_id):
+    """return the recipe clone url"""
+    return reverse('recipe:recipe-clone', args=[recipe_id])
+
+
 def sample_tag(user, name='Main Tag'):
     """create and return a sample"""
     return Tag.objects.create(user=user, name=name)
@@ -61,6 +74,7 @@ class PublicRecipeApiTests(TestCase):
 
 class PrivateRecipeApiTest(TestCase):
     """test to authorized user only"""
+    databases = set(settings.SHARDS)
 
     def setUp(self):
         self.client = APIClient()
@@ -201,9 +215,396 @@ class PrivateRecipeApiTest(TestCase):
         self.assertEqual(recipe.time_minutes, payload['time_minutes'])
         self.assertEqual(len(recipe.tag.all()), 0)
 
+    def test_create_recipe_queries_independent_of_ingredients(self):
+        """ids are validated and linked with a fixed number of queries"""
+        ingredients = [
+            sample_ingredient(user=self.user, name=f'ingredient{i}')
+            for i in range(40)
+        ]
+
+        def create(items):
+            with CaptureQueriesContext(connection) as context:
+                res = self.client.post(RECIPES_URL, {
+                    'title': 'Thali', 'time_minutes': 30, 'price': 10,
+                    'ingredient': [item.id for item in items],
+                })
+            self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+            return res, len(context.captured_queries)
+
+        # the first recipe also creates the user's stats rows
+        create(ingredients[:1])
+        _, one = create(ingredients[1:2])
+        res, many = create(ingredients[2:])
+
+        self.assertEqual(many, one)
+        recipe = Recipe.objects.get(id=res.data['id'])
+        self.assertEqual(recipe.ingredient.count(), 38)
+
+    def test_create_recipe_with_other_users_tag(self):
+        """tags of other users are rejected like missing ones"""
+        user2 = get_user_model().objects.create_user(
+            'other@gmail.com',
+            'otherpass'
+        )
+        tag = sample_tag(user=user2)
+        payload = {
+            'title': 'Dal', 'time_minutes': 5, 'price': 2, 'tag': [tag.id]
+        }
+
+        res = self.client.post(RECIPES_URL, payload)
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('tag', res.data)
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_update_recipe_diffs_tags(self):
+        """only the changed through rows are written, stats follow"""
+        recipe = sample_recipe(user=self.user)
+        kept = sample_tag(user=self.user, name='Kept')
+        dropped = sample_tag(user=self.user, name='Dropped')
+        added = sample_tag(user=self.user, name='Added')
+        recipe.tag.add(kept, dropped)
+        kept_row = Recipe.tag.through.objects.get(tag=kept)
+
+        res = self.client.patch(
+            detail_url(recipe.id), {'tag': [kept.id, added.id]}
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(set(recipe.tag.all()), {kept, added})
+        self.assertTrue(
+            Recipe.tag.through.objects.filter(id=kept_row.id).exists()
+        )
+        counts = dict(
+            RecipeStat.objects.filter(kind=RecipeStat.TAG)
+            .values_list('key', 'count')
+        )
+        self.assertEqual(counts.get(kept.id), 1)
+        self.assertEqual(counts.get(dropped.id, 0), 0)
+        self.assertEqual(counts.get(added.id), 1)
+
+    def test_clone_recipe(self):
+        """clone copies the recipe with its tags and ingredients"""
+        recipe = sample_recipe(user=self.user, title='Dal Makhani')
+        tags = [sample_tag(user=self.user, name=f'tag{i}') for i in range(3)]
+        ingredients = [
+            sample_ingredient(user=self.user, name=f'ingredient{i}')
+            for i in range(3)
+        ]
+        recipe.tag.add(*tags)
+        recipe.ingredient.add(*ingredients)
+
+        with self.assertNumQueries(13 + SHARD_LOOKUPS):
+            res = self.client.post(clone_url(recipe.id))
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertNotEqual(res.data['id'], recipe.id)
+        clone = Recipe.objects.get(id=res.data['id'])
+        self.assertEqual(clone.title, recipe.title)
+        self.assertEqual(set(clone.tag.all()), set(tags))
+        self.assertEqual(set(clone.ingredient.all()), set(ingredients))
+
+    def test_clone_recipe_other_user(self):
+        """recipes of other users can not be cloned"""
+        user2 = get_user_model().objects.create_user(
+            'other@gmail.com',
+            'otherpass'
+        )
+        recipe = sample_recipe(user=user2)
+
+        res = self.client.post(clone_url(recipe.id))
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(Recipe.objects.count(), 1)
+
+    def test_batch_edit_add_tag_and_price(self):
+        """batch edit adds a tag and sets price on many recipes"""
+        recipe1 = sample_recipe(user=self.user)
+        recipe2 = sample_recipe(user=self.user)
+        untouched = sample_recipe(user=self.user)
+        tag = sample_tag(user=self.user)
+        recipe1.tag.add(tag)
+        payload = {
+            'ids': [recipe1.id, recipe2.id],
+            'add_tag': [tag.id],
+            'price': '7.50'
+        }
+
+        res = self.client.post(BATCH_EDIT_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        for recipe in (recipe1, recipe2):
+            recipe.refresh_from_db()
+            self.assertEqual(str(recipe.price), '7.50')
+            self.assertEqual(list(recipe.tag.all()), [tag])
+        untouched.refresh_from_db()
+        self.assertEqual(untouched.tag.count(), 0)
+        self.assertEqual(str(untouched.price), '5.00')
+
+    def test_batch_edit_remove_ingredient(self):
+        """batch edit removes an ingredient from many recipes"""
+        ingredient = sample_ingredient(user=self.user)
+        recipes = [sample_recipe(user=self.user) for _ in range(3)]
+        for recipe in recipes:
+            recipe.ingredient.add(ingredient)
+        payload = {
+            'ids': [recipe.id for recipe in recipes],
+            'remove_ingredient': [ingredient.id]
+        }
+
+        res = self.client.post(BATCH_EDIT_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            Recipe.ingredient.through.objects.count(), 0
+        )
+
+    def test_batch_edit_limited_to_user(self):
+        """batch edit ignores recipes and rejects tags of other users"""
+        user2 = get_user_model().objects.create_user(
+            'other@gmail.com',
+            'otherpass'
+        )
+        other_recipe = sample_recipe(user=user2)
+        other_tag = sample_tag(user=user2)
+        recipe = sample_recipe(user=self.user)
+
+        res = self.client.post(BATCH_EDIT_URL, {
+            'ids': [recipe.id],
+            'add_tag': [other_tag.id]
+        }, format='json')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+        res = self.client.post(BATCH_EDIT_URL, {
+            'ids': [recipe.id, other_recipe.id],
+            'time_minutes': 99
+        }, format='json')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['ids'], [recipe.id])
+        other_recipe.refresh_from_db()
+        self.assertEqual(other_recipe.time_minutes, 10)
+
+    def test_batch_edit_ids_limited(self):
+        """batch edit rejects more than 1000 ids"""
+        res = self.client.post(BATCH_EDIT_URL, {
+            'ids': list(range(1, 1002)),
+            'time_minutes': 99
+        }, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('ids', res.data)
+
+    def test_batch_edit_related_ids_limited(self):
+        """batch edit rejects more than 1000 tags or ingredients"""
+        recipe = sample_recipe(user=self.user)
+        fields = ('add_tag', 'remove_tag', 'add_ingredient',
+                  'remove_ingredient')
+        for field in fields:
+            res = self.client.post(BATCH_EDIT_URL, {
+                'ids': [recipe.id],
+                field: list(range(1, 1002))
+            }, format='json')
+
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn(field, res.data)
+
+    def test_delete_recipe_soft_deletes(self):
+        """deleted recipes are hidden but kept until purged"""
+        recipe = sample_recipe(user=self.user)
+
+        res = self.client.delete(detail_url(recipe.id))
+
+        self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(Recipe.objects.filter(id=recipe.id).exists())
+        self.assertTrue(Recipe.all_objects.filter(id=recipe.id).exists())
+        res = self.client.get(RECIPES_URL)
+        self.assertEqual(res.data, [])
+        res = self.client.get(detail_url(recipe.id))
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_price_of_row_not_backfilled(self):
+        """a recipe the migration has not backfilled yet shows its price"""
+        recipe = sample_recipe(user=self.user, price=7)
+        Recipe.objects.filter(id=recipe.id).update(price_cents=None)
+
+        res = self.client.get(detail_url(recipe.id))
+
+        self.assertEqual(res.data['price'], '7.00')
+
+    def test_detail_of_row_without_updated_at(self):
+        """a recipe the migration has not backfilled yet is served"""
+        recipe = sample_recipe(user=self.user)
+        Recipe.objects.filter(id=recipe.id).update(updated_at=None)
+
+        res = self.client.get(detail_url(recipe.id))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertTrue(res.has_header('ETag'))
+
+    def test_filter_by_time_and_price(self):
+        """recipes are filtered by time and price ranges"""
+        quick_cheap = sample_recipe(user=self.user, time_minutes=20, price=8)
+        sample_recipe(user=self.user, time_minutes=20, price=10)
+        sample_recipe(user=self.user, time_minutes=45, price=3)
+
+        res = self.client.get(
+            RECIPES_URL, {'max_time': 30, 'price_lt': '10.00'}
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([r['id'] for r in res.data], [quick_cheap.id])
+        self.assertEqual(res.data[0]['price'], '8.00')
+
+    def test_filter_invalid_range(self):
+        """non numeric range filters are rejected"""
+        res = self.client.get(RECIPES_URL, {'max_time': 'soon'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('max_time', res.data)
+
+    def test_multi_get_by_ids(self):
+        """?ids= returns detail records in the requested order"""
+        user2 = get_user_model().objects.create_user(
+            'other@gmail.com',
+            'otherpass'
+        )
+        other = sample_recipe(user=user2)
+        recipes = [sample_recipe(user=self.user) for _ in range(3)]
+        for recipe in recipes:
+            recipe.tag.add(sample_tag(user=self.user))
+            recipe.ingredient.add(sample_ingredient(user=self.user))
+        ids = [recipes[1].id, other.id, recipes[0].id, recipes[2].id]
+
+        with self.assertNumQueries(3):
+            res = self.client.get(
+                RECIPES_URL, {'ids': ','.join(map(str, ids))}
+            )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [r['id'] for r in res.data],
+            [recipes[1].id, recipes[0].id, recipes[2].id]
+        )
+        recipes[1].refresh_from_db()
+        self.assertEqual(
+            res.data[0], RecipeDetailSerializer(recipes[1]).data
+        )
+
+    def test_multi_get_limits(self):
+        """?ids= rejects garbage and too many ids"""
+        res = self.client.get(RECIPES_URL, {'ids': '1,x'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+        ids = ','.join(str(pk) for pk in range(1, 100))
+        res = self.client.get(RECIPES_URL, {'ids': ids})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_list_conditional_get(self):
+        """an unchanged list is answered with 304 until a recipe changes"""
+        recipe = sample_recipe(user=self.user)
+        res = self.client.get(RECIPES_URL)
+        etag = res['ETag']
+        self.assertTrue(res.has_header('Last-Modified'))
+
+        with self.assertNumQueries(1):
+            res = self.client.get(RECIPES_URL, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        res = self.client.get(
+            RECIPES_URL, {'max_time': 5}, HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        recipe.title = 'Changed'
+        recipe.save()
+        res = self.client.get(RECIPES_URL, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_list_conditional_get_related_changes(self):
+        """deleting or renaming a listed tag changes the list etag"""
+        recipe = sample_recipe(user=self.user)
+        kept, deleted = sample_tag(user=self.user), sample_tag(user=self.user)
+        recipe.tag.add(kept, deleted)
+        params = {'expand': 'tag'}
+        etag = self.client.get(RECIPES_URL, params)['ETag']
+
+        deleted.delete()
+        res = self.client.get(RECIPES_URL, params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        etag = res['ETag']
+        kept.name = 'Renamed'
+        kept.save()
+        res = self.client.get(RECIPES_URL, params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data[0]['tag'][0]['name'], 'Renamed')
+
+        res = self.client.get(
+            RECIPES_URL, params, HTTP_IF_NONE_MATCH=res['ETag']
+        )
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_detail_conditional_get(self):
+        """renaming a tag of a recipe changes the detail etag"""
+        recipe = sample_recipe(user=self.user)
+        tag = sample_tag(user=self.user)
+        recipe.tag.add(tag)
+        url = detail_url(recipe.id)
+        etag = self.client.get(url)['ETag']
+
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        tag.name = 'Renamed'
+        tag.save()
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_sparse_fieldset_list(self):
+        """?fields= prunes the output and the columns and prefetches read"""
+        recipe = sample_recipe(user=self.user, title='Dal')
+        recipe.tag.add(sample_tag(user=self.user))
+
+        with CaptureQueriesContext(connection) as context:
+            res = self.client.get(RECIPES_URL, {'fields': 'id,title'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data, [{'id': recipe.id, 'title': 'Dal'}])
+        sql = ' '.join(query['sql'] for query in context.captured_queries)
+        self.assertNotIn('price', sql)
+        self.assertNotIn('core_recipe_tag', sql)
+
+    def test_expand_related_fields(self):
+        """?expand= nests tags instead of listing their ids"""
+        recipe = sample_recipe(user=self.user)
+        tag = sample_tag(user=self.user, name='Vegan')
+        recipe.tag.add(tag)
+
+        res = self.client.get(
+            RECIPES_URL, {'fields': 'id', 'expand': 'tag'}
+        )
+
+        self.assertEqual(res.data, [
+            {'id': recipe.id, 'tag': [{'id': tag.id, 'name': 'Vegan'}]}
+        ])
+
+    def test_sparse_fieldset_detail(self):
+        recipe = sample_recipe(user=self.user, title='Dal')
+        recipe.ingredient.add(sample_ingredient(user=self.user))
+
+        res = self.client.get(detail_url(recipe.id), {'fields': 'title'})
+
+        self.assertEqual(res.data, {'title': 'Dal'})
+
+    def test_unknown_sparse_fields(self):
+        for params in ({'fields': 'id,user'}, {'expand': 'title'}):
+            res = self.client.get(RECIPES_URL, params)
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
 
 class RecipeImageUploadTest(TestCase):
     """"""
+    databases = set(settings.SHARDS)
 
     def setUp(self):
         self.client = APIClient()
@@ -235,3 +636,98 @@ class RecipeImageUploadTest(TestCase):
         url = image_upload_url(self.recipe.id)
         res = self.client.post(url, {'image': 'notimage'}, format='multipart')
         self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class RecipeIdempotencyTest(TestCase):
+    """Idempotency-Key support on recipe writes"""
+    databases = set(settings.SHARDS)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'user@gmail.com',
+            'testpass'
+        )
+        self.client.force_authenticate(self.user)
+        self.payload = {'title': 'Dal', 'time_minutes': 5, 'price': 2}
+
+    def test_retry_replays_response(self):
+        """a retried create returns the first response without a new row"""
+        first = self.client.post(
+            RECIPES_URL, self.payload, HTTP_IDEMPOTENCY_KEY='abc'
+        )
+        retry = self.client.post(
+            RECIPES_URL, self.payload, HTTP_IDEMPOTENCY_KEY='abc'
+        )
+
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.data, first.data)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Recipe.objects.count(), 1)
+
+    def test_key_reused_for_other_payload(self):
+        self.client.post(RECIPES_URL, self.payload, HTTP_IDEMPOTENCY_KEY='k')
+        self.payload['title'] = 'Other'
+
+        res = self.client.post(
+            RECIPES_URL, self.payload, HTTP_IDEMPOTENCY_KEY='k'
+        )
+
+        self.assertEqual(
+            res.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY
+        )
+
+    def test_errors_are_not_stored(self):
+        """a failed request can be retried with the same key"""
+        res = self.client.post(
+            RECIPES_URL, {'title': 'Dal'}, HTTP_IDEMPOTENCY_KEY='e'
+        )
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+        res = self.client.post(
+            RECIPES_URL, self.payload, HTTP_IDEMPOTENCY_KEY='e'
+        )
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+
+    def in_progress(self, key, age):
+        """placeholder left by a request started ``age`` ago"""
+        IdempotencyKey.objects.create(
+            scope=f'user:{self.user.pk}', key=key, request_hash=''
+        )
+        IdempotencyKey.objects.filter(key=key).update(
+            created_at=timezone.now() - age
+        )
+
+    def test_request_in_progress(self):
+        self.in_progress('p', timedelta(seconds=1))
+
+        res = self.client.post(
+            RECIPES_URL, self.payload, HTTP_IDEMPOTENCY_KEY='p'
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(Recipe.objects.count(), 0)
+
+    def test_retry_takes_over_stale_placeholder(self):
+        """the key of a request whose worker died is not locked a day"""
+        self.in_progress('d', timedelta(minutes=5))
+
+        res = self.client.post(
+            RECIPES_URL, self.payload, HTTP_IDEMPOTENCY_KEY='d'
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        record = IdempotencyKey.objects.get(key='d')
+        self.assertEqual(record.status_code, status.HTTP_201_CREATED)
+
+    def test_keys_scoped_per_user(self):
+        self.client.post(RECIPES_URL, self.payload, HTTP_IDEMPOTENCY_KEY='u')
+        user2 = get_user_model().objects.create_user(
+            'other@gmail.com',
+            'otherpass'
+        )
+        self.client.force_authenticate(user2)
+
+        self.client.post(RECIPES_URL, self.payload, HTTP_IDEMPOTENCY_KEY='u')
+
+        self.assertEqual(Recipe.objects.filter(user=user2).count(), 1)
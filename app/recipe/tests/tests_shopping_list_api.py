@@ -0,0 +1,111 @@
+import json
+from unittest.mock import patch
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+from django.test import TestCase
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Ingredient, Recipe
+from core.testing import SHARD_LOOKUPS
+
+SHOPPING_LIST_URL = reverse('recipe:shopping-list')
+
+
+def sample_recipe(user, ingredients=(), **params):
+    """create and return sample recipe with the given ingredients"""
+    defaults = {
+        'title': 'Sample recipe',
+        'time_minutes': 10,
+        'price': 5.00
+    }
+    defaults.update(params)
+    recipe = Recipe.objects.create(user=user, **defaults)
+    recipe.ingredient.add(*ingredients)
+    return recipe
+
+
+class PrivateShoppingListApiTests(TestCase):
+    """Test the shopping list api"""
+    databases = set(settings.SHARDS)
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'manish@gmail.com',
+            'testpass'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.rice = Ingredient.objects.create(user=self.user, name='Rice')
+        self.dal = Ingredient.objects.create(user=self.user, name='Dal')
+        self.ghee = Ingredient.objects.create(user=self.user, name='Ghee')
+
+    def post(self, ids):
+        return self.client.post(
+            SHOPPING_LIST_URL, {'ids': ids}, format='json'
+        )
+
+    def test_login_required(self):
+        res = APIClient().post(SHOPPING_LIST_URL, {'ids': [1]})
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_ingredients_merged_in_one_query(self):
+        """ingredients are deduplicated with counts and their recipes"""
+        khichdi = sample_recipe(self.user, [self.rice, self.dal])
+        pulao = sample_recipe(self.user, [self.rice, self.ghee])
+        sample_recipe(self.user, [self.ghee])
+
+        with self.assertNumQueries(1 + SHARD_LOOKUPS):
+            res = self.post([khichdi.id, pulao.id])
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data, [
+            {'id': self.dal.id, 'name': 'Dal', 'count': 1,
+             'recipes': [khichdi.id]},
+            {'id': self.ghee.id, 'name': 'Ghee', 'count': 1,
+             'recipes': [pulao.id]},
+            {'id': self.rice.id, 'name': 'Rice', 'count': 2,
+             'recipes': [khichdi.id, pulao.id]},
+        ])
+
+    def test_repeated_recipe_counts_twice(self):
+        khichdi = sample_recipe(self.user, [self.rice])
+
+        res = self.post([khichdi.id, khichdi.id])
+
+        self.assertEqual(res.data[0]['count'], 2)
+        self.assertEqual(res.data[0]['recipes'], [khichdi.id])
+
+    def test_other_users_and_deleted_recipes_ignored(self):
+        other = get_user_model().objects.create_user('o@gmail.com', 'pass')
+        foreign = sample_recipe(
+            other, [Ingredient.objects.create(user=other, name='Salt')]
+        )
+        deleted = sample_recipe(self.user, [self.rice])
+        deleted.soft_delete()
+
+        res = self.post([foreign.id, deleted.id])
+
+        self.assertEqual(res.data, [])
+
+    def test_invalid_ids(self):
+        for ids in ([], ['x'], list(range(1001))):
+            res = self.post(ids)
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @patch('recipe.views.SHOPPING_LIST_STREAM_AFTER', 1)
+    def test_large_plans_are_streamed(self):
+        khichdi = sample_recipe(self.user, [self.rice, self.dal])
+        pulao = sample_recipe(self.user, [self.rice])
+
+        res = self.post([khichdi.id, pulao.id])
+
+        self.assertTrue(res.streaming)
+        data = json.loads(b''.join(res.streaming_content))
+        self.assertEqual(
+            [(item['name'], item['count']) for item in data],
+            [('Dal', 1), ('Rice', 2)]
+        )
@@ -0,0 +1,156 @@
+import time
+from unittest import skipIf
+from unittest.mock import patch
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+from django.test import SimpleTestCase, TestCase
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Tag, Ingredient, Recipe
+from recipe import similarity
+
+
+def similar_url(recipe_id):
+    """return the similar recipes url"""
+    return reverse('recipe:recipe-similar', args=[recipe_id])
+
+
+def sample_recipe(user, **params):
+    """create and return sample recipe"""
+    defaults = {
+        'title': 'Sample recipe',
+        'time_minutes': 10,
+        'price': 5.00
+    }
+    defaults.update(params)
+    return Recipe.objects.create(user=user, **defaults)
+
+
+class PrivateSimilarApiTests(TestCase):
+    """Test the similar recipes api"""
+    databases = set(settings.SHARDS)
+
+    def setUp(self):
+        similarity.clear()
+        self.user = get_user_model().objects.create_user(
+            'manish@gmail.com',
+            'testpass'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.tags = [
+            Tag.objects.create(user=self.user, name=name)
+            for name in ('Vegan', 'Indian', 'Dessert')
+        ]
+        self.ingredients = [
+            Ingredient.objects.create(user=self.user, name=name)
+            for name in ('Rice', 'Lentils', 'Sugar')
+        ]
+
+    def recipe(self, title, tags=(), ingredients=()):
+        recipe = sample_recipe(self.user, title=title)
+        recipe.tag.add(*[self.tags[i] for i in tags])
+        recipe.ingredient.add(*[self.ingredients[i] for i in ingredients])
+        return recipe
+
+    def test_ranked_by_overlap(self):
+        """recipes sharing more tags and ingredients come first"""
+        dal = self.recipe('Dal', tags=[0, 1], ingredients=[0, 1])
+        khichdi = self.recipe('Khichdi', tags=[0, 1], ingredients=[0, 1])
+        rice = self.recipe('Rice', tags=[1], ingredients=[0])
+        self.recipe('Cake', tags=[2], ingredients=[2])
+
+        res = self.client.get(similar_url(dal.id))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([r['id'] for r in res.data], [khichdi.id, rice.id])
+        self.assertEqual(res.data[0]['similarity'], 1.0)
+        self.assertEqual(res.data[1]['similarity'], 0.5)
+
+    def test_cosine_metric_and_limit(self):
+        """?metric=cosine and ?limit= are honoured"""
+        dal = self.recipe('Dal', tags=[0, 1], ingredients=[0, 1])
+        rice = self.recipe('Rice', tags=[1], ingredients=[0])
+        self.recipe('Vegan rice', tags=[0], ingredients=[0])
+
+        res = self.client.get(
+            similar_url(dal.id), {'metric': 'cosine', 'limit': 1}
+        )
+
+        self.assertEqual([r['id'] for r in res.data], [rice.id])
+        self.assertEqual(res.data[0]['similarity'], 0.7071)
+
+    def test_invalid_parameters(self):
+        dal = self.recipe('Dal', tags=[0])
+        for params in ({'metric': 'euclid'}, {'limit': 'x'}):
+            res = self.client.get(similar_url(dal.id), params)
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_other_users_recipe_not_found(self):
+        other = get_user_model().objects.create_user('o@gmail.com', 'pass')
+        recipe = sample_recipe(other)
+
+        res = self.client.get(similar_url(recipe.id))
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_tag_change_invalidates_cache(self):
+        """adding a tag shows up without waiting for the cache"""
+        dal = self.recipe('Dal', tags=[0])
+        cake = self.recipe('Cake', tags=[2])
+        self.assertEqual(self.client.get(similar_url(dal.id)).data, [])
+
+        cake.tag.add(self.tags[0])
+
+        res = self.client.get(similar_url(dal.id))
+        self.assertEqual([r['id'] for r in res.data], [cake.id])
+
+    def test_deleted_recipes_are_skipped(self):
+        dal = self.recipe('Dal', tags=[0])
+        self.recipe('Khichdi', tags=[0]).soft_delete()
+
+        res = self.client.get(similar_url(dal.id))
+
+        self.assertEqual(res.data, [])
+
+
+class FeatureMatrixTests(SimpleTestCase):
+    """Test the scoring without the database"""
+
+    def pairs(self, count):
+        # recipe i has features i % 100 and 100 + i % 7
+        return [
+            (recipe_id, feature)
+            for recipe_id in range(1, count + 1)
+            for feature in (recipe_id % 100, 100 + recipe_id % 7)
+        ]
+
+    def test_inverted_index_fallback_matches(self):
+        """Test scores without NumPy equal the vectorized ones"""
+        pairs = self.pairs(2000)
+        expected = similarity.FeatureMatrix(pairs).similar(1, 'cosine', 20)
+        with patch('recipe.similarity.numpy', None):
+            fallback = similarity.FeatureMatrix(pairs).similar(
+                1, 'cosine', 20
+            )
+        self.assertEqual(
+            [(pk, round(score, 6)) for pk, score in fallback],
+            [(pk, round(score, 6)) for pk, score in expected]
+        )
+
+    @skipIf(similarity.numpy is None, 'NumPy is not installed')
+    def test_scores_50k_recipes_quickly(self):
+        """Test one ranking over 50k recipes is a vectorized pass"""
+        matrix = similarity.FeatureMatrix(self.pairs(50000))
+
+        start = time.perf_counter()
+        ranked = matrix.similar(1, 'jaccard', 10)
+        elapsed = time.perf_counter() - start
+
+        # recipes 701, 1401, ... share both features with recipe 1
+        self.assertEqual([pk for pk, _ in ranked][:3], [701, 1401, 2101])
+        self.assertLess(elapsed, 0.5)
@@ -0,0 +1,174 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+from django.test import TestCase
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import stats
+from core.models import Tag, Ingredient, Recipe, RecipeStat, Task
+
+STATS_URL = reverse('recipe:stats')
+RECIPES_URL = reverse('recipe:recipe-list')
+
+
+def sample_recipe(user, **params):
+    """create and return sample recipe"""
+    defaults = {
+        'title': 'Sample recipe',
+        'time_minutes': 10,
+        'price': 5.00
+    }
+    defaults.update(params)
+    return Recipe.objects.create(user=user, **defaults)
+
+
+class PublicStatsApiTests(TestCase):
+    """Test unauthenticated stats api access"""
+
+    def test_login_required(self):
+        res = APIClient().get(STATS_URL)
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class PrivateStatsApiTests(TestCase):
+    """Test the stats api for an authorized user"""
+    databases = set(settings.SHARDS)
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'manish@gmail.com',
+            'testpass'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.vegan = Tag.objects.create(user=self.user, name='Vegan')
+        self.salt = Ingredient.objects.create(user=self.user, name='Salt')
+
+    def test_empty_stats(self):
+        """stats of a user without recipes"""
+        res = self.client.get(STATS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['recipe_count'], 0)
+        self.assertIsNone(res.data['average_price'])
+        self.assertEqual(res.data['tag'], [])
+
+    def test_stats_follow_recipe_changes(self):
+        """counters are maintained on create, update, m2m and delete"""
+        recipe1 = sample_recipe(self.user, price=4, time_minutes=10)
+        recipe2 = sample_recipe(self.user, price=12, time_minutes=45)
+        recipe1.tag.add(self.vegan)
+        recipe2.tag.add(self.vegan)
+        recipe2.ingredient.add(self.salt)
+
+        res = self.client.get(STATS_URL)
+
+        self.assertEqual(res.data['recipe_count'], 2)
+        self.assertEqual(str(res.data['average_price']), '8.00')
+        self.assertEqual(res.data['average_time_minutes'], 27.5)
+        self.assertEqual(
+            res.data['tag'],
+            [{'id': self.vegan.id, 'name': 'Vegan', 'count': 2}]
+        )
+        self.assertEqual(
+            [bucket['count'] for bucket in res.data['price_histogram']],
+            [1, 0, 1, 0, 0, 0]
+        )
+
+        recipe1.price = 60
+        recipe1.save()
+        recipe2.tag.remove(self.vegan)
+        recipe2.soft_delete()
+
+        res = self.client.get(STATS_URL)
+
+        self.assertEqual(res.data['recipe_count'], 1)
+        self.assertEqual(str(res.data['average_price']), '60.00')
+        self.assertEqual(res.data['tag'][0]['count'], 1)
+        self.assertEqual(res.data['ingredient'], [])
+        self.assertEqual(
+            [bucket['count'] for bucket in res.data['price_histogram']],
+            [0, 0, 0, 0, 1, 0]
+        )
+
+    def test_stats_query_count_independent_of_recipes(self):
+        """reading the stats does not touch the recipe table"""
+        for _ in range(5):
+            recipe = sample_recipe(self.user)
+            recipe.tag.add(self.vegan)
+            recipe.ingredient.add(self.salt)
+
+        with self.assertNumQueries(3):
+            self.client.get(STATS_URL)
+
+    def test_counters_updated_with_one_query(self):
+        """existing counters of several kinds are bumped in one UPDATE"""
+        pepper = Ingredient.objects.create(user=self.user, name='Pepper')
+        related = {
+            RecipeStat.TAG: [self.vegan.id],
+            RecipeStat.INGREDIENT: [self.salt.id, pepper.id],
+        }
+        # the first time, the missing rows are created
+        stats.record_related(self.user.id, related)
+
+        with self.assertNumQueries(1):
+            stats.record_related(self.user.id, related)
+
+        counters = RecipeStat.objects.filter(user=self.user)
+        self.assertEqual(
+            set(counters.values_list('kind', 'key', 'count')), {
+                (RecipeStat.TAG, self.vegan.id, 2),
+                (RecipeStat.INGREDIENT, self.salt.id, 2),
+                (RecipeStat.INGREDIENT, pepper.id, 2),
+            }
+        )
+
+    def test_recompute_matches_incremental(self):
+        """a full recompute gives the same result as the signals"""
+        recipe = sample_recipe(self.user, price=25, time_minutes=90)
+        recipe.tag.add(self.vegan)
+        recipe.ingredient.add(self.salt)
+        sample_recipe(self.user)
+        self.client.post(
+            reverse('recipe:recipe-batch-edit'),
+            {'ids': [recipe.id], 'add_tag': [self.vegan.id], 'price': 3},
+            format='json'
+        )
+        incremental = stats.user_stats(self.user)
+
+        stats.recompute(self.user)
+
+        self.assertEqual(stats.user_stats(self.user), incremental)
+        self.assertEqual(incremental['recipe_count'], 2)
+        self.assertEqual(str(incremental['average_price']), '4.00')
+
+    def test_batch_edit_updates_counters_in_place(self):
+        """batch edits keep the counters exact without a recompute task"""
+        pepper = Ingredient.objects.create(user=self.user, name='Pepper')
+        first = sample_recipe(self.user, price=25, time_minutes=90)
+        first.tag.add(self.vegan)
+        first.ingredient.add(self.salt, pepper)
+        second = sample_recipe(self.user)
+        second.ingredient.add(self.salt)
+
+        res = self.client.post(reverse('recipe:recipe-batch-edit'), {
+            'ids': [first.id, second.id],
+            'add_tag': [self.vegan.id],
+            'remove_ingredient': [self.salt.id],
+            'time_minutes': 20,
+        }, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertFalse(Task.objects.exists())
+        incremental = stats.user_stats(self.user)
+        self.assertEqual(incremental['tag'], [
+            {'id': self.vegan.id, 'name': 'Vegan', 'count': 2}
+        ])
+        self.assertEqual(incremental['ingredient'], [
+            {'id': pepper.id, 'name': 'Pepper', 'count': 1}
+        ])
+        self.assertEqual(incremental['average_time_minutes'], 20)
+        stats.recompute(self.user)
+        self.assertEqual(stats.user_stats(self.user), incremental)
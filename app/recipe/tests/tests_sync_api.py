@@ -0,0 +1,144 @@
+from datetime import timedelta
+from unittest.mock import patch
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import sync
+from core.models import Tag, Ingredient, Recipe
+
+SYNC_URL = reverse('recipe:sync')
+
+
+def sample_recipe(user, **params):
+    """create and return sample recipe"""
+    defaults = {
+        'title': 'Sample recipe',
+        'time_minutes': 10,
+        'price': 5.00
+    }
+    defaults.update(params)
+    return Recipe.objects.create(user=user, **defaults)
+
+
+class PrivateSyncApiTests(TestCase):
+    """Test the delta sync api"""
+    databases = set(settings.SHARDS)
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'manish@gmail.com',
+            'testpass'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def sync(self, cursor=None):
+        params = {'since': cursor} if cursor else {}
+        res = self.client.get(SYNC_URL, params)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return res.data
+
+    def test_login_required(self):
+        res = APIClient().get(SYNC_URL)
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_full_sync_without_cursor(self):
+        """the first sync returns every row of the user"""
+        recipe = sample_recipe(self.user)
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        other = get_user_model().objects.create_user('o@gmail.com', 'pass')
+        sample_recipe(other)
+
+        data = self.sync()
+
+        self.assertTrue(data['full'])
+        self.assertEqual([r['id'] for r in data['recipe']], [recipe.id])
+        self.assertEqual([t['id'] for t in data['tag']], [tag.id])
+
+    @override_settings(SYNC_CURSOR_OVERLAP=0)
+    def test_delta_sync_returns_changes_only(self):
+        """rows untouched since the cursor are not sent again"""
+        unchanged = sample_recipe(self.user, title='Old')
+        changed = sample_recipe(self.user, title='Changed')
+        deleted = sample_recipe(self.user, title='Deleted')
+        ingredient = Ingredient.objects.create(user=self.user, name='Salt')
+        cursor = self.sync()['cursor']
+
+        changed.title = 'Changed again'
+        changed.save()
+        deleted.soft_delete()
+        ingredient_id = ingredient.id
+        ingredient.delete()
+        created = Tag.objects.create(user=self.user, name='New')
+        data = self.sync(cursor)
+
+        self.assertFalse(data['full'])
+        self.assertEqual([r['id'] for r in data['recipe']], [changed.id])
+        self.assertNotIn(unchanged.id, [r['id'] for r in data['recipe']])
+        self.assertEqual([t['id'] for t in data['tag']], [created.id])
+        self.assertEqual(data['deleted']['recipe'], [deleted.id])
+        self.assertEqual(data['deleted']['ingredient'], [ingredient_id])
+
+        data = self.sync(data['cursor'])
+        self.assertEqual(data['recipe'], [])
+        self.assertEqual(data['deleted']['recipe'], [])
+
+    def test_batch_edit_marks_recipes_changed(self):
+        """set based batch edits are picked up by delta sync"""
+        recipe = sample_recipe(self.user)
+        cursor = self.sync()['cursor']
+
+        self.client.post(
+            reverse('recipe:recipe-batch-edit'),
+            {'ids': [recipe.id], 'time_minutes': 45},
+            format='json'
+        )
+        data = self.sync(cursor)
+
+        self.assertEqual(data['recipe'][0]['time_minutes'], 45)
+
+    def test_expired_cursor_forces_full_sync(self):
+        """cursors older than the kept tombstones get a full sync"""
+        sample_recipe(self.user)
+        old = sync.encode_cursor(
+            timezone.now() - sync.TOMBSTONE_TTL - timedelta(days=1)
+        )
+
+        data = self.sync(old)
+
+        self.assertTrue(data['full'])
+        self.assertEqual(len(data['recipe']), 1)
+
+    def test_invalid_cursor(self):
+        res = self.client.get(SYNC_URL, {'since': 'nope'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_out_of_range_cursor(self):
+        for cursor in ('99999999999999999999', '-99999999999999999999'):
+            res = self.client.get(SYNC_URL, {'since': cursor})
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(SYNC_CURSOR_OVERLAP=30)
+    def test_cursor_overlaps_late_commits(self):
+        """a row stamped just before the cursor is sent again"""
+        recipe = sample_recipe(self.user)
+        cursor = self.sync()['cursor']
+
+        data = self.sync(cursor)
+
+        self.assertIn(recipe.id, [r['id'] for r in data['recipe']])
+
+    def test_prune_tombstones(self):
+        """old tombstones are removed by the purge"""
+        sample_recipe(self.user).soft_delete()
+        later = timezone.now() + sync.TOMBSTONE_TTL + timedelta(days=1)
+
+        with patch('core.sync.timezone.now', return_value=later):
+            self.assertEqual(sync.prune_tombstones(), 1)
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.urls import reverse
 from django.test import TestCase
@@ -25,6 +26,7 @@ class PublicTagApiTest(TestCase):
 
 class PrivateTagsApiTest(TestCase):
     """Test the authorized user tag api"""
+    databases = set(settings.SHARDS)
 
     def setUp(self):
         self.user = get_user_model().objects.create_user(
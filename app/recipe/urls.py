@@ -12,5 +12,9 @@ router.register('recipe', views.RecipeViewSet)
 app_name = 'recipe'
 
 urlpatterns = [
+    path('stats/', views.RecipeStatsView.as_view(), name='stats'),
+    path('sync/', views.RecipeSyncView.as_view(), name='sync'),
+    path('shopping-list/', views.ShoppingListView.as_view(),
+         name='shopping-list'),
     path('', include(router.urls))
 ]
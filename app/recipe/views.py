@@ -1,24 +1,148 @@
+import json
+import zlib
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.db.models import Count, Max, Subquery
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from rest_framework import viewsets, mixins, status
-from rest_framework.authentication import TokenAuthentication
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.views import APIView
+
+from core import events, sharding, stats, sync, tasks
+from core.authentication import ExpiringTokenAuthentication
+from core.idempotency import idempotent
+from core.models import Tag, Ingredient, Recipe, RecipeStat, Tombstone, \
+    price_to_cents
+from core.sharding import ShardedViewMixin
+from recipe import autocomplete, serializers, shopping, similarity
+
+
+def _pair_counts(through, field, recipe_ids, related_ids):
+    """number of existing through rows per related id"""
+    return dict(
+        through.objects.filter(
+            recipe_id__in=recipe_ids, **{f'{field}__in': related_ids}
+        ).order_by().values_list(field).annotate(n=Count('pk'))
+    )
+
+
+def _add_related(through, field, recipe_ids, related_ids, created=False):
+    """bulk insert through rows, skipping pairs that already exist
+
+    Returns the number of rows inserted per related id, ``created``
+    recipes have no rows to look up.
+    """
+    existing = {} if created else _pair_counts(
+        through, field, recipe_ids, related_ids
+    )
+    through.objects.bulk_create(
+        [
+            through(**{'recipe_id': recipe_id, field: related_id})
+            for recipe_id in recipe_ids
+            for related_id in related_ids
+        ],
+        ignore_conflicts=True
+    )
+    return {
+        related_id: len(recipe_ids) - existing.get(related_id, 0)
+        for related_id in related_ids
+    }
+
+
+def _latest(queryset, field):
+    """scalar subquery of the newest ``field`` of ``queryset``"""
+    return Subquery(
+        queryset.order_by().values('user_id')
+        .annotate(latest=Max(field)).values('latest')
+    )
+
+
+def _remove_related(through, field, recipe_ids, related_ids):
+    """delete through rows with a single set based DELETE
 
-from core.models import Tag, Ingredient, Recipe
-from recipe import serializers
+    Returns the number of rows deleted per related id.
+    """
+    existing = _pair_counts(through, field, recipe_ids, related_ids)
+    through.objects.filter(
+        recipe_id__in=recipe_ids,
+        **{f'{field}__in': related_ids}
+    ).delete()
+    return existing
 
 
-class BaseRecipeAttributeViewSet(viewsets.GenericViewSet,
+RANGE_FILTERS = (
+    ('min_time', 'time_minutes__gte', int),
+    ('max_time', 'time_minutes__lte', int),
+    ('price_gte', 'price_cents__gte', price_to_cents),
+    ('price_lt', 'price_cents__lt', price_to_cents),
+)
+
+# most recipes fetched at once with ?ids=
+MULTI_GET_LIMIT = 50
+
+# default and largest number of ?prefix= autocomplete results
+AUTOCOMPLETE_LIMIT = 10
+AUTOCOMPLETE_MAX_LIMIT = 50
+
+# default and largest number of similar recipes
+SIMILAR_LIMIT = 10
+SIMILAR_MAX_LIMIT = 50
+
+# model columns read by each field of the recipe serializers, the
+# related fields are prefetched instead
+RECIPE_COLUMNS = {
+    'id': ('id',),
+    'title': ('title',),
+    'time_minutes': ('time_minutes',),
+    'price': ('price_cents',),
+    'link': ('link',),
+}
+RECIPE_RELATED = ('tag', 'ingredient')
+
+# shopping lists of larger plans are streamed as they are read
+SHOPPING_LIST_STREAM_AFTER = 100
+
+
+class BaseRecipeAttributeViewSet(ShardedViewMixin,
+                                 viewsets.GenericViewSet,
                                  mixins.ListModelMixin,
                                  mixins.CreateModelMixin):
     """Common code for permission,authentication and and saving"""
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (ExpiringTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
 
     def get_queryset(self):
         """return objects for current authenticated user"""
         return self.queryset.filter(user=self.request.user).order_by('-name')
 
+    def list(self, request, *args, **kwargs):
+        """list objects, or the first names starting with ?prefix="""
+        prefix = request.query_params.get('prefix')
+        if prefix is None:
+            return super().list(request, *args, **kwargs)
+
+        try:
+            limit = min(
+                int(request.query_params.get('limit', AUTOCOMPLETE_LIMIT)),
+                AUTOCOMPLETE_MAX_LIMIT
+            )
+        except ValueError:
+            raise ValidationError({'limit': ['Enter a whole number.']})
+        rows = autocomplete.search(
+            self.queryset.model, request.user, prefix, max(limit, 0)
+        )
+        return Response([{'id': pk, 'name': name} for pk, name in rows])
+
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        return super().create(request, *args, **kwargs)
+
     def perform_create(self, serializer):
         """create new ingredient"""
         serializer.save(user=self.request.user)
@@ -36,33 +160,211 @@ class IngredientViewSet(BaseRecipeAttributeViewSet):
     serializer_class = serializers.IngredientSerializer
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(ShardedViewMixin, viewsets.ModelViewSet):
     """Manage recipe in database"""
     serializer_class = serializers.RecipeSerializer
     queryset = Recipe.objects.all()
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (ExpiringTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
+    throttle_scope = 'recipe'
 
     def get_queryset(self):
         """Retrive recipe for the authenticated users"""
-        return self.queryset.filter(user=self.request.user)
+        queryset = self.queryset.filter(user=self.request.user)
+        if self.action in ('list', 'retrieve'):
+            # load only the columns and relations that get serialized,
+            # price is read from price_cents without building Decimals
+            fields, _ = self._sparse_fieldsets()
+            wanted = fields or set(RECIPE_COLUMNS) | set(RECIPE_RELATED)
+            columns = {'id', 'updated_at'}
+            for name in wanted.intersection(RECIPE_COLUMNS):
+                columns.update(RECIPE_COLUMNS[name])
+            queryset = queryset.only(*columns).prefetch_related(
+                *[name for name in RECIPE_RELATED if name in wanted]
+            )
+        if self.action == 'list':
+            queryset = self._filter_ranges(queryset)
+        return queryset.order_by('-id')
+
+    def _sparse_fieldsets(self):
+        """fields asked for with ?fields= (None for all) and ?expand="""
+        if hasattr(self, '_fieldsets'):
+            return self._fieldsets
+        params = self.request.query_params
+        errors = {}
+        parsed = {}
+        allowed = {
+            'fields': set(RECIPE_COLUMNS) | set(RECIPE_RELATED),
+            'expand': set(RECIPE_RELATED),
+        }
+        for param, names in allowed.items():
+            value = params.get(param)
+            if value is None:
+                parsed[param] = None
+                continue
+            requested = {name for name in value.split(',') if name}
+            unknown = requested - names
+            if unknown:
+                errors[param] = [
+                    f'Unknown fields: {", ".join(sorted(unknown))}.'
+                ]
+            parsed[param] = requested
+        if errors:
+            raise ValidationError(errors)
+
+        fields, expand = parsed['fields'], parsed['expand'] or set()
+        if fields is not None:
+            # expanding a field asks for it
+            fields |= expand
+        self._fieldsets = (fields, expand)
+        return self._fieldsets
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.action in ('list', 'retrieve'):
+            context['fields'], context['expand'] = self._sparse_fieldsets()
+        return context
+
+    def _filter_ranges(self, queryset):
+        """apply ?min_time=, ?max_time=, ?price_gte= and ?price_lt="""
+        params = self.request.query_params
+        errors = {}
+        for param, lookup, parse in RANGE_FILTERS:
+            value = params.get(param)
+            if value is None:
+                continue
+            try:
+                queryset = queryset.filter(**{lookup: parse(value)})
+            except (ValueError, ArithmeticError):
+                errors[param] = ['Enter a valid number.']
+        if errors:
+            raise ValidationError(errors)
+        return queryset
 
     def get_serializer_class(self):
         """Return appropriate serializer class"""
-        if self.action == 'retrieve':
+        if self.action in ('retrieve', 'clone'):
+            return serializers.RecipeDetailSerializer
+        elif self.action == 'list' and 'ids' in self.request.query_params:
             return serializers.RecipeDetailSerializer
         elif self.action == 'upload_image':
             return serializers.RecipeImageSerializer
+        elif self.action == 'batch_edit':
+            return serializers.RecipeBatchEditSerializer
 
         return self.serializer_class
 
+    def _conditional(self, request, etag, last_modified, render):
+        """answer 304 from the validators, or render and attach them"""
+        last_modified = last_modified and int(last_modified.timestamp())
+        response = get_conditional_response(
+            request, etag=quote_etag(etag), last_modified=last_modified
+        )
+        if response is not None:
+            return response
+        response = render()
+        response['ETag'] = quote_etag(etag)
+        if last_modified:
+            response['Last-Modified'] = http_date(last_modified)
+        return response
+
+    def retrieve(self, request, *args, **kwargs):
+        """recipe detail supporting If-None-Match/If-Modified-Since"""
+        recipe = self.get_object()
+        fields, _ = self._sparse_fieldsets()
+        # rows not backfilled yet have no updated_at
+        last_modified = max(filter(None, [recipe.updated_at] + [
+            related.updated_at
+            for name in RECIPE_RELATED if fields is None or name in fields
+            for related in getattr(recipe, name).all()
+        ]), default=None)
+        etag = f'{recipe.id}-{last_modified and last_modified.timestamp()}'
+        if request.META.get('QUERY_STRING'):
+            # ?fields= and ?expand= change the representation
+            etag += f'-{zlib.crc32(request.get_full_path().encode())}'
+        return self._conditional(
+            request, etag, last_modified,
+            lambda: Response(self.get_serializer(recipe).data)
+        )
+
+    def list(self, request, *args, **kwargs):
+        """list recipes, or fetch the details of ?ids=1,2,3 in that order"""
+        if 'ids' not in request.query_params:
+            # validated with one aggregate, before any row is serialized.
+            # Renamed or deleted tags and ingredients change the listed
+            # recipes without touching them, their newest change and the
+            # newest tombstone are part of the validators too
+            queryset = self.filter_queryset(self.get_queryset())
+            user = request.user
+            state = queryset.order_by().aggregate(
+                count=Count('id'), last_modified=Max('updated_at'),
+                tag=Max(_latest(Tag.objects.filter(user=user), 'updated_at')),
+                ingredient=Max(_latest(
+                    Ingredient.objects.filter(user=user), 'updated_at'
+                )),
+                deleted=Max(_latest(
+                    Tombstone.objects.filter(user=user), 'deleted_at'
+                )),
+            )
+            changes = [
+                state[name] for name in
+                ('last_modified', 'tag', 'ingredient', 'deleted')
+            ]
+            last_modified = max(filter(None, changes), default=None)
+            etag = '{}-{}-{}-{}'.format(
+                user.id, state['count'],
+                '-'.join(
+                    str(change and change.timestamp()) for change in changes
+                ),
+                zlib.crc32(request.get_full_path().encode())
+            )
+            return self._conditional(
+                request, etag, last_modified,
+                lambda: super(RecipeViewSet, self).list(
+                    request, *args, **kwargs
+                )
+            )
+
+        try:
+            ids = [
+                int(value) for value in
+                request.query_params['ids'].split(',') if value
+            ]
+        except ValueError:
+            raise ValidationError({'ids': ['Enter a list of integers.']})
+        ids = list(dict.fromkeys(ids))
+        if len(ids) > MULTI_GET_LIMIT:
+            raise ValidationError(
+                {'ids': [f'At most {MULTI_GET_LIMIT} ids are allowed.']}
+            )
+
+        recipes = {
+            recipe.id: recipe
+            for recipe in self.get_queryset().filter(id__in=ids)
+        }
+        ordered = [recipes[pk] for pk in ids if pk in recipes]
+        return Response(self.get_serializer(ordered, many=True).data)
+
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        return super().create(request, *args, **kwargs)
+
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
+    def perform_destroy(self, instance):
+        """soft delete, the purge task removes the row and image later"""
+        instance.soft_delete()
+        tasks.purge_recipe.delay(
+            instance.id, instance.user_id, countdown=settings.PURGE_DELAY
+        )
+
     @action(methods=['POST'], detail=True, url_path='upload-image')
+    @idempotent
     def upload_image(self, request, pk=None):
         """upload a image to recipe"""
         recipe = self.get_object()
+        old_image = recipe.image.name
         serializer = self.get_serializer(
             recipe,
             data=request.data
@@ -70,6 +372,8 @@ class RecipeViewSet(viewsets.ModelViewSet):
 
         if serializer.is_valid():
             serializer.save()
+            if old_image and old_image != recipe.image.name:
+                tasks.delete_file.delay(old_image)
             return Response(
                 serializer.data,
                 status=status.HTTP_200_OK
@@ -78,3 +382,202 @@ class RecipeViewSet(viewsets.ModelViewSet):
             serializer.errors,
             status=status.HTTP_400_BAD_REQUEST
         )
+
+    @action(methods=['POST'], detail=True)
+    def clone(self, request, pk=None):
+        """copy a recipe together with its tags and ingredients"""
+        recipe = self.get_object()
+        tag_through = Recipe.tag.through
+        ingredient_through = Recipe.ingredient.through
+        tag_ids = list(
+            tag_through.objects.filter(recipe_id=recipe.id)
+            .values_list('tag_id', flat=True)
+        )
+        ingredient_ids = list(
+            ingredient_through.objects.filter(recipe_id=recipe.id)
+            .values_list('ingredient_id', flat=True)
+        )
+
+        with sharding.atomic():
+            recipe.pk = None
+            # the image file is not shared, deleting it would break the copy
+            recipe.image = None
+            recipe.save()
+            _add_related(
+                tag_through, 'tag_id', [recipe.id], tag_ids, created=True
+            )
+            _add_related(
+                ingredient_through, 'ingredient_id',
+                [recipe.id], ingredient_ids, created=True
+            )
+            stats.record_related(recipe.user_id, {
+                RecipeStat.TAG: tag_ids,
+                RecipeStat.INGREDIENT: ingredient_ids,
+            })
+
+        serializer = self.get_serializer(recipe)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    @action(methods=['POST'], detail=False, url_path='batch-edit')
+    def batch_edit(self, request):
+        """apply the same edit to many recipes with set based queries"""
+        serializer = self.get_serializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(
+                serializer.errors,
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        data = serializer.validated_data
+        fields = {
+            key: data[key] for key in ('price', 'time_minutes')
+            if key in data
+        }
+        if 'price' in fields:
+            fields['price_cents'] = price_to_cents(fields['price'])
+        # update() skips auto_now, bump it for delta sync clients
+        fields['updated_at'] = timezone.now()
+        related = (
+            ('add_tag', Recipe.tag.through, 'tag_id', RecipeStat.TAG, 1),
+            ('remove_tag', Recipe.tag.through, 'tag_id', RecipeStat.TAG,
+             -1),
+            ('add_ingredient', Recipe.ingredient.through, 'ingredient_id',
+             RecipeStat.INGREDIENT, 1),
+            ('remove_ingredient', Recipe.ingredient.through,
+             'ingredient_id', RecipeStat.INGREDIENT, -1),
+        )
+
+        # the set based writes bypass the stats signals, the counters are
+        # updated in the same transaction while the recipes are locked
+        with sharding.atomic():
+            rows = list(
+                self.get_queryset().filter(id__in=data['ids'])
+                .select_for_update()
+                .values_list('id', 'price', 'time_minutes')
+            )
+            recipe_ids = [recipe_id for recipe_id, _, _ in rows]
+            Recipe.objects.filter(id__in=recipe_ids).update(**fields)
+            stats.record_recipes(request.user.id, [
+                ((price, minutes), (
+                    data.get('price', price),
+                    data.get('time_minutes', minutes)
+                ))
+                for _, price, minutes in rows
+            ])
+            counts = {}
+            for name, through, field, kind, sign in related:
+                if not data.get(name):
+                    continue
+                write = _add_related if sign > 0 else _remove_related
+                changed = write(through, field, recipe_ids, data[name])
+                for key, amount in changed.items():
+                    pair = (kind, key)
+                    counts[pair] = counts.get(pair, 0) + sign * amount
+            stats.record_counts(request.user.id, counts)
+        similarity.invalidate(request.user.id)
+        events.publish_changes(
+            request.user.id, 'recipe', recipe_ids, using=sharding.current()
+        )
+
+        return Response({'ids': recipe_ids}, status=status.HTTP_200_OK)
+
+    @action(methods=['GET'], detail=True)
+    def similar(self, request, pk=None):
+        """other recipes ranked by tag and ingredient overlap"""
+        recipe = self.get_object()
+        params = request.query_params
+        metric = params.get('metric', 'jaccard')
+        if metric not in similarity.METRICS:
+            raise ValidationError(
+                {'metric': [f'Choose one of {", ".join(similarity.METRICS)}.']}
+            )
+        try:
+            limit = min(int(params.get('limit', SIMILAR_LIMIT)),
+                        SIMILAR_MAX_LIMIT)
+        except ValueError:
+            raise ValidationError({'limit': ['Enter a whole number.']})
+
+        ranked = similarity.similar(
+            request.user, recipe.id, metric, max(limit, 0)
+        )
+        recipes = self.get_queryset().prefetch_related('tag', 'ingredient') \
+            .in_bulk([pk for pk, _ in ranked])
+        data = []
+        for pk, score in ranked:
+            if pk in recipes:
+                item = self.get_serializer(recipes[pk]).data
+                item['similarity'] = round(score, 4)
+                data.append(item)
+        return Response(data)
+
+
+class RecipeStatsView(ShardedViewMixin, APIView):
+    """Aggregate statistics over the recipes of the authenticated user"""
+    authentication_classes = (ExpiringTokenAuthentication,)
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request):
+        return Response(stats.user_stats(request.user))
+
+
+class RecipeSyncView(ShardedViewMixin, APIView):
+    """Recipes, tags and ingredients changed since the client's cursor"""
+    authentication_classes = (ExpiringTokenAuthentication,)
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request):
+        # taken before reading so rows changed meanwhile come next time
+        cursor = sync.next_cursor()
+        since = request.query_params.get('since')
+        try:
+            since = sync.decode_cursor(since) if since else None
+        except sync.InvalidCursor:
+            return Response(
+                {'since': ['Invalid sync cursor.']},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        querysets, deleted, full = sync.changes(request.user, since)
+        recipes = querysets['recipe'].prefetch_related('tag', 'ingredient')
+        return Response({
+            'cursor': cursor,
+            'full': full,
+            'recipe': serializers.RecipeSerializer(recipes, many=True).data,
+            'tag': serializers.TagSerializer(
+                querysets['tag'], many=True
+            ).data,
+            'ingredient': serializers.IngredientSerializer(
+                querysets['ingredient'], many=True
+            ).data,
+            'deleted': deleted,
+        })
+
+
+class ShoppingListView(ShardedViewMixin, APIView):
+    """Ingredients needed for a set of recipes with their counts"""
+    authentication_classes = (ExpiringTokenAuthentication,)
+    permission_classes = (IsAuthenticated,)
+
+    def post(self, request):
+        serializer = serializers.ShoppingListSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(
+                serializer.errors,
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        ids = serializer.validated_data['ids']
+        items = shopping.items(request.user, ids)
+        if len(ids) <= SHOPPING_LIST_STREAM_AFTER:
+            return Response(list(items))
+        return StreamingHttpResponse(
+            self._stream(items), content_type='application/json'
+        )
+
+    @staticmethod
+    def _stream(items):
+        """a JSON array written one ingredient at a time"""
+        yield '['
+        for index, item in enumerate(items):
+            yield (',' if index else '') + json.dumps(item)
+        yield ']'
@@ -33,6 +33,9 @@ class AuthTokenSerializer(serializers.Serializer):
         style={'input_type': 'password'},
         trim_whitespace=False
     )
+    device = serializers.CharField(
+        max_length=64, required=False, allow_blank=True
+    )
 
     def validate(self, attrs):
         """validate and authenticate the user"""
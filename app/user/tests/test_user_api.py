@@ -2,9 +2,15 @@ from django.test import TestCase
 from django.contrib.auth import get_user_model
 from django.urls import reverse
 
-from rest_framework.test import APIClient
+from rest_framework.parsers import FormParser, MultiPartParser
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
 from rest_framework import status
 
+from core import idempotency
+from core.models import AuthToken
+from core.testing import QueryBudgetMixin
+
 CREATE_USER_URL = reverse('user:create')
 TOKEN_URL = reverse('user:token')
 ME_URL = reverse('user:me')
@@ -33,6 +39,58 @@ class PublicUserApiTests(TestCase):
         self.assertTrue(user.check_password(payload['password']))
         self.assertNotIn('password', res.data)
 
+    def test_create_user_idempotent_retry(self):
+        """a retried signup replays the response instead of failing"""
+        payload = {
+            'email': 'manishmishra650@gmail.com',
+            'password': 'testpass',
+            'name': 'Test Name'
+        }
+        first = self.client.post(
+            CREATE_USER_URL, payload, HTTP_IDEMPOTENCY_KEY='signup'
+        )
+        retry = self.client.post(
+            CREATE_USER_URL, payload, HTTP_IDEMPOTENCY_KEY='signup'
+        )
+
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.data, first.data)
+
+    def test_anonymous_keys_not_shared_between_clients(self):
+        """another signup reusing a key is not given the first response"""
+        first = {
+            'email': 'first@gmail.com', 'password': 'testpass',
+            'name': 'First'
+        }
+        other = {
+            'email': 'other@gmail.com', 'password': 'otherpass',
+            'name': 'Other'
+        }
+
+        self.client.post(CREATE_USER_URL, first, HTTP_IDEMPOTENCY_KEY='k')
+        res = self.client.post(
+            CREATE_USER_URL, other, HTTP_IDEMPOTENCY_KEY='k'
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(res.data['email'], other['email'])
+        self.assertNotIn('Idempotent-Replayed', res)
+
+    def test_idempotency_fingerprint_is_keyed(self):
+        """the fingerprint of a signup depends on the secret key"""
+        payload = {'email': 'first@gmail.com', 'password': 'testpass'}
+        request = Request(
+            APIRequestFactory().post(CREATE_USER_URL, payload),
+            parsers=[FormParser(), MultiPartParser()]
+        )
+
+        keyed = idempotency.request_hash(request)
+        with self.settings(SECRET_KEY='another secret'):
+            other = idempotency.request_hash(request)
+
+        self.assertEqual(keyed, idempotency.request_hash(request))
+        self.assertNotEqual(keyed, other)
+
     def test_user_exists(self):
         """User creation fail to test user alredy exits"""
         payload = {
@@ -66,8 +124,25 @@ class PublicUserApiTests(TestCase):
         create_user(**payload)
         res = self.client.post(TOKEN_URL, payload)
         self.assertIn('token', res.data)
+        self.assertIn('expires', res.data)
         self.assertEqual(res.status_code, status.HTTP_200_OK)
 
+    def test_token_per_device(self):
+        """each device gets its own token, a new login rotates it"""
+        payload = {
+            'email': 'manishmishra650@gmail.com',
+            'password': 'testpass'
+        }
+        user = create_user(**payload)
+
+        phone = self.client.post(TOKEN_URL, {**payload, 'device': 'phone'})
+        laptop = self.client.post(TOKEN_URL, {**payload, 'device': 'laptop'})
+        again = self.client.post(TOKEN_URL, {**payload, 'device': 'phone'})
+
+        keys = set(user.auth_tokens.values_list('key', flat=True))
+        self.assertEqual(keys, {laptop.data['token'], again.data['token']})
+        self.assertNotEqual(phone.data['token'], again.data['token'])
+
     def test_create_token_invalid_credential(self):
         """Token is not created if credential is invalid"""
         create_user(email='manishmishra650@gmail.com', password='testpass')
@@ -106,7 +181,7 @@ class PublicUserApiTests(TestCase):
         self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
 
 
-class PrivateUserApiTets(TestCase):
+class PrivateUserApiTets(QueryBudgetMixin, TestCase):
     """Test api that required authentication"""
 
     def setUp(self):
@@ -121,7 +196,8 @@ class PrivateUserApiTets(TestCase):
 
     def test_retrieve_profile_success(self):
         """test for retriving the profile for login user"""
-        res = self.client.get(ME_URL)
+        with self.assertWithinBudget('user:me'):
+            res = self.client.get(ME_URL)
 
         self.assertEqual(res.status_code, status.HTTP_200_OK)
 
@@ -142,3 +218,23 @@ class PrivateUserApiTets(TestCase):
         self.assertEqual(self.user.name, payload['name'])
         self.assertTrue(self.user.check_password(payload['password']))
         self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_delete_user_soft_deletes(self):
+        """deleting the profile deactivates the user and drops its token"""
+        AuthToken.issue(self.user)
+
+        res = self.client.delete(ME_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.is_active)
+        self.assertIsNotNone(self.user.deleted_at)
+        self.assertFalse(AuthToken.objects.filter(user=self.user).exists())
+
+    def test_retrieve_profile_conditional_get(self):
+        """an unchanged profile is answered with 304"""
+        etag = self.client.get(ME_URL)['ETag']
+
+        res = self.client.get(ME_URL, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
@@ -1,26 +1,55 @@
-from rest_framework import generics, authentication, permissions
+from django.conf import settings
+from rest_framework import generics, permissions
 from rest_framework.authtoken.views import ObtainAuthToken
+from rest_framework.response import Response
 from rest_framework.settings import api_settings
 
+from core import tasks
+from core.authentication import ExpiringTokenAuthentication
+from core.idempotency import idempotent
+from core.models import AuthToken
 from user.serializers import UserSerializers, AuthTokenSerializer
 
 
 class CreateUserView(generics.CreateAPIView):
     """create a new user in the system"""
     serializer_class = UserSerializers
+    throttle_scope = 'user.create'
+
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        return super().create(request, *args, **kwargs)
 
 
 class CreateTokenView(ObtainAuthToken):
     """create auth token view for user"""
     serializer_class = AuthTokenSerializer
     renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES
-
-
-class ManageUserView(generics.RetrieveUpdateAPIView):
+    throttle_scope = 'user.token'
+
+    def post(self, request, *args, **kwargs):
+        """issue a new expiring token, one per device"""
+        serializer = self.serializer_class(
+            data=request.data, context={'request': request}
+        )
+        serializer.is_valid(raise_exception=True)
+        token = AuthToken.issue(
+            serializer.validated_data['user'],
+            serializer.validated_data.get('device', '')
+        )
+        return Response({'token': token.key, 'expires': token.expires})
+
+
+class ManageUserView(generics.RetrieveUpdateDestroyAPIView):
     """Manage authenticated user"""
     serializer_class = UserSerializers
-    authentication_classes = (authentication.TokenAuthentication,)
+    authentication_classes = (ExpiringTokenAuthentication,)
     permission_classes = (permissions.IsAuthenticated,)
 
     def get_object(self):
         return self.request.user
+
+    def perform_destroy(self, instance):
+        """soft delete, the purge task removes the user data later"""
+        instance.soft_delete()
+        tasks.purge_user.delay(instance.id, countdown=settings.PURGE_DELAY)